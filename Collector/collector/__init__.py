@@ -0,0 +1,3 @@
+"""
+    Asyncio collector of battery level notifications from a fleet of peripherals
+"""
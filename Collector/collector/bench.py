@@ -0,0 +1,42 @@
+"""
+    Collector throughput benchmark on the fake transport
+
+        python3 -m collector.bench [peripherals] [rate_hz] [duration_s]
+"""
+import asyncio
+import sys
+import time
+from collector.collector import FleetCollector
+from collector.store import TimeSeriesStore
+from collector.transport import FakeTransport
+
+
+async def _run(peripherals, rate_hz, duration_s, batch_size):
+    transport = FakeTransport()
+    addresses = ['AA:BB:CC:%02X:%02X:%02X' % (i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF) for i in range(peripherals)]
+    for address in addresses:
+        transport.add_peripheral(address)
+    collector = FleetCollector(transport, TimeSeriesStore(), batch_size=batch_size)
+    await collector.start(addresses)
+    start = time.perf_counter()
+    sent = await transport.run(rate_hz, duration_s)
+    await collector.stop()
+    elapsed = time.perf_counter() - start
+    return {
+        'peripherals': peripherals,
+        'sent': sent,
+        'stored': len(collector.store),
+        'batches': collector.store.batches,
+        'elapsed_s': round(elapsed, 3),
+        'notifications_per_s': int(len(collector.store) / elapsed),
+    }
+
+
+def run(peripherals=100, rate_hz=50, duration_s=2, batch_size=1000):
+    return asyncio.run(_run(peripherals, rate_hz, duration_s, batch_size))
+
+
+if __name__ == '__main__':
+    report = run(*[int(a) for a in sys.argv[1:4]])
+    for key in sorted(report):
+        print('%s: %s' % (key, report[key]))
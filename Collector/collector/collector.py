@@ -0,0 +1,85 @@
+"""
+    Fleet collector: subscribes to the battery level of many peripherals concurrently and batches the readings
+"""
+import asyncio
+import time
+from collector.transport import BATTERY_SERVICE_UUID, BATTERY_LEVEL_UUID
+
+
+class FleetCollector:
+
+    def __init__(self, transport, store, batch_size=1000, flush_interval_s=0.1, clock=time.time):
+        self.transport = transport
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._clock = clock
+        self._pending = []
+        self._flusher = None
+        self._batch_ready = None
+        self.subscribed = set()
+        self.failed = {}
+        self.received = 0
+        self.invalid = 0
+
+    async def start(self, addresses):
+        """Connects and subscribes to all the peripherals concurrently. Failures are kept in `failed`"""
+        self._batch_ready = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        results = await asyncio.gather(*[self._subscribe(address) for address in addresses], return_exceptions=True)
+        for address, result in zip(addresses, results):
+            if isinstance(result, Exception):
+                self.failed[address] = result
+            else:
+                self.subscribed.add(address)
+
+    async def stop(self):
+        await asyncio.gather(*[self.transport.disconnect(address) for address in self.subscribed],
+                             return_exceptions=True)
+        self.subscribed.clear()
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        self.flush()
+
+    def flush(self, full_only=False):
+        """Stores the pending readings in batches of at most batch_size. If full_only, the last partial batch is
+        kept pending"""
+        while len(self._pending) >= self.batch_size:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            self.store.append_batch(batch)
+        if self._pending and not full_only:
+            batch, self._pending = self._pending, []
+            self.store.append_batch(batch)
+
+    def latest(self, address):
+        return self.store.latest(address)
+
+    def on_notification(self, address, data):
+        if len(data) != 1 or data[0] > 100:
+            self.invalid += 1
+            return
+        self.received += 1
+        self._pending.append((self._clock(), address, data[0]))
+        if len(self._pending) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _subscribe(self, address):
+        await self.transport.connect(address)
+        await self.transport.subscribe(address, BATTERY_SERVICE_UUID, BATTERY_LEVEL_UUID, self.on_notification)
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval_s)
+                # woken by a full batch: the readings arriving after it wait for the next one (or the interval)
+                full_only = True
+            except asyncio.TimeoutError:
+                full_only = False
+            self._batch_ready.clear()
+            self.flush(full_only)
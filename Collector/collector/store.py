@@ -0,0 +1,61 @@
+"""
+    Append-only time-series store of battery levels, with an in-memory index of the latest values
+"""
+from array import array
+
+
+class TimeSeriesStore:
+    """Readings are appended in batches to column arrays (and, optionally, to a CSV log file).
+    Nothing is ever updated nor removed; the latest reading per device is kept in a dict"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.timestamps = array('d')
+        self.device_ids = array('I')
+        self.levels = array('B')
+        self.batches = 0
+        self._devices = []
+        self._device_ids = {}
+        self._latest = {}
+
+    def __len__(self):
+        return len(self.levels)
+
+    def append_batch(self, readings):
+        """readings: iterable of (timestamp, address, level)"""
+        lines = [] if self.path is not None else None
+        for timestamp, address, level in readings:
+            device_id = self._device_id(address)
+            self.timestamps.append(timestamp)
+            self.device_ids.append(device_id)
+            self.levels.append(level)
+            self._latest[address] = (timestamp, level)
+            if lines is not None:
+                lines.append('%f,%s,%d\n' % (timestamp, address, level))
+        if lines:
+            with open(self.path, 'a') as log:
+                log.writelines(lines)
+        self.batches += 1
+
+    def latest(self, address):
+        """Returns the latest (timestamp, level) for the device, or None"""
+        return self._latest.get(address)
+
+    def latest_all(self):
+        return dict(self._latest)
+
+    def history(self, address, since=None):
+        """Returns the (timestamp, level) readings of the device, oldest first (full scan)"""
+        device_id = self._device_ids.get(address)
+        if device_id is None:
+            return []
+        return [(self.timestamps[i], self.levels[i]) for i in range(len(self.levels))
+                if self.device_ids[i] == device_id and (since is None or self.timestamps[i] >= since)]
+
+    def _device_id(self, address):
+        device_id = self._device_ids.get(address)
+        if device_id is None:
+            device_id = len(self._devices)
+            self._devices.append(address)
+            self._device_ids[address] = device_id
+        return device_id
@@ -0,0 +1,111 @@
+"""
+    Unit Tests for the collector and transport modules
+"""
+
+import unittest
+from collector.collector import FleetCollector
+from collector.store import TimeSeriesStore
+from collector.transport import FakeTransport
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FleetCollectorTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.store = TimeSeriesStore()
+        self.clock = FakeClock()
+        self.addresses = ['peripheral-%d' % i for i in range(5)]
+        for address in self.addresses:
+            self.transport.add_peripheral(address)
+
+    def _collector(self, **kwargs):
+        return FleetCollector(self.transport, self.store, clock=self.clock, **kwargs)
+
+    async def test_should_subscribe_to_all_peripherals(self):
+        collector = self._collector()
+        await collector.start(self.addresses)
+        self.assertEqual(collector.subscribed, set(self.addresses))
+        await collector.stop()
+        self.assertFalse(self.transport.peripherals['peripheral-0'].connected)
+
+    async def test_should_keep_failed_peripherals(self):
+        collector = self._collector()
+        await collector.start(self.addresses + ['unknown'])
+        self.assertEqual(len(collector.subscribed), 5)
+        self.assertIsInstance(collector.failed['unknown'], ConnectionError)
+        await collector.stop()
+
+    async def test_should_store_notifications_in_batches(self):
+        collector = self._collector(batch_size=1000)
+        await collector.start(self.addresses)
+        self.clock.now = 10.0
+        self.transport.notify('peripheral-1', 42)
+        self.transport.notify('peripheral-2', 43)
+        self.assertEqual(len(self.store), 0)
+        await collector.stop()
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.batches, 1)
+        self.assertEqual(collector.latest('peripheral-1'), (10.0, 42))
+
+    async def test_should_flush_full_batches(self):
+        collector = self._collector(batch_size=10, flush_interval_s=60)
+        await collector.start(self.addresses)
+        for level in range(25):
+            collector.on_notification('peripheral-1', bytes((level,)))
+        collector.flush(full_only=True)
+        self.assertEqual(len(self.store), 20)
+        self.assertEqual(self.store.batches, 2)
+        await collector.stop()
+        self.assertEqual(len(self.store), 25)
+        self.assertEqual(self.store.batches, 3)
+
+    async def test_should_only_store_full_batches_before_the_flush_interval(self):
+        collector = self._collector(batch_size=10, flush_interval_s=60)
+        await collector.start(self.addresses)
+        await self.transport.run(rate_hz=1000, duration_s=0.01)
+        self.assertEqual(len(self.store) % 10, 0)
+        await collector.stop()
+        self.assertEqual(len(self.store), 50)
+
+    async def test_should_flush_periodically(self):
+        collector = self._collector(batch_size=1000, flush_interval_s=0.01)
+        await collector.start(self.addresses)
+        self.transport.notify('peripheral-1', 42)
+        await self.transport.run(rate_hz=100, duration_s=0.05)
+        self.assertTrue(len(self.store) > 0)
+        await collector.stop()
+
+    async def test_should_discard_invalid_notifications(self):
+        collector = self._collector()
+        await collector.start(self.addresses)
+        collector.on_notification('peripheral-1', b'\x65')
+        collector.on_notification('peripheral-1', b'\x01\x02')
+        await collector.stop()
+        self.assertEqual(collector.invalid, 2)
+        self.assertEqual(len(self.store), 0)
+
+
+class FakeTransportTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_should_refuse_unknown_characteristics(self):
+        transport = FakeTransport()
+        transport.add_peripheral('a')
+        await transport.connect('a')
+        with self.assertRaises(ValueError):
+            await transport.subscribe('a', 0x180F, 0x2A1A, print)
+
+    async def test_should_require_connection_to_subscribe(self):
+        transport = FakeTransport()
+        transport.add_peripheral('a')
+        with self.assertRaises(ConnectionError):
+            await transport.subscribe('a', 0x180F, 0x2A19, print)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+    Unit Tests for the store module
+"""
+
+import os
+import tempfile
+import unittest
+from collector.store import TimeSeriesStore
+
+
+class TimeSeriesStoreTestCase(unittest.TestCase):
+    def test_should_append_batches_and_index_latest_values(self):
+        store = TimeSeriesStore()
+        store.append_batch([(1.0, 'a', 50), (1.5, 'b', 70)])
+        store.append_batch([(2.0, 'a', 49)])
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.batches, 2)
+        self.assertEqual(store.latest('a'), (2.0, 49))
+        self.assertEqual(store.latest('b'), (1.5, 70))
+        self.assertIsNone(store.latest('c'))
+        self.assertEqual(store.latest_all(), {'a': (2.0, 49), 'b': (1.5, 70)})
+
+    def test_should_return_device_history(self):
+        store = TimeSeriesStore()
+        store.append_batch([(1.0, 'a', 50), (1.5, 'b', 70), (2.0, 'a', 49)])
+        self.assertEqual(store.history('a'), [(1.0, 50), (2.0, 49)])
+        self.assertEqual(store.history('a', since=1.5), [(2.0, 49)])
+        self.assertEqual(store.history('c'), [])
+
+    def test_should_append_batches_to_log_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'levels.csv')
+            store = TimeSeriesStore(path)
+            store.append_batch([(1.0, 'a', 50)])
+            store.append_batch([(2.0, 'b', 70)])
+            with open(path) as log:
+                self.assertEqual(log.read().splitlines(), ['1.000000,a,50', '2.000000,b,70'])
+
+
+if __name__ == '__main__':
+    unittest.main()
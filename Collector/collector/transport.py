@@ -0,0 +1,89 @@
+"""
+    Transports: how the collector reaches the peripherals
+"""
+import asyncio
+
+BATTERY_SERVICE_UUID = 0x180F
+BATTERY_LEVEL_UUID = 0x2A19
+
+
+class Transport:
+    """Interface to be implemented by the transports (a BLE adapter, a gateway...)
+
+    callback is called as callback(address, data) for every notification received"""
+
+    async def connect(self, address):
+        raise NotImplementedError
+
+    async def subscribe(self, address, service_uuid, characteristic_uuid, callback):
+        raise NotImplementedError
+
+    async def disconnect(self, address):
+        raise NotImplementedError
+
+
+class FakePeripheral:
+    def __init__(self, address, level=100, services=((BATTERY_SERVICE_UUID, (BATTERY_LEVEL_UUID,)),)):
+        self.address = address
+        self.level = level
+        self.services = dict(services)
+        self.connected = False
+        self.callback = None
+        self.notifications = 0
+
+
+class FakeTransport(Transport):
+    """In-process transport, where peripherals are simulated and notify on demand"""
+
+    def __init__(self, connect_latency_s=0):
+        self.connect_latency_s = connect_latency_s
+        self.peripherals = {}
+
+    def add_peripheral(self, address, level=100):
+        self.peripherals[address] = FakePeripheral(address, level)
+        return self.peripherals[address]
+
+    async def connect(self, address):
+        peripheral = self.peripherals.get(address)
+        if peripheral is None:
+            raise ConnectionError('unknown peripheral %s' % address)
+        await asyncio.sleep(self.connect_latency_s)
+        peripheral.connected = True
+
+    async def subscribe(self, address, service_uuid, characteristic_uuid, callback):
+        peripheral = self._connected(address)
+        if characteristic_uuid not in peripheral.services.get(service_uuid, ()):
+            raise ValueError('characteristic 0x%04x not found' % characteristic_uuid)
+        peripheral.callback = callback
+
+    async def disconnect(self, address):
+        peripheral = self._connected(address)
+        peripheral.connected = False
+        peripheral.callback = None
+
+    def notify(self, address, level):
+        peripheral = self.peripherals[address]
+        peripheral.level = level
+        if peripheral.callback is not None:
+            peripheral.notifications += 1
+            peripheral.callback(address, bytes((level,)))
+
+    async def run(self, rate_hz, duration_s, waveform=None):
+        """Every subscribed peripheral notifies rate_hz times per second, during duration_s (loop time)"""
+        loop = asyncio.get_running_loop()
+        period = 1 / rate_hz
+        ticks = int(rate_hz * duration_s)
+        start = loop.time()
+        for tick in range(ticks):
+            for peripheral in self.peripherals.values():
+                level = waveform(peripheral.address, tick) if waveform is not None else tick % 101
+                self.notify(peripheral.address, level)
+            delay = start + (tick + 1) * period - loop.time()
+            await asyncio.sleep(delay if delay > 0 else 0)
+        return ticks * len(self.peripherals)
+
+    def _connected(self, address):
+        peripheral = self.peripherals[address]
+        if not peripheral.connected:
+            raise ConnectionError('peripheral %s not connected' % address)
+        return peripheral
@@ -0,0 +1,3 @@
+"""
+    Benchmarks for the peripheral, running on the simulated BLE stack
+"""
@@ -0,0 +1,57 @@
+"""
+    Per reconnect cost of (re)advertising, rebuilding the payload each time vs. using the cached payload
+
+    From the Peripheral folder:
+
+        micropython -m bench.advertising [cycles]
+        python3 -m bench.advertising [cycles]
+"""
+import sys
+from sim import install
+
+install()
+
+if 'py' not in sys.path:
+    sys.path.append('py')
+
+from time import ticks_us, ticks_diff
+from bluetooth import UUID
+from sim.ble import BLE
+from ble_advertising import advertising_payload
+from ble_service import BatteryService, BATTERY_SERVICE_APPEARANCE, DEVICE_NAME
+
+
+class UncachedBatteryService(BatteryService):
+    """BatteryService as it was before caching: the payload is rebuilt every time advertising restarts"""
+
+    def start(self):
+        self.bt.gap_advertise(interval_us=500000, adv_data=advertising_payload(
+            name=DEVICE_NAME, services=[UUID(0x180F)], appearance=BATTERY_SERVICE_APPEARANCE))
+
+
+def reconnect_cost_us(service_class, cycles):
+    ble = BLE()
+    service = service_class(ble)
+    service.register_services()
+    service.start()
+    start = ticks_us()
+    for _ in range(cycles):
+        ble.disconnect_central(ble.connect_central())
+    return ticks_diff(ticks_us(), start) / cycles
+
+
+def run(cycles=1000):
+    uncached = reconnect_cost_us(UncachedBatteryService, cycles)
+    cached = reconnect_cost_us(BatteryService, cycles)
+    return {
+        'cycles': cycles,
+        'uncached_reconnect_us': uncached,
+        'cached_reconnect_us': cached,
+        'speedup': uncached / cached if cached else 0,
+    }
+
+
+if __name__ == '__main__':
+    report = run(*[int(a) for a in sys.argv[1:2]])
+    for key in sorted(report):
+        print('%s: %s' % (key, report[key]))
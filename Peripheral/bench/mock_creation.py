@@ -0,0 +1,58 @@
+"""
+    Cost of create_mock, introspecting the class and wrapping every method on each call (as it was)
+    vs. the cached spec with wrappers created on first access
+
+    From the Peripheral folder:
+
+        micropython -m bench.mock_creation [mocks] [methods used per mock]
+        python3 -m bench.mock_creation [mocks] [methods used per mock]
+"""
+import sys
+from sim import install
+
+install()
+
+from time import ticks_us, ticks_diff
+from bluetooth import BLE
+from mock.mock import Mock, create_mock
+
+
+def eager_create_mock(cls=None, max_recorded_calls=None):
+    """create_mock as it was before caching the specs (dunder attributes skipped, so it runs on CPython too)"""
+    newMock = Mock(max_recorded_calls)
+    if cls is not None:
+        for attr in dir(cls):
+            if not attr.startswith('__') and callable(getattr(cls, attr)):
+                setattr(newMock, attr, newMock._wrapper(attr))
+    return newMock
+
+
+_METHODS = ('active', 'irq', 'gatts_register_services', 'gatts_write', 'gatts_notify', 'gap_advertise')
+
+
+def cost_us(factory, mocks, methods):
+    """Time (in us) to create a BLE mock and call the given number of its methods, as a test setUp would"""
+    start = ticks_us()
+    for _ in range(mocks):
+        mock = factory(BLE)
+        for name in _METHODS[:methods]:
+            getattr(mock, name)()
+    return ticks_diff(ticks_us(), start) / mocks
+
+
+def run(mocks=2000, methods=3):
+    eager = cost_us(eager_create_mock, mocks, methods)
+    lazy = cost_us(create_mock, mocks, methods)
+    return {
+        'mocks': mocks,
+        'methods_used': methods,
+        'eager_us': eager,
+        'lazy_cached_us': lazy,
+        'speedup': eager / lazy if lazy else 0,
+    }
+
+
+if __name__ == '__main__':
+    report = run(*[int(a) for a in sys.argv[1:3]])
+    for key in sorted(report):
+        print('%s: %s' % (key, report[key]))
@@ -0,0 +1,222 @@
+"""
+    Micro-benchmarks for the peripheral hot paths, on the micropython unix port and on CPython
+
+    Every benchmark reports ops/s and the bytes allocated per op, and the results are compared against
+    the baseline stored for the running runtime in bench/baseline.json. From the Peripheral folder:
+
+        micropython -m bench.suite [--json] [--save] [--baseline path] [--tolerance 0.25] [--centrals 5]
+        python3 -m bench.suite [--json] [--save] [--baseline path] [--tolerance 0.25] [--centrals 5]
+
+    The exit status is 1 when any benchmark regressed beyond the tolerance
+"""
+import gc
+import sys
+import json
+from sim import install
+
+install()
+
+if 'py' not in sys.path:
+    sys.path.append('py')
+
+from time import ticks_us, ticks_diff
+from bluetooth import UUID
+from sim.ble import BLE
+from mock.mock import Mock
+from ble_advertising import advertising_payload, decode_name, decode_services
+from ble_service import BatteryService, BATTERY_SERVICE_APPEARANCE, DEVICE_NAME
+from voltage_reader import VoltageReader
+from sample_filters import MovingAverageFilter
+
+BASELINE_PATH = 'bench/baseline.json'
+DEFAULT_TOLERANCE = 0.25
+_ALLOCATION_SLACK_BYTES = 16
+_MIN_DURATION_US = 200000
+_ALLOCATION_SAMPLES = 20
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def runtime_name():
+    return sys.implementation.name
+
+
+def _ops_per_s(operation):
+    iterations = 1
+    while True:
+        start = ticks_us()
+        for _ in range(iterations):
+            operation()
+        elapsed = ticks_diff(ticks_us(), start)
+        if elapsed >= _MIN_DURATION_US:
+            return iterations * 1000000 // elapsed
+        iterations *= 2
+
+
+def _alloc_bytes_per_op(operation):
+    if tracemalloc is None:
+        # micropython: heap allocated by the ops, with the collector held off meanwhile
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(_ALLOCATION_SAMPLES):
+            operation()
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+        return allocated // _ALLOCATION_SAMPLES
+    # CPython frees most temporaries right away, so the peak of each single op is measured instead
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(_ALLOCATION_SAMPLES):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+    tracemalloc.stop()
+    return allocated // _ALLOCATION_SAMPLES
+
+
+def measure(operation):
+    operation()  # warm up
+    return {'ops_per_s': _ops_per_s(operation), 'alloc_bytes_per_op': _alloc_bytes_per_op(operation)}
+
+
+def _advertising_payload():
+    services = [UUID(0x180F)]
+    return lambda: advertising_payload(name=DEVICE_NAME, services=services, appearance=BATTERY_SERVICE_APPEARANCE)
+
+
+def _decode():
+    payload = advertising_payload(name=DEVICE_NAME, services=[UUID(0x180F)], appearance=BATTERY_SERVICE_APPEARANCE)
+
+    def operation():
+        decode_name(payload)
+        decode_services(payload)
+    return operation
+
+
+def _set_battery_level(centrals):
+    ble = BLE(queue_depth=1)
+    service = BatteryService(ble)
+    service.register_services()
+    for _ in range(centrals):
+        ble.connect_central()
+    levels = [0]
+
+    def operation():
+        levels[0] = (levels[0] + 1) % 101
+        service.set_battery_level_percentage(levels[0])
+    return operation
+
+
+class _SawtoothADC:
+    def __init__(self):
+        self.value = 0
+
+    def read(self):
+        self.value = (self.value + 7) % 4096
+        return self.value
+
+
+def _voltage_reader_refresh():
+    ble = BLE()
+    service = BatteryService(ble)
+    service.register_services()
+    reader = VoltageReader(_SawtoothADC(), 4095, oversampling=4, window=8, sample_filter=MovingAverageFilter())
+    return lambda: reader.refresh(service)
+
+
+def _mock_recording():
+    mock = Mock()
+    mock.gatts_notify = mock._wrapper('gatts_notify')
+    data = b'\x32'
+    return lambda: mock.gatts_notify(0, 1, data)
+
+
+def _mock_assertion():
+    mock = Mock()
+    mock.gatts_notify = mock._wrapper('gatts_notify')
+    for conn_handle in range(1000):
+        mock.gatts_notify(conn_handle, 1, b'\x32')
+    args = (500, 1, b'\x32')
+    return lambda: mock.has_been_called_with('gatts_notify', args)
+
+
+def benchmarks(centrals=5):
+    return (
+        ('advertising_payload', _advertising_payload),
+        ('decode_name_services', _decode),
+        ('set_battery_level_%d_centrals' % centrals, lambda: _set_battery_level(centrals)),
+        ('voltage_reader_refresh', _voltage_reader_refresh),
+        ('mock_recording', _mock_recording),
+        ('mock_assertion', _mock_assertion),
+    )
+
+
+def run(centrals=5):
+    return {name: measure(setup()) for name, setup in benchmarks(centrals)}
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as f:
+            return json.loads(f.read())
+    except OSError:
+        return {}
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    baseline = load_baseline(path)
+    baseline[runtime_name()] = results
+    with open(path, 'w') as f:
+        f.write(json.dumps(baseline))
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns the regressions as (benchmark, metric, baseline value, current value) tuples.
+    ops/s regress below baseline * (1 - tolerance), allocations above baseline * (1 + tolerance) plus some slack"""
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if current['ops_per_s'] < reference['ops_per_s'] * (1 - tolerance):
+            regressions.append((name, 'ops_per_s', reference['ops_per_s'], current['ops_per_s']))
+        if current['alloc_bytes_per_op'] > \
+                reference['alloc_bytes_per_op'] * (1 + tolerance) + _ALLOCATION_SLACK_BYTES:
+            regressions.append((name, 'alloc_bytes_per_op', reference['alloc_bytes_per_op'],
+                                current['alloc_bytes_per_op']))
+    return regressions
+
+
+def _option(args, name, default):
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def main(args):
+    path = _option(args, '--baseline', BASELINE_PATH)
+    tolerance = float(_option(args, '--tolerance', DEFAULT_TOLERANCE))
+    results = run(int(_option(args, '--centrals', 5)))
+    regressions = compare(results, load_baseline(path).get(runtime_name(), {}), tolerance)
+    if '--json' in args:
+        print(json.dumps({'runtime': runtime_name(), 'results': results,
+                          'regressions': [list(r) for r in regressions]}))
+    else:
+        for name in sorted(results):
+            print('%s: %d ops/s, %d bytes/op' % (name, results[name]['ops_per_s'],
+                                                 results[name]['alloc_bytes_per_op']))
+        for name, metric, reference, current in regressions:
+            print('REGRESSION %s %s: %s -> %s' % (name, metric, reference, current))
+    if '--save' in args:
+        save_baseline(results, path)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
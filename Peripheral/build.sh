@@ -0,0 +1,16 @@
+#!/bin/bash
+# Precompiles the modules copied to the board into .mpy files (in build/), so they are not compiled on every boot.
+# main.py stays as source, the board only runs main.py on boot
+MODULES="ble_service ble_advertising voltage_reader sample_filters scheduler ble_scanner gatt notification_policy
+irq_queue instrumentation history batching boot_profile advertising_policy connections"
+
+mkdir -p build
+for m in $MODULES
+do
+  mpy-cross -o build/$m.mpy py/$m.py
+  if [ $? -ne 0 ]; then
+    echo "Failed compiling $m"
+    exit 1
+  fi
+done
+echo "Modules compiled into build/"
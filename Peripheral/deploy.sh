@@ -1,2 +1,3 @@
 #!/bin/bash
+./build.sh || exit 1
 rshell -p /dev/ttyUSB0 -f ./rshell_deploy
@@ -0,0 +1,9 @@
+# Freezes the peripheral modules into a custom firmware build, instead of deploying them as .mpy files.
+# From micropython's ports/esp32 folder:
+#
+#     make FROZEN_MANIFEST=<path to this folder>/manifest.py
+include('$(PORT_DIR)/boards/manifest.py')
+freeze('py', ('ble_service.py', 'ble_advertising.py', 'voltage_reader.py', 'sample_filters.py', 'scheduler.py',
+              'ble_scanner.py', 'gatt.py', 'notification_policy.py', 'irq_queue.py', 'instrumentation.py',
+              'history.py', 'batching.py', 'boot_profile.py', 'advertising_policy.py',
+              'connections.py'))
@@ -2,53 +2,173 @@
     Mocks creating module
 """
 
-class Mock:
+try:
+    from _thread import get_ident, allocate_lock
+except ImportError:
+    get_ident = None
+try:
+    from itertools import count as _count
+except ImportError:
+    _count = None
+
+_KWARGS = object()
+_UNHASHABLE = object()
+
+# class: (callable attributes, Mock subclass mocking them), introspected once per class
+_specs = {}
+
+
+def _snapshot(value):
+    # buffers are copied, as the real stack does, so later changes to them do not alter the recorded calls
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return value
+
+
+def _index_key(parameters):
+    if isinstance(parameters, dict):
+        parameters = (_KWARGS, tuple(sorted(parameters.items())))
+    try:
+        hash(parameters)
+    except TypeError:
+        return _UNHASHABLE
+    return parameters
+
+
+def _spec(cls):
+    spec = _specs.get(cls)
+    if spec is None:
+        methods = set()
+        for attr in dir(cls):
+            if not attr.startswith('__') and callable(getattr(cls, attr)):
+                methods.add(attr)
+        # a subclass per mocked class, as a __getattr__ in Mock would slow down every attribute access of every
+        # mock (CPython does not specialize attribute loads on classes defining it)
+        spec = (methods, type(cls.__name__ + 'Mock', (Mock,), {attr: _LazyWrapper(attr) for attr in methods}))
+        _specs[cls] = spec
+    return spec
+
+
+class _LazyWrapper:
+    """Method of the mocked class: its wrapper is created on first access and kept in the mock, shadowing this
+    (non-data) descriptor from then on"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, mock, owner=None):
+        if mock is None:
+            return self
+        wrapper = mock._wrapper(self.name)
+        setattr(mock, self.name, wrapper)
+        return wrapper
+
+
+class _Sequence:
+    """Global call order for the thread safe recording: itertools.count, atomic under the GIL, when available"""
+
     def __init__(self):
+        if _count is not None:
+            self.next = _count().__next__
+        else:
+            self._lock = allocate_lock()
+            self._value = 0
+            self.next = self._locked_next
+
+    def _locked_next(self):
+        with self._lock:
+            value = self._value
+            self._value += 1
+        return value
+
+
+class Mock:
+    def __init__(self, max_recorded_calls=None, thread_safe=False):
+        """thread_safe: calls from several threads are recorded, each as a single entry, into per thread buffers
+        (no lock shared by the threads), merged in call order on the next assertion. The order is only kept among
+        the calls each merge finds: a call still being recorded meanwhile is merged later, after them"""
+        self._max_recorded_calls = max_recorded_calls
+        self._thread_safe = thread_safe
         self._calls_matching = {}
-        self._actual_calls = []
-        self._actual_parameters = []
+        if max_recorded_calls is None:
+            self._actual_calls = []
+            self._actual_parameters = []
+            self._actual_threads = []
+        else:
+            self._actual_calls = [None] * max_recorded_calls
+            self._actual_parameters = [None] * max_recorded_calls
+            self._actual_threads = [None] * max_recorded_calls
+        if thread_safe:
+            if get_ident is None:
+                raise ValueError('thread safe recording needs the _thread module')
+            self._sequence = _Sequence()
+            self._buffers = {}
+        self._next_position = 0
+        self._recorded = 0
+        self._calls_by_method = {}
+        self._parameters_by_method = {}
+        self._unhashable_parameters_by_method = {}
 
     def when(self, method_name, required_args=None, return_value=None, raise_exception=None):
         if method_name not in self._calls_matching.keys():
-            self._calls_matching[method_name] = {'params': [], 'return_values': [], 'raise_exception': []}
-        self._calls_matching[method_name]['params'].append(required_args)
-        self._calls_matching[method_name]['return_values'].append(return_value)
-        self._calls_matching[method_name]['raise_exception'].append(raise_exception)
+            self._calls_matching[method_name] = {'params': [], 'return_values': [], 'raise_exception': [],
+                                                 'index': {}, 'unhashable': []}
+        stubs = self._calls_matching[method_name]
+        key = _index_key(required_args)
+        if key is _UNHASHABLE:
+            stubs['unhashable'].append(len(stubs['params']))
+        elif key not in stubs['index']:
+            stubs['index'][key] = len(stubs['params'])
+        stubs['params'].append(required_args)
+        stubs['return_values'].append(return_value)
+        stubs['raise_exception'].append(raise_exception)
 
     def has_been_called(self, times=1, method=None):
+        if self._thread_safe:
+            self._merge()
         if method is None:
-            if self._actual_calls and len(self._actual_calls) == times:
+            if self._recorded and self._recorded == times:
                 return True
         else:
-            if self._actual_calls and self._actual_calls.count(method) == times:
+            if self._recorded and self._calls_by_method.get(method, 0) == times:
                 return True
         return False
 
     def has_been_called_with(self, method_name, args, times=None):
-        if self._actual_calls:
-            indices = [i for i, m in enumerate(self._actual_calls) if m == method_name]
-            if indices:
-                found = [self._actual_parameters[j] for j in indices]
-                if args in found:
-                    count = found.count(args)
-                    if times is not None:
-                        return count == times
-                    else:
-                        return True
+        if self._thread_safe:
+            self._merge()
+        count = self._count_calls_with(method_name, args)
+        if count:
+            if times is not None:
+                return count == times
+            else:
+                return True
         return False
 
+    def calls(self):
+        """Returns the recorded calls, oldest first, as (method name, parameters, thread id) tuples.
+        The thread id is only recorded by thread safe mocks, whose order only holds among the calls merged together"""
+        if self._thread_safe:
+            self._merge()
+        if self._max_recorded_calls is None or self._recorded < self._max_recorded_calls:
+            positions = range(self._recorded)
+        else:
+            positions = [(self._next_position + i) % self._max_recorded_calls for i in range(self._recorded)]
+        return [(self._actual_calls[p], self._actual_parameters[p], self._actual_threads[p]) for p in positions]
+
     def reset(self):
-        self.__init__()
+        self.__init__(self._max_recorded_calls, self._thread_safe)
 
     def _wrapper(self, method_name):
+        record = self._record_concurrent if self._thread_safe else self._record
+
         def func(*args, **kwargs):
-            self._actual_calls.append(method_name)
             if args:
-                self._actual_parameters.append(args)
+                record(method_name, tuple(_snapshot(arg) for arg in args))
             elif kwargs:
-                self._actual_parameters.append(kwargs)
+                record(method_name, {key: _snapshot(value) for key, value in kwargs.items()})
             else:
-                self._actual_parameters.append(())
+                record(method_name, ())
             if method_name in self._calls_matching.keys():
                 if args:
                     return self._get_return_value_or_raise_exception(method_name, args)
@@ -59,23 +179,115 @@ class Mock:
             return None
         return func
 
+    def _record_concurrent(self, method_name, parameters):
+        # each call is appended as a single entry to a buffer only its thread appends to
+        thread_id = get_ident()
+        buffer = self._buffers.get(thread_id)
+        if buffer is None:
+            buffer = self._buffers.setdefault(thread_id, [])
+        buffer.append((self._sequence.next(), thread_id, method_name, parameters))
+
+    def _merge(self):
+        """Moves the calls recorded by the threads into the (single threaded) recording, in call order.
+        Calls still being recorded by running threads are merged by a later assertion, so they end up after the
+        ones merged now even if they were made before: the global order only holds among the calls recorded by
+        threads done with them (e.g. joined) before each assertion"""
+        entries = []
+        for buffer in list(self._buffers.values()):
+            taken = buffer[:]
+            del buffer[:len(taken)]
+            entries.extend(taken)
+        entries.sort(key=lambda entry: entry[0])
+        for _, thread_id, method_name, parameters in entries:
+            self._record(method_name, parameters, thread_id)
+
+    def _record(self, method_name, parameters, thread_id=None):
+        if self._max_recorded_calls is None:
+            self._actual_calls.append(method_name)
+            self._actual_parameters.append(parameters)
+            self._actual_threads.append(thread_id)
+            self._recorded += 1
+        else:
+            position = self._next_position
+            if self._recorded == self._max_recorded_calls:
+                self._unindex(self._actual_calls[position], self._actual_parameters[position])
+            else:
+                self._recorded += 1
+            self._actual_calls[position] = method_name
+            self._actual_parameters[position] = parameters
+            self._actual_threads[position] = thread_id
+            self._next_position = (position + 1) % self._max_recorded_calls
+        self._index(method_name, parameters)
+
+    def _index(self, method_name, parameters):
+        self._calls_by_method[method_name] = self._calls_by_method.get(method_name, 0) + 1
+        key = _index_key(parameters)
+        if key is _UNHASHABLE:
+            if method_name not in self._unhashable_parameters_by_method:
+                self._unhashable_parameters_by_method[method_name] = []
+            self._unhashable_parameters_by_method[method_name].append(parameters)
+            return
+        if method_name not in self._parameters_by_method:
+            self._parameters_by_method[method_name] = {}
+        index = self._parameters_by_method[method_name]
+        entry = index.get(key)
+        if entry is None:
+            index[key] = [parameters, 1]
+        else:
+            entry[1] += 1
+
+    def _unindex(self, method_name, parameters):
+        self._calls_by_method[method_name] -= 1
+        key = _index_key(parameters)
+        if key is _UNHASHABLE:
+            self._unhashable_parameters_by_method[method_name].remove(parameters)
+            return
+        index = self._parameters_by_method[method_name]
+        entry = index[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del index[key]
+
+    def _count_calls_with(self, method_name, args):
+        index = self._parameters_by_method.get(method_name, {})
+        key = _index_key(args)
+        if key is _UNHASHABLE:
+            count = sum(entry[1] for entry in index.values() if entry[0] == args)
+        else:
+            entry = index.get(key)
+            count = entry[1] if entry is not None else 0
+        for parameters in self._unhashable_parameters_by_method.get(method_name, ()):
+            if parameters == args:
+                count += 1
+        return count
+
     def _get_return_value_or_raise_exception(self, method_name, parameters):
-        if parameters in self._calls_matching[method_name]['params']:
-            return self._on_parameters_get_return_value_or_raise(method_name, parameters)
-        elif None in self._calls_matching[method_name]['params']:
-            return self._on_parameters_get_return_value_or_raise(method_name, None)
+        index = self._find_stub(method_name, parameters)
+        if index is None:
+            index = self._find_stub(method_name, None)
+        if index is not None:
+            return self._on_index_get_return_value_or_raise(method_name, index)
 
-    def _on_parameters_get_return_value_or_raise(self, method_name, parameters):
-        index = self._calls_matching[method_name]['params'].index(parameters)
+    def _find_stub(self, method_name, parameters):
+        stubs = self._calls_matching[method_name]
+        key = _index_key(parameters)
+        if key is _UNHASHABLE:
+            return stubs['params'].index(parameters) if parameters in stubs['params'] else None
+        index = stubs['index'].get(key)
+        for position in stubs['unhashable']:
+            if index is not None and position > index:
+                break
+            if stubs['params'][position] == parameters:
+                return position
+        return index
+
+    def _on_index_get_return_value_or_raise(self, method_name, index):
         if self._calls_matching[method_name]['raise_exception'][index] is not None:
             raise self._calls_matching[method_name]['raise_exception'][index]
         return self._calls_matching[method_name]['return_values'][index]
 
 
-def create_mock(cls=None):
-    newMock = Mock()
-    if cls is not None:
-        for attr in dir(cls):
-            if callable(getattr(cls, attr)):
-                setattr(newMock, attr, newMock._wrapper(attr))
-    return newMock
+def create_mock(cls=None, max_recorded_calls=None, thread_safe=False):
+    if cls is None:
+        return Mock(max_recorded_calls, thread_safe)
+    return _spec(cls)[1](max_recorded_calls, thread_safe)
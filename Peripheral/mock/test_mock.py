@@ -1,5 +1,7 @@
 import unittest
-from mock import create_mock, Mock
+import _thread
+from time import sleep, time
+from mock import create_mock, Mock, _specs
 
 
 class TestClass():
@@ -10,6 +12,11 @@ class TestClass():
         pass
 
 
+class ResettableClass():
+    def reset(self):
+        pass
+
+
 class MockTestCase(unittest.TestCase):
     def test_should_create_mock(self):
         test_mock = create_mock()
@@ -121,6 +128,184 @@ class MockTestCase(unittest.TestCase):
         self.assertTrue(test_mock.has_been_called_with('method2', {'arg1': '1', 'arg2': 0}, times=1))
         self.assertFalse(test_mock.has_been_called_with('method2', {'arg1': '1', 'arg2': 1}))
 
+    def test_should_count_calls_with_unhashable_parameters(self):
+        test_mock = create_mock(TestClass)
+        test_mock.method1(1, bytearray(b'ab'))
+        test_mock.method1(1, b'ab')
+        self.assertTrue(test_mock.has_been_called_with('method1', (1, b'ab'), times=2))
+        self.assertTrue(test_mock.has_been_called_with('method1', (1, bytearray(b'ab')), times=2))
+        test_mock.method2(arg1=[1, 2], arg2=0)
+        self.assertTrue(test_mock.has_been_called_with('method2', {'arg1': [1, 2], 'arg2': 0}, times=1))
+        self.assertFalse(test_mock.has_been_called_with('method2', {'arg1': [1, 3], 'arg2': 0}))
+
+    def test_should_return_first_matching_stub_value(self):
+        test_mock = create_mock(TestClass)
+        test_mock.when('method1', ('a', 7), return_value=11)
+        test_mock.when('method1', ('a', 7), return_value=12)
+        test_mock.when('method1', ([1],), return_value=13)
+        self.assertEqual(test_mock.method1('a', 7), 11)
+        self.assertEqual(test_mock.method1([1]), 13)
+        self.assertIsNone(test_mock.method1([2]))
+
+    def test_should_keep_only_last_calls_when_bounded(self):
+        test_mock = create_mock(TestClass, max_recorded_calls=3)
+        for i in range(10):
+            test_mock.method1(i)
+        test_mock.method2('a')
+        self.assertTrue(test_mock.has_been_called(times=3))
+        self.assertTrue(test_mock.has_been_called(method='method1', times=2))
+        self.assertTrue(test_mock.has_been_called_with('method1', (9,), times=1))
+        self.assertFalse(test_mock.has_been_called_with('method1', (7,)))
+        self.assertTrue(test_mock.has_been_called_with('method2', ('a',), times=1))
+
+    def test_should_stay_bounded_after_reset(self):
+        test_mock = create_mock(TestClass, max_recorded_calls=2)
+        test_mock.method1()
+        test_mock.reset()
+        for i in range(5):
+            test_mock.method1([i])
+        self.assertTrue(test_mock.has_been_called(times=2))
+        self.assertTrue(test_mock.has_been_called_with('method1', ([4],), times=1))
+        self.assertFalse(test_mock.has_been_called_with('method1', ([2],)))
+
+    def test_should_record_buffer_contents_at_call_time(self):
+        test_mock = create_mock(TestClass)
+        buffer = bytearray(1)
+        buffer[0] = 1
+        test_mock.method1(buffer)
+        buffer[0] = 2
+        test_mock.method2(arg1=buffer)
+        self.assertTrue(test_mock.has_been_called_with('method1', (b'\x01',), times=1))
+        self.assertTrue(test_mock.has_been_called_with('method2', {'arg1': b'\x02'}, times=1))
+
+    def test_should_introspect_each_class_once(self):
+        create_mock(TestClass)
+        spec = _specs[TestClass]
+        create_mock(TestClass)
+        self.assertIs(_specs[TestClass], spec)
+        self.assertEqual(spec[0], {'method1', 'method2'})
+
+    def test_should_create_method_wrappers_on_first_access(self):
+        test_mock = create_mock(TestClass)
+        method = test_mock.method1
+        self.assertIs(test_mock.method1, method)
+        method(1, 2)
+        self.assertTrue(test_mock.has_been_called_with('method1', (1, 2)))
+
+    def test_should_raise_on_attributes_not_in_spec(self):
+        test_mock = create_mock(TestClass)
+        with self.assertRaises(AttributeError):
+            test_mock.method3()
+        with self.assertRaises(AttributeError):
+            create_mock().method1()
+
+    def test_should_mock_methods_named_as_mock_ones(self):
+        test_mock = create_mock(ResettableClass)
+        test_mock.reset()
+        self.assertTrue(test_mock.has_been_called(method='reset'))
+
+    def test_should_keep_spec_after_reset(self):
+        test_mock = create_mock(TestClass)
+        test_mock.method1(1, 2)
+        test_mock.reset()
+        test_mock.method2(3, 4)
+        self.assertTrue(test_mock.has_been_called(times=1))
+        self.assertTrue(test_mock.has_been_called_with('method2', (3, 4)))
+
+
+def _run_in_threads(threads, target, timeout_s=10):
+    """Runs target(thread_index) in the given number of threads, waiting for all of them.
+    Raises again the first exception raised by a thread, and fails if they are not done within timeout_s"""
+    done = []
+    errors = []
+    lock = _thread.allocate_lock()
+
+    def run(index):
+        try:
+            target(index)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        finally:
+            with lock:
+                done.append(index)
+
+    for index in range(threads):
+        _thread.start_new_thread(run, (index,))
+    deadline = time() + timeout_s
+    while len(done) < threads:
+        if time() > deadline:
+            raise AssertionError('%d of %d threads still running after %d s' % (threads - len(done), threads,
+                                                                                   timeout_s))
+        sleep(0.01)
+    if errors:
+        raise errors[0]
+
+
+class ThreadSafeMockTestCase(unittest.TestCase):
+    def test_should_record_calls_from_several_threads(self):
+        test_mock = create_mock(TestClass, thread_safe=True)
+
+        def calls(index):
+            for i in range(200):
+                test_mock.method1(index, i)
+
+        _run_in_threads(4, calls)
+        self.assertTrue(test_mock.has_been_called(times=800))
+        self.assertTrue(test_mock.has_been_called_with('method1', (3, 199), times=1))
+
+    def test_should_keep_each_thread_order_and_id(self):
+        test_mock = create_mock(TestClass, thread_safe=True)
+
+        def calls(index):
+            for i in range(100):
+                test_mock.method2(index, i)
+
+        _run_in_threads(3, calls)
+        by_thread = {}
+        for method, parameters, thread_id in test_mock.calls():
+            self.assertEqual(method, 'method2')
+            by_thread.setdefault(parameters[0], []).append((parameters[1], thread_id))
+        for index, calls in by_thread.items():
+            self.assertEqual([i for i, _ in calls], list(range(100)))
+            self.assertEqual(len(set(thread_id for _, thread_id in calls)), 1)
+        self.assertEqual(len(set(calls[0][1] for calls in by_thread.values())), 3)
+
+    def test_should_merge_in_global_call_order(self):
+        test_mock = create_mock(TestClass, thread_safe=True)
+        test_mock.method1(1, 2)
+
+        def call(index):
+            test_mock.method2(3, 4)
+
+        _run_in_threads(1, call)
+        test_mock.method1(5, 6)
+        self.assertEqual([parameters for _, parameters, _ in test_mock.calls()], [(1, 2), (3, 4), (5, 6)])
+
+    def test_should_stay_bounded_when_thread_safe(self):
+        test_mock = create_mock(TestClass, max_recorded_calls=10, thread_safe=True)
+
+        def calls(index):
+            for i in range(50):
+                test_mock.method1(index, i)
+
+        _run_in_threads(2, calls)
+        self.assertTrue(test_mock.has_been_called(times=10))
+        self.assertEqual(len(test_mock.calls()), 10)
+
+    def test_should_report_exceptions_raised_in_threads(self):
+        test_mock = create_mock(TestClass, thread_safe=True)
+        test_mock.when('method1', (1, 0), raise_exception=ValueError('boom'))
+        with self.assertRaises(ValueError):
+            _run_in_threads(2, lambda index: test_mock.method1(index, 0))
+
+    def test_should_keep_thread_safe_recording_after_reset(self):
+        test_mock = create_mock(TestClass, thread_safe=True)
+        test_mock.method1(1, 2)
+        test_mock.reset()
+        _run_in_threads(2, lambda index: test_mock.method1(index, 0))
+        self.assertTrue(test_mock.has_been_called(times=2))
+
 
 if __name__ == '__main__':
     unittest.main()
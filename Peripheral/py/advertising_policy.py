@@ -0,0 +1,61 @@
+"""
+    Advertising policy: a fast burst after boot or a disconnection, so centrals (re)connect quickly, stepping down
+    to slower intervals, and no advertising at all while the maximum number of centrals is connected
+"""
+from time import ticks_ms, ticks_diff
+
+# (interval in us, duration in ms) of every step, the last one (duration 0) lasts until the next burst.
+# Intervals among the ones recommended by Apple's accessory design guidelines
+DEFAULT_STEPS = ((20000, 30000), (417500, 300000), (1285000, 0))
+
+
+class AdvertisingPolicy:
+
+    def __init__(self, steps=DEFAULT_STEPS, max_centrals=None, clock=ticks_ms):
+        """max_centrals: advertising stops while that many centrals are connected, never if None"""
+        self.steps = steps
+        self.max_centrals = max_centrals
+        self._clock = clock
+        # called on every burst, e.g. to arm the timer stepping advertising down
+        self.on_burst = None
+        self.bursts = 0
+        self.burst()
+
+    def burst(self):
+        """Starts over from the first (fastest) step"""
+        self._burst_start = self._clock()
+        self.bursts += 1
+        if self.on_burst is not None:
+            self.on_burst()
+
+    def interval_us(self, connected_centrals=0):
+        """Returns the advertising interval for the current step, None if advertising must stop"""
+        if self.max_centrals is not None and connected_centrals >= self.max_centrals:
+            return None
+        return self.steps[self.step()][0]
+
+    def step(self):
+        elapsed = ticks_diff(self._clock(), self._burst_start)
+        last = len(self.steps) - 1
+        for i in range(last):
+            duration = self.steps[i][1]
+            if elapsed < duration:
+                return i
+            elapsed -= duration
+        return last
+
+    def next_step_ms(self):
+        """Returns the ms until advertising steps down to the next interval, None if already at the slowest one"""
+        step = self.step()
+        if step == len(self.steps) - 1:
+            return None
+        end = 0
+        for i in range(step + 1):
+            end += self.steps[i][1]
+        return max(end - ticks_diff(self._clock(), self._burst_start), 0)
+
+    def counters(self):
+        return {
+            'bursts': self.bursts,
+            'step': self.step(),
+        }
@@ -0,0 +1,89 @@
+"""
+    Batched notifications: several timestamped samples packed into a single notification, filling the MTU
+"""
+from array import array
+from struct import pack_into
+from time import ticks_ms, ticks_add, ticks_diff
+from bluetooth import UUID, FLAG_WRITE, FLAG_NOTIFY
+from gatt import Service, Characteristic
+
+BATCH_SERVICE_UUID = UUID('6e7f1a00-5b3c-4d2e-9a10-3c2b1a000003')
+BATCH_UUID = UUID('6e7f1a01-5b3c-4d2e-9a10-3c2b1a000003')
+BATCH = 'battery_samples'
+
+DEFAULT_MTU = 23
+ATT_HEADER_SIZE = 3
+MAX_PAYLOAD_SIZE = 509  # max ATT MTU (512) minus the ATT header
+
+# packet: age in ms of its first sample (uint32), then the samples as ms since the previous sample
+# (uint16, 0 for the first one) and level (uint8)
+PACKET_HEADER_SIZE = 4
+SAMPLE_SIZE = 3
+_MAX_DELTA_MS = 0xFFFF
+
+
+def samples_per_packet(payload_size):
+    return max((payload_size - PACKET_HEADER_SIZE) // SAMPLE_SIZE, 1)
+
+
+class SampleBatcher:
+    """Samples wait in preallocated buffers until a packet is full, or the oldest one is max_latency_ms old"""
+
+    def __init__(self, max_latency_ms=2000, clock=ticks_ms):
+        self.max_latency_ms = max_latency_ms
+        self._clock = clock
+        self.capacity = samples_per_packet(MAX_PAYLOAD_SIZE)
+        self._deltas = array('H', [0] * self.capacity)
+        self._levels = bytearray(self.capacity)
+        self._count = 0
+        self._first_ms = 0
+        self._last_ms = 0
+        self.samples = 0
+        self.packets = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, level):
+        """Returns False, dropping the sample, when the buffer is full"""
+        if self._count == self.capacity:
+            return False
+        now = self._clock()
+        if self._count:
+            self._deltas[self._count] = min(ticks_diff(now, self._last_ms), _MAX_DELTA_MS)
+        else:
+            self._deltas[0] = 0
+            self._first_ms = now
+        self._last_ms = now
+        self._levels[self._count] = level
+        self._count += 1
+        self.samples += 1
+        return True
+
+    def full(self, payload_size):
+        return self._count >= samples_per_packet(payload_size)
+
+    def due(self):
+        return self._count and ticks_diff(self._clock(), self._first_ms) >= self.max_latency_ms
+
+    def packet(self, payload_size):
+        """Returns the packet with the oldest samples that fit in payload_size bytes, and removes them"""
+        count = min(self._count, samples_per_packet(payload_size))
+        data = bytearray(PACKET_HEADER_SIZE + count * SAMPLE_SIZE)
+        pack_into('<I', data, 0, ticks_diff(self._clock(), self._first_ms))
+        for i in range(count):
+            pack_into('<HB', data, PACKET_HEADER_SIZE + i * SAMPLE_SIZE, self._deltas[i] if i else 0, self._levels[i])
+        if count < self._count:
+            self._first_ms = ticks_add(self._first_ms, sum(self._deltas[1:count + 1]))
+        for i in range(count, self._count):
+            self._deltas[i - count] = self._deltas[i]
+            self._levels[i - count] = self._levels[i]
+        self._count -= count
+        self.packets += 1
+        return bytes(data)
+
+
+def batch_service(on_write):
+    """A central writes 1 to get the samples batched on this characteristic (instead of every change notified
+    on the battery level), 0 to go back"""
+    return Service(BATCH_SERVICE_UUID, (Characteristic(BATCH, BATCH_UUID, FLAG_WRITE | FLAG_NOTIFY, on_write=on_write),))
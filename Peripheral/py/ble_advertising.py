@@ -20,61 +20,116 @@ _ADV_TYPE_UUID128_MORE = const(0x6)
 _ADV_TYPE_APPEARANCE = const(0x19)
 
 
-# Generate a payload to be passed to gap_advertise(adv_data=...).
-def advertising_payload(limited_disc=False, br_edr=False, name=None, services=None, appearance=0):
-    payload = bytearray()
+def _append(payload, adv_type, value):
+    payload.extend(struct.pack("BB", len(value) + 1, adv_type) + value)
 
-    def _append(adv_type, value):
-        nonlocal payload
-        payload += struct.pack("BB", len(value) + 1, adv_type) + value
-
-    _append(
-        _ADV_TYPE_FLAGS,
-        struct.pack("B", (0x01 if limited_disc else 0x02) + (0x00 if br_edr else 0x04)),
-    )
 
+def _append_name_and_services(payload, name, services):
     if name:
-        _append(_ADV_TYPE_NAME, name)
+        _append(payload, _ADV_TYPE_NAME, name.encode() if isinstance(name, str) else name)
 
     if services:
         for uuid in services:
             b = bytes(uuid)
             if len(b) == 2:
-                _append(_ADV_TYPE_UUID16_COMPLETE, b)
+                _append(payload, _ADV_TYPE_UUID16_COMPLETE, b)
             elif len(b) == 4:
-                _append(_ADV_TYPE_UUID32_COMPLETE, b)
+                _append(payload, _ADV_TYPE_UUID32_COMPLETE, b)
             elif len(b) == 16:
-                _append(_ADV_TYPE_UUID128_COMPLETE, b)
+                _append(payload, _ADV_TYPE_UUID128_COMPLETE, b)
+
+
+# Generate a payload to be passed to gap_advertise(adv_data=...).
+def advertising_payload(limited_disc=False, br_edr=False, name=None, services=None, appearance=0):
+    payload = bytearray()
+
+    _append(
+        payload,
+        _ADV_TYPE_FLAGS,
+        struct.pack("B", (0x01 if limited_disc else 0x02) + (0x00 if br_edr else 0x04)),
+    )
+
+    _append_name_and_services(payload, name, services)
 
     # See org.bluetooth.characteristic.gap.appearance.xml
-    _append(_ADV_TYPE_APPEARANCE, struct.pack("<h", appearance))
+    _append(payload, _ADV_TYPE_APPEARANCE, struct.pack("<h", appearance))
 
     return payload
 
 
-def decode_field(payload, adv_type):
+# Generate a payload to be passed to gap_advertise(resp_data=...), no flags nor appearance are included.
+def scan_response_payload(name=None, services=None):
+    payload = bytearray()
+    _append_name_and_services(payload, name, services)
+    return payload
+
+
+_payload_cache = {}
+
+
+def _cache_key(kind, limited_disc, br_edr, name, services, appearance):
+    return kind, limited_disc, br_edr, name, tuple(bytes(uuid) for uuid in services) if services else (), appearance
+
+
+# Cached, immutable version of advertising_payload: each payload is built only once.
+def cached_advertising_payload(limited_disc=False, br_edr=False, name=None, services=None, appearance=0):
+    key = _cache_key('adv', limited_disc, br_edr, name, services, appearance)
+    payload = _payload_cache.get(key)
+    if payload is None:
+        payload = bytes(advertising_payload(limited_disc, br_edr, name, services, appearance))
+        _payload_cache[key] = payload
+    return payload
+
+
+# Cached, immutable version of scan_response_payload.
+def cached_scan_response_payload(name=None, services=None):
+    key = _cache_key('resp', False, False, name, services, 0)
+    payload = _payload_cache.get(key)
+    if payload is None:
+        payload = bytes(scan_response_payload(name, services))
+        _payload_cache[key] = payload
+    return payload
+
+
+# Decode all the fields of a payload in a single pass, returning a dict mapping each AD type to the list of
+# its values. Values are memoryview slices of the payload, so no data is copied.
+def decode_fields(payload):
+    fields = {}
+    data = memoryview(payload)
     i = 0
-    result = []
-    while i + 1 < len(payload):
-        if payload[i + 1] == adv_type:
-            result.append(payload[i + 2 : i + payload[i] + 1])
-        i += 1 + payload[i]
-    return result
+    while i + 1 < len(data):
+        adv_type = data[i + 1]
+        if adv_type in fields:
+            fields[adv_type].append(data[i + 2 : i + data[i] + 1])
+        else:
+            fields[adv_type] = [data[i + 2 : i + data[i] + 1]]
+        i += 1 + data[i]
+    return fields
+
+
+def decode_field(payload, adv_type):
+    return decode_fields(payload).get(adv_type, [])
 
 
+# Both decode_name and decode_services accept either a payload or the fields already decoded by decode_fields.
 def decode_name(payload):
-    n = decode_field(payload, _ADV_TYPE_NAME)
+    fields = payload if isinstance(payload, dict) else decode_fields(payload)
+    n = fields.get(_ADV_TYPE_NAME)
     return str(n[0], "utf-8") if n else ""
 
 
 def decode_services(payload):
+    fields = payload if isinstance(payload, dict) else decode_fields(payload)
     services = []
-    for u in decode_field(payload, _ADV_TYPE_UUID16_COMPLETE):
-        services.append(bluetooth.UUID(struct.unpack("<h", u)[0]))
-    for u in decode_field(payload, _ADV_TYPE_UUID32_COMPLETE):
-        services.append(bluetooth.UUID(struct.unpack("<d", u)[0]))
-    for u in decode_field(payload, _ADV_TYPE_UUID128_COMPLETE):
-        services.append(bluetooth.UUID(u))
+    for adv_type in (_ADV_TYPE_UUID16_COMPLETE, _ADV_TYPE_UUID16_MORE):
+        for u in fields.get(adv_type, ()):
+            services.append(bluetooth.UUID(struct.unpack("<H", u)[0]))
+    for adv_type in (_ADV_TYPE_UUID32_COMPLETE, _ADV_TYPE_UUID32_MORE):
+        for u in fields.get(adv_type, ()):
+            services.append(bluetooth.UUID(struct.unpack("<I", u)[0]))
+    for adv_type in (_ADV_TYPE_UUID128_COMPLETE, _ADV_TYPE_UUID128_MORE):
+        for u in fields.get(adv_type, ()):
+            services.append(bluetooth.UUID(bytes(u)))
     return services
 
 
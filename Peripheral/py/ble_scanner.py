@@ -0,0 +1,117 @@
+"""
+    Central role scanning for peripherals advertising the Battery Service
+"""
+from bluetooth import UUID
+from micropython import const
+from ble_advertising import decode_fields, decode_name, decode_services
+
+_SCAN_INTERVAL_US = const(30000)
+_SCAN_WINDOW_US = const(30000)
+_DEFAULT_CACHE_SIZE = const(64)
+_FNV_OFFSET = 0x811c9dc5
+_FNV_PRIME = 0x01000193
+
+
+def _fnv1a(data, value=_FNV_OFFSET):
+    """32-bit FNV-1a of a buffer, going on from value, for the ports built without binascii.crc32"""
+    for byte in data:
+        value = ((value ^ byte) * _FNV_PRIME) & 0xffffffff
+    return value
+
+
+try:
+    from binascii import crc32 as _checksum
+except ImportError:
+    _checksum = _fnv1a
+
+
+class LRUCache:
+    """Bounded mapping evicting the least recently used key. Eviction walks the entries, so it suits small caches"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = {}
+        self._clock = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._clock += 1
+        entry[0] = self._clock
+        return entry[1]
+
+    def put(self, key, value):
+        self._clock += 1
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[0] = self._clock
+            entry[1] = value
+            return
+        if len(self._entries) >= self.capacity:
+            oldest_key = None
+            oldest = self._clock
+            for k, e in self._entries.items():
+                if e[0] < oldest:
+                    oldest_key, oldest = k, e[0]
+            del self._entries[oldest_key]
+        self._entries[key] = [self._clock, value]
+
+    def values(self):
+        return [entry[1] for entry in self._entries.values()]
+
+
+class BatteryScanner:
+    """Handles scan results, de-duplicating adverts by a checksum of their address and payload, and keeping the devices
+    advertising the Battery Service (0x180F) as (addr_type, addr, name, rssi) tuples"""
+
+    def __init__(self, ble, on_device=None, cache_size=_DEFAULT_CACHE_SIZE, service_uuid=UUID(0x180F)):
+        self.bt = ble
+        self.on_device = on_device
+        self.service_uuid = service_uuid
+        self._seen = LRUCache(cache_size)
+        self._devices = LRUCache(cache_size)
+        self.scanning = False
+        self.results = 0
+        self.duplicates = 0
+        self.matches = 0
+
+    def start(self, duration_ms=10000, interval_us=_SCAN_INTERVAL_US, window_us=_SCAN_WINDOW_US):
+        self.scanning = True
+        self.bt.gap_scan(duration_ms, interval_us, window_us)
+
+    def stop(self):
+        self.bt.gap_scan(None)
+        self.scanning = False
+
+    def devices(self):
+        return self._devices.values()
+
+    def on_scan_result(self, data):
+        addr_type, addr, _, rssi, adv_data = data
+        self.results += 1
+        # addr and adv_data are only valid during the IRQ: they are hashed in place, and addr is only copied when kept
+        key = _checksum(adv_data, _checksum(addr))
+        if key in self._seen:
+            self._seen.get(key)
+            self.duplicates += 1
+            return
+        self._seen.put(key, True)
+        fields = decode_fields(adv_data)
+        if self.service_uuid not in decode_services(fields):
+            return
+        self.matches += 1
+        addr = bytes(addr)
+        device = (addr_type, addr, decode_name(fields), rssi)
+        self._devices.put(addr, device)
+        if self.on_device is not None:
+            self.on_device(device)
+
+    def on_scan_complete(self):
+        self.scanning = False
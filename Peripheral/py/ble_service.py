@@ -3,90 +3,552 @@
 """
 from bluetooth import UUID, FLAG_READ, FLAG_NOTIFY
 from micropython import const
-from ble_advertising import advertising_payload
-from struct import pack, unpack
-
-_IRQ_CENTRAL_CONNECT = const(1 << 0)
-_IRQ_CENTRAL_DISCONNECT = const(1 << 1)
-_IRQ_GATTS_WRITE = const(1 << 2)
-_IRQ_GATTS_READ_REQUEST = const(1 << 3)
-_IRQ_SCAN_RESULT = const(1 << 4)
-_IRQ_SCAN_COMPLETE = const(1 << 5)
-_IRQ_PERIPHERAL_CONNECT = const(1 << 6)
-_IRQ_PERIPHERAL_DISCONNECT = const(1 << 7)
-_IRQ_GATTC_SERVICE_RESULT = const(1 << 8)
-_IRQ_GATTC_CHARACTERISTIC_RESULT = const(1 << 9)
-_IRQ_GATTC_DESCRIPTOR_RESULT = const(1 << 10)
-_IRQ_GATTC_READ_RESULT = const(1 << 11)
-_IRQ_GATTC_WRITE_STATUS = const(1 << 12)
-_IRQ_GATTC_NOTIFY = const(1 << 13)
-_IRQ_GATTC_INDICATE = const(1 << 14)
-
-BATTERY_SERVICE_APPEARANCE = const(3264)  # Generic Personal Mobility Device
+from ble_advertising import cached_advertising_payload, cached_scan_response_payload
+from struct import unpack, unpack_from
+from irq_queue import EventQueue
+from connections import ConnectionPool, ADDR_SIZE
+from instrumentation import diagnostics_service, DIAGNOSTICS, DIAGNOSTICS_SIZE
+from history import history_service, HISTORY
+from batching import batch_service, BATCH, DEFAULT_MTU, ATT_HEADER_SIZE
+from gatt import GattTable, Service, Characteristic, Descriptor, presentation_format, PRESENTATION_FORMAT_UUID, \
+    FORMAT_UINT8, UNIT_PERCENTAGE
 
+# IRQ event codes of the bluetooth module since micropython 1.18 (the first one with connection and encryption
+# updates), which also passes the handler positionally and gives the advertising type in scan results
+_IRQ_CENTRAL_CONNECT = const(1)
+_IRQ_CENTRAL_DISCONNECT = const(2)
+_IRQ_GATTS_WRITE = const(3)
+_IRQ_GATTS_READ_REQUEST = const(4)
+_IRQ_SCAN_RESULT = const(5)
+_IRQ_SCAN_DONE = const(6)
+_IRQ_PERIPHERAL_CONNECT = const(7)
+_IRQ_PERIPHERAL_DISCONNECT = const(8)
+_IRQ_GATTC_SERVICE_RESULT = const(9)
+_IRQ_GATTC_SERVICE_DONE = const(10)
+_IRQ_GATTC_CHARACTERISTIC_RESULT = const(11)
+_IRQ_GATTC_CHARACTERISTIC_DONE = const(12)
+_IRQ_GATTC_DESCRIPTOR_RESULT = const(13)
+_IRQ_GATTC_DESCRIPTOR_DONE = const(14)
+_IRQ_GATTC_READ_RESULT = const(15)
+_IRQ_GATTC_READ_DONE = const(16)
+_IRQ_GATTC_WRITE_DONE = const(17)
+_IRQ_GATTC_NOTIFY = const(18)
+_IRQ_GATTC_INDICATE = const(19)
+_IRQ_GATTS_INDICATE_DONE = const(20)
+_IRQ_MTU_EXCHANGED = const(21)
+_IRQ_CONNECTION_UPDATE = const(27)
+_IRQ_ENCRYPTION_UPDATE = const(28)
+# events carrying two handles (or a handle and a value) kept in the IRQ queue
+_IRQ_TWO_ARGS = (_IRQ_GATTS_WRITE, _IRQ_MTU_EXCHANGED)
+# events never dropped from the IRQ queue: a lost disconnection would leak its connection record
+_IRQ_CONNECTION_EVENTS = (_IRQ_CENTRAL_CONNECT, _IRQ_CENTRAL_DISCONNECT)
 
-def _create_battery_service():
-    battery_service_uuid = UUID(0x180F)
-    battery_level_characteristic = (
-        UUID(0x2A19), FLAG_NOTIFY | FLAG_READ,)  # type org.bluetooth.characteristic.battery_level, uint8 0-100
-    return battery_service_uuid, (battery_level_characteristic,),
+BATTERY_SERVICE_APPEARANCE = const(3264)  # Generic Personal Mobility Device
+DEVICE_NAME = 'micropython-esp32'
+_ADVERTISING_INTERVAL_US = const(500000)
+_MAX_CONNECTIONS = const(16)
+BATTERY_LEVEL = 'battery_level'
+# with subscriptions the stack notifies every subscribed central at once, paced by the notification policy as this one
+_SUBSCRIBERS = const(-1)
 
 
-def _create_services():
-    return _create_battery_service(),
+def channel_name(channel):
+    """Name of the Battery Level characteristic of the channel, the first one being the battery level"""
+    return BATTERY_LEVEL if channel == 0 else '%s_%d' % (BATTERY_LEVEL, channel)
 
 
-def _create_advertising_payload():
-    return advertising_payload(name='micropython-esp32', services=[UUID(0x180F)], appearance=BATTERY_SERVICE_APPEARANCE)
+def _create_battery_service(channels=1):
+    characteristics = []
+    for channel in range(channels):
+        # several Battery Level characteristics are told apart by the description of their presentation format:
+        # first, second... (1, 2...) in the Bluetooth SIG namespace
+        description = channel + 1 if channels > 1 else 0
+        battery_level_format = Descriptor(PRESENTATION_FORMAT_UUID, FLAG_READ,
+                                          value=presentation_format(FORMAT_UINT8, unit=UNIT_PERCENTAGE,
+                                                                    description=description))
+        # type org.bluetooth.characteristic.battery_level, uint8 0-100
+        characteristics.append(Characteristic(channel_name(channel), UUID(0x2A19), FLAG_NOTIFY | FLAG_READ,
+                                              descriptors=(battery_level_format,), value=b'\x32'))
+    return Service(UUID(0x180F), tuple(characteristics))
 
 
 class BatteryService:
-    def __init__(self, ble):
+    def __init__(self, ble, notification_policy=None, scanner=None, schedule=None, irq_queue_size=16,
+                 instrumentation=None, diagnostics=False, history=None, batcher=None, advertising_policy=None,
+                 max_connections=_MAX_CONNECTIONS, subscriptions=False, channels=1):
+        """schedule: function used to run the IRQ queue drain out of the IRQ (micropython.schedule on the device).
+        If None, the queue is drained right away, still inside the IRQ handler.
+        irq_queue_size: events kept in the IRQ queue until drained, plus a connection and a disconnection reserved
+        for each of the max_connections.
+        instrumentation: instrumentation.Instrumentation, nothing is measured if None.
+        diagnostics: adds the diagnostics service, published with publish_diagnostics (requires instrumentation).
+        history: history.HistoryLog offered through the history service, in chunks filling the MTU.
+        batcher: batching.SampleBatcher, offers batched notifications (several samples per packet) to the centrals
+        asking for them, while the rest keep getting every change on the battery level.
+        advertising_policy: advertising_policy.AdvertisingPolicy choosing the advertising interval (a burst after
+        every disconnection, stepped down by update_advertising) and stopping it at the maximum number of centrals.
+        If None, it always advertises every 500 ms.
+        max_connections: size of the pool of connection records, centrals connecting beyond it are disconnected.
+        subscriptions: the levels are written with send_update, so the stack notifies them only to the centrals
+        which enabled it in the Client Characteristic Configuration Descriptor it adds (and keeps) for them.
+        If False, every connected central gets them. The notification policy paces the notifications of all the
+        subscribed centrals as a whole, and batching is not offered (the stack would notify the batched centrals too).
+        channels: number of Battery Level characteristics (e.g. one per cell), set at once by set_channel_levels.
+        The first one is the battery level, the only one going through the notification policy and the batcher"""
+        if subscriptions and batcher is not None:
+            raise ValueError('batching needs every notification under control, not left to the stack')
         self.bt = ble
         self.bt.active(True)
-        self.bt.irq(handler=self._irq_handler)
-        self._connected_centrals = set()
+        self.bt.irq(self._irq_handler)
+        self._connected_centrals = ()
+        # the centrals getting every change notified on the battery level (all of them, but the batched ones)
+        self._single_centrals = ()
+        self._batched_centrals = ()
+        self._battery_level = bytearray(1)
+        self.channels = channels
+        self._channel_names = tuple(channel_name(c) for c in range(channels))
+        # the value written and notified for each channel
+        self._levels = (self._battery_level,) + tuple(bytearray(1) for _ in range(channels - 1))
+        self.notification_policy = notification_policy
+        if notification_policy is not None and subscriptions:
+            notification_policy.add_central(_SUBSCRIBERS)
+        self.scanner = scanner
+        self.instrumentation = instrumentation
+        self._subscriptions = subscriptions
+        self.gatt = GattTable((_create_battery_service(channels),))
+        if diagnostics and instrumentation is not None:
+            self.gatt.add_service(diagnostics_service())
+            self._diagnostics = True
+        else:
+            self._diagnostics = False
+        self.history = history
+        self._history_transfers = {}  # conn_handle: next sequence number to send
+        if history is not None:
+            self.gatt.add_service(history_service(self._on_history_request))
+        self.batcher = batcher
+        if batcher is not None:
+            self.gatt.add_service(batch_service(self._on_batch_request))
+        self.connections = ConnectionPool(max_connections)
+        self.advertising_policy = advertising_policy
+        self.advertising_interval_us = None  # None while not advertising
+        # handled inside the IRQ
+        self._irq_handlers = {
+            _IRQ_SCAN_RESULT: self._on_scan_result,
+            _IRQ_SCAN_DONE: self._on_scan_complete,
+            _IRQ_CONNECTION_UPDATE: self._on_connection_update,
+        }
+        # enqueued by the IRQ, handled when the queue is drained. They return True if advertising must restart
+        self._deferred_handlers = {
+            _IRQ_CENTRAL_CONNECT: self._on_central_connect,
+            _IRQ_CENTRAL_DISCONNECT: self._on_central_disconnect,
+            _IRQ_GATTS_WRITE: self._on_gatts_write,
+            _IRQ_GATTS_READ_REQUEST: self._on_read_request,
+            _IRQ_MTU_EXCHANGED: self._on_mtu_exchanged,
+        }
+        # the central address is copied into the queue, and from it into _irq_addr when the event is handled
+        reserved = 2 * max_connections
+        self.irq_queue = EventQueue(irq_queue_size + reserved, ADDR_SIZE, reserved, _IRQ_CONNECTION_EVENTS)
+        self._irq_addr = bytearray(ADDR_SIZE)
+        self._schedule = schedule
+        self._drain_scheduled = False
+        self._drain = self._drain_irq_queue  # bound once, scheduling it from the IRQ must not allocate
+        self.coalesced_restarts = 0
+        self.schedule_failures = 0
+        # called inside the IRQ as on_read_request(conn_handle) when a central reads a battery level, before the
+        # stack answers with the value in place. It must not allocate: it may only write a fresh value (e.g. sampled
+        # again once too old) with write_battery_level_percentage or write_channel_levels, returning True if it did
+        self.on_read_request = None
+        # called out of the IRQ as on_read_refreshed(conn_handle) once on_read_request returned True, to notify
+        # the value (and whatever else follows a change)
+        self.on_read_refreshed = None
+        # called when a central starts getting the battery level changes (e.g. to resume the periodic sampling)
+        self.on_notified_central = None
+        self.configure_advertising()
+
+    def add_service(self, service):
+        """Adds a service (gatt.Service) to be registered along with the Battery Service"""
+        self.gatt.add_service(service)
 
     def register_services(self):
-        ((self.battery_level_value_handle,),) = self.bt.gatts_register_services(_create_services())
-        self.bt.gatts_write(self.battery_level_value_handle, b'\x32')
+        self.gatt.register(self.bt)
+        self.channel_value_handles = tuple(self.gatt.handle(name) for name in self._channel_names)
+        self.battery_level_value_handle = self.channel_value_handles[0]
+        if self._diagnostics:
+            self.bt.gatts_set_buffer(self.gatt.handle(DIAGNOSTICS), DIAGNOSTICS_SIZE)
+            self.publish_diagnostics()
+
+    def configure_advertising(self, name=DEVICE_NAME, services=None, appearance=BATTERY_SERVICE_APPEARANCE,
+                              scan_response_name=None, scan_response_services=None):
+        """Builds (or takes from the cache) the payloads used each time advertising (re)starts"""
+        if services is None:
+            services = [UUID(0x180F)]
+        self._adv_data = cached_advertising_payload(name=name, services=services, appearance=appearance)
+        if scan_response_name or scan_response_services:
+            self._resp_data = cached_scan_response_payload(name=scan_response_name, services=scan_response_services)
+        else:
+            self._resp_data = None
 
     def start(self):
-        self.bt.gap_advertise(interval_us=500000, adv_data=_create_advertising_payload())
+        if self.advertising_policy is None:
+            interval_us = _ADVERTISING_INTERVAL_US
+        else:
+            interval_us = self.advertising_policy.interval_us(len(self._connected_centrals))
+            if interval_us is None:
+                # as many centrals connected as allowed
+                self.stop()
+                return
+        if self._resp_data is None:
+            self.bt.gap_advertise(interval_us=interval_us, adv_data=self._adv_data)
+        else:
+            self.bt.gap_advertise(interval_us=interval_us, adv_data=self._adv_data, resp_data=self._resp_data)
+        self.advertising_interval_us = interval_us
 
     def stop(self):
         self.bt.gap_advertise(None)
+        self.advertising_interval_us = None
+
+    def update_advertising(self):
+        """Restarts advertising if the policy stepped down the interval.
+        Returns the ms until the next step down, None if there is none"""
+        if self.advertising_policy is None:
+            return None
+        if self.advertising_interval_us is not None and \
+                self.advertising_policy.interval_us(len(self._connected_centrals)) != self.advertising_interval_us:
+            self.start()
+        return self.advertising_policy.next_step_ms()
 
     def set_battery_level_percentage(self, raw_percentage):
-        packed_value = pack('B', self._round_and_limit_percentage(raw_percentage))
-        self.bt.gatts_write(self.battery_level_value_handle, packed_value)
-        for central in self._connected_centrals:
-            self.bt.gatts_notify(central, self.battery_level_value_handle, packed_value)
+        """Writes and notifies the new level. Without a notification policy it does not allocate
+        memory (the value is written into a preallocated buffer), so it can be called from a hard IRQ"""
+        value = self._round_and_limit_percentage(raw_percentage)
+        if self.notification_policy is not None and not self.notification_policy.update(value):
+            return
+        self._battery_level[0] = value
+        if self.notification_policy is None and self.instrumentation is None:
+            # the hot path with many centrals: the stack is called directly
+            value_handle = self.battery_level_value_handle
+            if self._subscriptions:
+                self.bt.gatts_write(value_handle, self._battery_level, True)
+            else:
+                self.bt.gatts_write(value_handle, self._battery_level)
+                for central in self._single_centrals:
+                    self.bt.gatts_notify(central, value_handle, self._battery_level)
+        elif self.notification_policy is None:
+            self._write_battery_level(0, self._subscriptions)
+            if not self._subscriptions:
+                for central in self._single_centrals:
+                    self._notify(central)
+        else:
+            self._write_battery_level()
+            self._notify_due_centrals(True)
+        if self._batched_centrals:
+            self.batcher.add(value)
+            self._send_batches(False)
 
-    def read_battery_level_percentage(self):
-        value, = unpack('B', self.bt.gatts_read(self.battery_level_value_handle))
+    def set_channel_levels(self, levels, changed=-1):
+        """Writes and notifies, in a single pass, the levels (percentages, one per channel) of the channels
+        flagged in the changed bit mask. The other channels are notified to every connected central (or, with
+        subscriptions, by the stack to the ones subscribed to them)"""
+        if changed & 1:
+            self.set_battery_level_percentage(levels[0])
+        for channel in range(1, self.channels):
+            if changed & (1 << channel):
+                self._levels[channel][0] = self._round_and_limit_percentage(levels[channel])
+                self._write_battery_level(channel, self._subscriptions)
+                if not self._subscriptions:
+                    for central in self._connected_centrals:
+                        self._notify(central, channel)
+
+    def write_battery_level_percentage(self, raw_percentage, channel=0):
+        """Writes the level in place, without notifying it. It does not allocate memory, so it can be called
+        from the read request IRQ"""
+        self._levels[channel][0] = self._round_and_limit_percentage(raw_percentage)
+        self.bt.gatts_write(self.channel_value_handles[channel], self._levels[channel])
+
+    def write_channel_levels(self, levels, changed=-1):
+        """Writes in place, without notifying them, the levels of the channels flagged in the changed bit mask"""
+        for channel in range(self.channels):
+            if changed & (1 << channel):
+                self.write_battery_level_percentage(levels[channel], channel)
+
+    def flush_notifications(self):
+        """Sends the notifications held back by the notification policy, once they are due,
+        and continues the history transfers interrupted because the stack ran out of buffers"""
+        if self.notification_policy is not None and self.notification_policy.pending():
+            self._notify_due_centrals(False)
+        if self._batched_centrals and self.batcher.due():
+            self._send_batches(True)
+        for central in tuple(self._history_transfers):
+            self._send_history(central)
+
+    def read_battery_level_percentage(self, channel=0):
+        value, = unpack('B', self.bt.gatts_read(self.channel_value_handles[channel]))
         return value
 
     def connected_centrals(self):
         return len(self._connected_centrals)
 
+    def notified_centrals(self):
+        """Centrals getting the changes of the battery level, one by one or batched. With subscriptions, every
+        connected one is counted: the stack does not tell which ones enabled the notifications"""
+        return len(self._single_centrals) + len(self._batched_centrals)
+
+    def mtu(self, conn_handle):
+        record = self.connections.get(conn_handle)
+        if record is None or not record.mtu:
+            return DEFAULT_MTU
+        return record.mtu
+
+    def stats(self):
+        stats = {
+            'connected_centrals': len(self._connected_centrals),
+            'rejected_connections': self.connections.rejected,
+            'coalesced_restarts': self.coalesced_restarts,
+            'schedule_failures': self.schedule_failures,
+            'irq_queue': self.irq_queue.counters(),
+        }
+        if self.notification_policy is not None:
+            stats['notifications'] = self.notification_policy.counters()
+        if self.advertising_policy is not None:
+            stats['advertising'] = self.advertising_policy.counters()
+            stats['advertising']['interval_us'] = self.advertising_interval_us
+        if self.batcher is not None:
+            stats['batched_centrals'] = len(self._batched_centrals)
+            stats['batched_samples'] = self.batcher.samples
+            stats['batched_packets'] = self.batcher.packets
+        if self.instrumentation is not None:
+            stats.update(self.instrumentation.stats())
+        return stats
+
+    def publish_diagnostics(self):
+        """Writes the current instrumentation counters into the diagnostics characteristic"""
+        if self._diagnostics:
+            self.bt.gatts_write(self.gatt.handle(DIAGNOSTICS), self.instrumentation.pack())
+
     def _round_and_limit_percentage(self, raw_percentage):
-        percentage = int(round(raw_percentage))
-        if percentage < 0:
-            value = 0
-        elif percentage > 100:
-            value = 100
+        # limit before rounding, so round only ever returns a small int
+        if raw_percentage <= 0:
+            return 0
+        if raw_percentage >= 100:
+            return 100
+        return round(raw_percentage)
+
+    def _notify_due_centrals(self, count_deferred):
+        due = self.notification_policy.due_centrals(count_deferred)
+        if due and self._subscriptions:
+            # the stack notifies every subscribed central at once
+            self._write_battery_level(0, True)
+        for central in due:
+            if not self._subscriptions:
+                self._notify(central)
+            self.notification_policy.notified(central)
+
+    def _write_battery_level(self, channel=0, send_update=False):
+        """With send_update, the stack notifies the value to the centrals subscribed to it"""
+        if self.instrumentation is None:
+            self._gatts_write(channel, send_update)
+            return
+        try:
+            self._gatts_write(channel, send_update)
+        except OSError:
+            self.instrumentation.count('gatts_write_failures')
+            raise
+        self.instrumentation.count('gatts_write')
+
+    def _gatts_write(self, channel, send_update):
+        if send_update:
+            self.bt.gatts_write(self.channel_value_handles[channel], self._levels[channel], True)
         else:
-            value = percentage
-        return value
+            self.bt.gatts_write(self.channel_value_handles[channel], self._levels[channel])
+
+    def _notify(self, central, channel=0):
+        self._send(central, self.channel_value_handles[channel], self._levels[channel])
+
+    def _send(self, central, value_handle, data):
+        """Every notification goes through here, so the instrumentation counts them all (and their failures)"""
+        if self.instrumentation is None:
+            self.bt.gatts_notify(central, value_handle, data)
+            return
+        try:
+            self.bt.gatts_notify(central, value_handle, data)
+        except OSError:
+            self.instrumentation.count('gatts_notify_failures')
+            raise
+        self.instrumentation.count('gatts_notify')
 
     def _irq_handler(self, event, data):
-        if event == _IRQ_CENTRAL_DISCONNECT:
-            conn_handle, _, _, = data
-            if conn_handle in self._connected_centrals:
-                self._connected_centrals.remove(conn_handle)
-            self.start()
-        elif event == _IRQ_CENTRAL_CONNECT:
-            conn_handle, _, _, = data
-            self._connected_centrals.add(conn_handle)
+        if self.instrumentation is None:
+            self._handle_irq(event, data)
+        else:
+            start = self.instrumentation.start()
+            self._handle_irq(event, data)
+            self.instrumentation.count('irq')
+            self.instrumentation.elapsed('irq_us', start)
+
+    def _handle_irq(self, event, data):
+        if event == _IRQ_CENTRAL_CONNECT:
+            # conn_handle, addr_type and addr, which is only valid during the IRQ
+            self.irq_queue.put(event, data[0], data[1], data[2])
+            self._schedule_drain()
+        elif event == _IRQ_GATTS_READ_REQUEST:
+            # conn_handle and value_handle: a battery level refreshed in place is notified once out of the IRQ
+            if self.on_read_request is not None and data[1] in self.channel_value_handles \
+                    and self.on_read_request(data[0]):
+                self.irq_queue.put(event, data[0], data[1])
+                self._schedule_drain()
+        elif event in self._deferred_handlers:
+            self.irq_queue.put(event, data[0], data[1] if event in _IRQ_TWO_ARGS else 0)
+            self._schedule_drain()
+        else:
+            handler = self._irq_handlers.get(event)
+            if handler is not None:
+                handler(data)
+
+    def _schedule_drain(self):
+        if self._schedule is None:
+            self._drain_irq_queue()
+        elif not self._drain_scheduled:
+            # set before scheduling, the drain may run (and clear it) before schedule returns
+            self._drain_scheduled = True
+            try:
+                self._schedule(self._drain, None)
+            except RuntimeError:
+                # micropython's schedule queue is full: the next IRQ will try again
+                self._drain_scheduled = False
+                self.schedule_failures += 1
+
+    def _drain_irq_queue(self, _=None):
+        self._drain_scheduled = False
+        restarts = 0
+        while len(self.irq_queue):
+            event, arg0, arg1 = self.irq_queue.get(self._irq_addr)
+            if self._deferred_handlers[event](arg0, arg1):
+                restarts += 1
+        if restarts:
+            self.coalesced_restarts += restarts - 1
             self.start()
+
+    def _on_central_connect(self, conn_handle, addr_type):
+        if conn_handle not in self._connected_centrals:
+            if self.connections.acquire(conn_handle, addr_type, self._irq_addr) is None:
+                # as many connections as records in the pool
+                self.bt.gap_disconnect(conn_handle)
+                return False
+            self._connected_centrals += (conn_handle,)
+            self._single_centrals += (conn_handle,)
+            self._notified_central_added()
+        if self.notification_policy is not None and not self._subscriptions:
+            self.notification_policy.add_central(conn_handle, self.connections.get(conn_handle))
+        if self.instrumentation is not None:
+            self.instrumentation.count('connects')
+        return True
+
+    def _on_central_disconnect(self, conn_handle, _):
+        # a new tuple is assigned (never mutated in place), so an update running meanwhile is safe
+        self._connected_centrals = tuple(c for c in self._connected_centrals if c != conn_handle)
+        self._single_centrals = tuple(c for c in self._single_centrals if c != conn_handle)
+        self._batched_centrals = tuple(c for c in self._batched_centrals if c != conn_handle)
+        self.connections.release(conn_handle)
+        if self.notification_policy is not None:
+            self.notification_policy.remove_central(conn_handle)
+        if conn_handle in self._history_transfers:
+            del self._history_transfers[conn_handle]
+        if self.advertising_policy is not None:
+            self.advertising_policy.burst()
+        if self.instrumentation is not None:
+            self.instrumentation.count('disconnects')
+        return True
+
+    def _on_gatts_write(self, conn_handle, value_handle):
+        attribute = self.gatt.find(value_handle)
+        if attribute is not None and attribute.on_write is not None:
+            attribute.on_write(conn_handle, value_handle)
+        return False
+
+    def _add_single_central(self, conn_handle):
+        if conn_handle not in self._single_centrals:
+            self._single_centrals += (conn_handle,)
+            if self.notification_policy is not None:
+                self.notification_policy.add_central(conn_handle, self.connections.get(conn_handle))
+            self._notified_central_added()
+
+    def _notified_central_added(self):
+        if self.on_notified_central is not None:
+            self.on_notified_central()
+
+    def _on_read_request(self, conn_handle, _):
+        if self.on_read_refreshed is not None:
+            self.on_read_refreshed(conn_handle)
+        return False
+
+    def _remove_single_central(self, conn_handle):
+        if conn_handle in self._single_centrals:
+            self._single_centrals = tuple(c for c in self._single_centrals if c != conn_handle)
+            if self.notification_policy is not None:
+                self.notification_policy.remove_central(conn_handle)
+
+    def _on_history_request(self, conn_handle, value_handle):
+        request = self.bt.gatts_read(value_handle)
+        self._history_transfers[conn_handle] = unpack_from('<I', request)[0] if len(request) >= 4 else 0
+        self._send_history(conn_handle)
+
+    def _send_history(self, conn_handle):
+        value_handle = self.gatt.handle(HISTORY)
+        seq = self._history_transfers[conn_handle]
+        while True:
+            chunk, next_seq = self.history.chunk(seq, self.mtu(conn_handle) - ATT_HEADER_SIZE)
+            try:
+                self._send(conn_handle, value_handle, chunk)
+            except OSError:
+                # out of buffers (or disconnected): resumed on the next flush
+                break
+            if next_seq == seq:
+                del self._history_transfers[conn_handle]
+                break
+            seq = next_seq
+            self._history_transfers[conn_handle] = seq
+
+    def _on_mtu_exchanged(self, conn_handle, mtu):
+        record = self.connections.get(conn_handle)
+        if record is not None:
+            record.mtu = mtu
+        return False
+
+    def _on_connection_update(self, data):
+        # handled inside the IRQ, it only updates the connection record. Intervals come in 1.25 ms units and
+        # the supervision timeout in 10 ms ones
+        conn_handle, interval, latency, supervision_timeout, status = data
+        record = self.connections.get(conn_handle)
+        if record is not None and not status:
+            record.interval_us = interval * 1250
+            record.latency = latency
+            record.supervision_timeout_ms = supervision_timeout * 10
+
+    def _on_batch_request(self, conn_handle, value_handle):
+        request = self.bt.gatts_read(value_handle)
+        batched = bool(request) and request[0] != 0
+        if batched == (conn_handle in self._batched_centrals) or conn_handle not in self._connected_centrals:
+            return
+        if batched:
+            self._batched_centrals += (conn_handle,)
+            self._remove_single_central(conn_handle)
+        else:
+            self._batched_centrals = tuple(c for c in self._batched_centrals if c != conn_handle)
+            self._add_single_central(conn_handle)
+
+    def _send_batches(self, flush):
+        """Sends the full packets (and the last, partial, one if flush), sized for the smallest MTU"""
+        payload_size = min(self.mtu(c) for c in self._batched_centrals) - ATT_HEADER_SIZE
+        value_handle = self.gatt.handle(BATCH)
+        while self.batcher.full(payload_size) or (flush and len(self.batcher)):
+            packet = self.batcher.packet(payload_size)
+            for central in self._batched_centrals:
+                self._send(central, value_handle, packet)
+
+    def _on_scan_result(self, data):
+        if self.scanner is not None:
+            self.scanner.on_scan_result(data)
+
+    def _on_scan_complete(self, data):
+        if self.scanner is not None:
+            self.scanner.on_scan_complete()
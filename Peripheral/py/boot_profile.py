@@ -0,0 +1,25 @@
+"""
+    Boot profiling: time elapsed, since the profile was created, at each step of the boot
+"""
+from time import ticks_us, ticks_diff
+
+
+class BootProfile:
+
+    def __init__(self, clock=ticks_us):
+        self._clock = clock
+        self._start = clock()
+        self.marks = []
+
+    def mark(self, step):
+        self.marks.append((step, ticks_diff(self._clock(), self._start)))
+
+    def elapsed_us(self, step):
+        """Time (in us) from the start to the given step, None if the step was not reached yet"""
+        for name, elapsed in self.marks:
+            if name == step:
+                return elapsed
+        return None
+
+    def report(self):
+        return {name: elapsed for name, elapsed in self.marks}
@@ -0,0 +1,60 @@
+"""
+    Per-connection state: compact records taken from a preallocated pool, which caps the number of connections
+"""
+ADDR_SIZE = 6
+
+
+class Connection:
+    """interval_us, latency and supervision_timeout_ms are the ones the central set, 0 until the stack reports them
+    (the bluetooth module offers no way for the peripheral to ask for others).
+    mtu is 0 until exchanged, last_notify_ms None until the notification policy paces a notification to it"""
+    __slots__ = ('conn_handle', 'addr_type', 'addr', 'mtu', 'interval_us', 'latency', 'supervision_timeout_ms',
+                 'last_notify_ms')
+
+    def __init__(self):
+        self.conn_handle = None
+        self.addr_type = 0
+        self.addr = bytearray(ADDR_SIZE)
+        self.reset()
+
+    def reset(self):
+        self.mtu = 0
+        self.interval_us = 0
+        self.latency = 0
+        self.supervision_timeout_ms = 0
+        self.last_notify_ms = None
+
+
+class ConnectionPool:
+    """get does not allocate memory, so it can be called from an IRQ"""
+
+    def __init__(self, capacity=4):
+        self.capacity = capacity
+        self._records = [Connection() for _ in range(capacity)]
+        self._by_handle = {}
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._by_handle)
+
+    def acquire(self, conn_handle, addr_type, addr):
+        """Returns the record for the new connection, None (counting it as rejected) if the pool is full"""
+        for record in self._records:
+            if record.conn_handle is None:
+                record.reset()
+                record.addr_type = addr_type
+                record.addr[:] = addr
+                record.conn_handle = conn_handle
+                self._by_handle[conn_handle] = record
+                return record
+        self.rejected += 1
+        return None
+
+    def release(self, conn_handle):
+        record = self._by_handle.pop(conn_handle, None)
+        if record is not None:
+            record.conn_handle = None
+        return record
+
+    def get(self, conn_handle):
+        return self._by_handle.get(conn_handle)
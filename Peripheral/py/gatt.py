@@ -0,0 +1,101 @@
+"""
+    Declarative GATT table: services, characteristics and descriptors registered at once, and looked up by handle
+"""
+from bluetooth import UUID
+from struct import pack
+
+# org.bluetooth.descriptor.gatt.characteristic_presentation_format
+PRESENTATION_FORMAT_UUID = UUID(0x2904)
+FORMAT_UINT8 = 0x04
+UNIT_PERCENTAGE = 0x27AD
+NAMESPACE_BLUETOOTH_SIG = 0x01
+
+
+def presentation_format(value_format, exponent=0, unit=0x2700, namespace=NAMESPACE_BLUETOOTH_SIG, description=0):
+    return pack('<BbHBH', value_format, exponent, unit, namespace, description)
+
+
+class Descriptor:
+    """on_write is called as on_write(conn_handle, handle) when a central writes its value"""
+
+    def __init__(self, uuid, flags, value=None, on_write=None):
+        self.uuid = uuid
+        self.flags = flags
+        self.value = value
+        self.on_write = on_write
+        self.handle = None
+
+    def definition(self):
+        return self.uuid, self.flags
+
+
+class Characteristic:
+    """name is the key to find the characteristic in the table. on_write is called as on_write(conn_handle, handle)
+    when a central writes its value"""
+
+    def __init__(self, name, uuid, flags, descriptors=(), value=None, on_write=None):
+        self.name = name
+        self.uuid = uuid
+        self.flags = flags
+        self.descriptors = descriptors
+        self.value = value
+        self.on_write = on_write
+        self.handle = None
+
+    def definition(self):
+        if self.descriptors:
+            return self.uuid, self.flags, tuple(d.definition() for d in self.descriptors)
+        return self.uuid, self.flags
+
+
+class Service:
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+    def definition(self):
+        return self.uuid, tuple(c.definition() for c in self.characteristics)
+
+
+class GattTable:
+    """Handle and name lookups are dicts built once, at registration"""
+
+    def __init__(self, services=()):
+        self.services = list(services)
+        self._by_handle = {}
+        self._by_name = {}
+
+    def add_service(self, service):
+        self.services.append(service)
+
+    def definition(self):
+        return tuple(s.definition() for s in self.services)
+
+    def register(self, ble):
+        """Registers all the services and writes the initial values of characteristics and descriptors"""
+        all_handles = ble.gatts_register_services(self.definition())
+        self._by_handle = {}
+        self._by_name = {}
+        for service, handles in zip(self.services, all_handles):
+            i = 0
+            for characteristic in service.characteristics:
+                characteristic.handle = handles[i]
+                self._by_handle[characteristic.handle] = characteristic
+                self._by_name[characteristic.name] = characteristic
+                i += 1
+                for descriptor in characteristic.descriptors:
+                    descriptor.handle = handles[i]
+                    self._by_handle[descriptor.handle] = descriptor
+                    i += 1
+        for attribute in self._by_handle.values():
+            if attribute.value is not None:
+                ble.gatts_write(attribute.handle, attribute.value)
+
+    def characteristic(self, name):
+        return self._by_name[name]
+
+    def handle(self, name):
+        return self._by_name[name].handle
+
+    def find(self, handle):
+        return self._by_handle.get(handle)
@@ -0,0 +1,112 @@
+"""
+    Battery level history: a circular log of readings with delta-encoded timestamps, and its chunked transfer
+"""
+from array import array
+from struct import pack, pack_into
+from time import ticks_ms, ticks_add, ticks_diff
+from bluetooth import UUID, FLAG_WRITE, FLAG_NOTIFY
+from gatt import Service, Characteristic
+
+HISTORY_SERVICE_UUID = UUID('6e7f1a00-5b3c-4d2e-9a10-3c2b1a000002')
+HISTORY_UUID = UUID('6e7f1a01-5b3c-4d2e-9a10-3c2b1a000002')
+HISTORY = 'battery_history'
+
+# chunk: sequence number of its first entry (uint32), age in seconds of that entry (uint32),
+# then the entries as seconds since the previous entry (uint16, 0 for the first one) and level (uint8).
+# A chunk without entries marks the end of the transfer
+CHUNK_HEADER_SIZE = 8
+ENTRY_SIZE = 3
+_MAX_DELTA_S = 0xFFFF
+
+
+class HistoryLog:
+    """Only the seconds elapsed between consecutive readings are stored, along with the level (3 bytes per reading).
+    When full, the oldest readings are overwritten. Every reading gets a sequence number, so a transfer can be
+    resumed where it was left"""
+
+    def __init__(self, capacity=256, clock=ticks_ms):
+        self.capacity = capacity
+        self._clock = clock
+        self._deltas = array('H', [0] * capacity)
+        self._levels = bytearray(capacity)
+        self._head = 0
+        self._count = 0
+        self.first_seq = 0
+        self._first_ms = 0
+        self._last_ms = 0
+
+    def __len__(self):
+        return self._count
+
+    def next_seq(self):
+        return self.first_seq + self._count
+
+    def append(self, level):
+        now = self._clock()
+        if not self._count:
+            delta_s = 0
+            self._first_ms = now
+            self._last_ms = now
+        else:
+            delta_s = min(ticks_diff(now, self._last_ms) // 1000, _MAX_DELTA_S)
+            # advanced by whole seconds, so the rounding errors do not pile up
+            self._last_ms = ticks_add(self._last_ms, delta_s * 1000)
+        if self._count == self.capacity:
+            self._drop_oldest()
+        tail = (self._head + self._count) % self.capacity
+        self._deltas[tail] = delta_s
+        self._levels[tail] = level
+        self._count += 1
+
+    def entries(self, start_seq=0):
+        """Returns (seq, age_s, level) of the readings from start_seq on, oldest first"""
+        now = self._clock()
+        result = []
+        offset_ms = 0
+        for i in range(self._count):
+            position = (self._head + i) % self.capacity
+            if i:
+                offset_ms += self._deltas[position] * 1000
+            seq = self.first_seq + i
+            if seq >= start_seq:
+                result.append((seq, ticks_diff(now, ticks_add(self._first_ms, offset_ms)) // 1000,
+                               self._levels[position]))
+        return result
+
+    def chunk(self, start_seq, size):
+        """Returns the chunk (at most size bytes) with the readings from start_seq on, and the sequence number
+        to continue from. Readings already overwritten are skipped"""
+        start_seq = max(start_seq, self.first_seq)
+        count = min(max((size - CHUNK_HEADER_SIZE) // ENTRY_SIZE, 1), max(self.next_seq() - start_seq, 0))
+        if not count:
+            return pack('<II', self.next_seq(), 0), self.next_seq()
+        age_s = 0
+        data = bytearray(CHUNK_HEADER_SIZE + count * ENTRY_SIZE)
+        offset_ms = 0
+        first = start_seq - self.first_seq
+        for i in range(first + count):
+            position = (self._head + i) % self.capacity
+            if i:
+                offset_ms += self._deltas[position] * 1000
+            if i == first:
+                age_s = ticks_diff(self._clock(), ticks_add(self._first_ms, offset_ms)) // 1000
+            if i >= first:
+                pack_into('<HB', data, CHUNK_HEADER_SIZE + (i - first) * ENTRY_SIZE,
+                          0 if i == first else self._deltas[position], self._levels[position])
+        pack_into('<II', data, 0, start_seq, age_s)
+        return bytes(data), start_seq + count
+
+    def _drop_oldest(self):
+        self._head = (self._head + 1) % self.capacity
+        self._count -= 1
+        self.first_seq += 1
+        if self._count:
+            self._first_ms = ticks_add(self._first_ms, self._deltas[self._head] * 1000)
+        else:
+            self._first_ms = self._last_ms
+
+
+def history_service(on_write):
+    """The central writes the sequence number (uint32) to start from, and the chunks are notified back"""
+    return Service(HISTORY_SERVICE_UUID,
+                   (Characteristic(HISTORY, HISTORY_UUID, FLAG_WRITE | FLAG_NOTIFY, on_write=on_write),))
@@ -0,0 +1,105 @@
+"""
+    Runtime instrumentation: counters and fixed-bucket latency histograms, exposed through stats()
+    and, optionally, a vendor diagnostics characteristic
+"""
+import gc
+from array import array
+from struct import pack
+from time import ticks_us, ticks_diff
+from bluetooth import UUID, FLAG_READ
+from gatt import Service, Characteristic
+
+DIAGNOSTICS_SERVICE_UUID = UUID('6e7f1a00-5b3c-4d2e-9a10-3c2b1a000001')
+DIAGNOSTICS_UUID = UUID('6e7f1a01-5b3c-4d2e-9a10-3c2b1a000001')
+DIAGNOSTICS = 'diagnostics'
+
+# upper bounds (in us) of the histogram buckets, an extra bucket holds everything above the last one
+LATENCY_BUCKETS_US = (50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# counters (and histograms) in the order they are packed into the diagnostics characteristic
+COUNTERS = ('irq', 'connects', 'disconnects', 'gatts_write', 'gatts_write_failures', 'gatts_notify',
+            'gatts_notify_failures', 'refreshes')
+HISTOGRAMS = ('irq_us', 'refresh_us')
+# counters, then max and average of each histogram, then free heap: all of them uint32
+DIAGNOSTICS_SIZE = 4 * (len(COUNTERS) + 2 * len(HISTOGRAMS) + 1)
+
+
+def _mem_free():
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        # CPython
+        return 0
+
+
+class Histogram:
+    """record does not allocate memory, so it can be called from an IRQ"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_US):
+        self.bounds = bounds
+        self.buckets = array('I', [0] * (len(bounds) + 1))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        i = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def average(self):
+        return self.total // self.count if self.count else 0
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'avg': self.average(),
+            'max': self.max,
+            'buckets': list(self.buckets),
+        }
+
+
+class Instrumentation:
+    """Counters and histograms shared by the instrumented objects (BatteryService, VoltageReader)"""
+
+    def __init__(self, clock=ticks_us):
+        self._clock = clock
+        self.counters = {name: 0 for name in COUNTERS}
+        self.histograms = {name: Histogram() for name in HISTOGRAMS}
+
+    def count(self, name):
+        self.counters[name] += 1
+
+    def start(self):
+        return self._clock()
+
+    def elapsed(self, name, start):
+        """Records, in the given histogram, the time elapsed since start (as returned by start())"""
+        self.histograms[name].record(ticks_diff(self._clock(), start))
+
+    def stats(self):
+        stats = dict(self.counters)
+        for name, histogram in self.histograms.items():
+            stats[name] = histogram.stats()
+        stats['mem_free'] = _mem_free()
+        return stats
+
+    def pack(self):
+        """Diagnostics characteristic value: see DIAGNOSTICS_SIZE"""
+        values = [self.counters[name] for name in COUNTERS]
+        for name in HISTOGRAMS:
+            values.append(self.histograms[name].max)
+            values.append(self.histograms[name].average())
+        values.append(_mem_free())
+        return pack('<%dI' % len(values), *values)
+
+
+def diagnostics_service():
+    return Service(DIAGNOSTICS_SERVICE_UUID, (Characteristic(DIAGNOSTICS, DIAGNOSTICS_UUID, FLAG_READ),))
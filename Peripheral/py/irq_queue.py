@@ -0,0 +1,71 @@
+"""
+    Bounded, preallocated ring buffer of IRQ events, so IRQ handlers only enqueue and the work is done later
+"""
+from array import array
+
+
+class EventQueue:
+    """Each event is kept as three integers: the event code and two arguments (e.g. conn_handle, value_handle),
+    plus up to data_size bytes copied from a buffer only valid during the IRQ (e.g. the central address).
+    put does not allocate memory, so it can be called from an IRQ.
+    The last reserved slots are only taken by the reserved_events (a tuple of event codes, e.g. connections and
+    disconnections, which must never be lost), so a flood of any other event cannot crowd them out"""
+
+    def __init__(self, capacity=16, data_size=0, reserved=0, reserved_events=()):
+        self.capacity = capacity
+        self.data_size = data_size
+        self.reserved = reserved
+        self.reserved_events = reserved_events
+        self._events = array('B', [0] * capacity)
+        self._args0 = array('H', [0] * capacity)
+        self._args1 = array('H', [0] * capacity)
+        self._data = bytearray(capacity * data_size)
+        self._head = 0
+        self._count = 0
+        self.enqueued = 0
+        self.overflows = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self._count
+
+    def put(self, event, arg0=0, arg1=0, data=None):
+        """Returns False (and counts an overflow) when the queue is full, or only the reserved slots are left and
+        the event is not one of the reserved ones"""
+        if self._count == self.capacity or \
+                (self._count >= self.capacity - self.reserved and event not in self.reserved_events):
+            self.overflows += 1
+            return False
+        tail = (self._head + self._count) % self.capacity
+        self._events[tail] = event
+        self._args0[tail] = arg0
+        self._args1[tail] = arg1
+        if data is not None:
+            offset = tail * self.data_size
+            for i in range(min(len(data), self.data_size)):
+                self._data[offset + i] = data[i]
+        self._count += 1
+        self.enqueued += 1
+        if self._count > self.high_water:
+            self.high_water = self._count
+        return True
+
+    def get(self, data=None):
+        """Returns the oldest event as (event, arg0, arg1), copying its data into the given buffer, if any"""
+        if not self._count:
+            raise IndexError('empty queue')
+        head = self._head
+        if data is not None:
+            offset = head * self.data_size
+            for i in range(self.data_size):
+                data[i] = self._data[offset + i]
+        self._head = (head + 1) % self.capacity
+        self._count -= 1
+        return self._events[head], self._args0[head], self._args1[head]
+
+    def counters(self):
+        return {
+            'enqueued': self.enqueued,
+            'overflows': self.overflows,
+            'high_water': self.high_water,
+        }
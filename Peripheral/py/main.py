@@ -1,35 +1,149 @@
+from boot_profile import BootProfile
+
+boot_profile = BootProfile()
+
+# every service is registered (in a single GATT table) before advertising starts, so their modules, and the
+# instrumentation and history they offer, are loaded first. Only the voltage reader (with its ADC and filters) and
+# the scheduler are left until after advertising starts
 from bluetooth import BLE
+from micropython import schedule
 from ble_service import BatteryService
-from voltage_reader import VoltageReader
-from machine import Pin, ADC, Timer
+from notification_policy import NotificationPolicy
+from instrumentation import Instrumentation
+from history import HistoryLog
+from batching import SampleBatcher
+from advertising_policy import AdvertisingPolicy
+from machine import Timer
 
-_ADC_PIN = 32
+# one channel (a Battery Level characteristic) per pin, e.g. one per cell of the pack
+_ADC_PINS = (32,)
 _ADC_UPPER_LIMIT = 511
-_TIMER_PERIOD_IN_MS = 2000
+_ADC_OVERSAMPLING = 4
+_ADC_SAMPLES_WINDOW = 8
+_HYSTERESIS_PERCENT = 1
+_MIN_REFRESH_PERIOD_MS = 1000
+_MAX_REFRESH_PERIOD_MS = 16000
+_HEARTBEAT_PERIOD_MS = 60000
+# read driven: the level is sampled on read requests (unless sampled within the TTL), and periodically while a
+# central is connected (every one counts as notified, the stack does not tell which ones subscribed), with a long
+# heartbeat otherwise (for the history)
+_READ_DRIVEN = True
+_READ_TTL_MS = 2000
+_IDLE_HEARTBEAT_PERIOD_MS = 600000
+_NOTIFY_MIN_INTERVAL_MS = 1000
+_NOTIFY_COALESCE_WINDOW_MS = 0
+_DIAGNOSTICS = True
+_HISTORY_CAPACITY = 512
+_BATCH_MAX_LATENCY_MS = 5000
+_MAX_CENTRALS = 3
+# notifying only through the CCCD the stack keeps (send_update) excludes batching, so it stays off here
+_TRACK_SUBSCRIPTIONS = False
+
+instrumentation = Instrumentation()
+history = HistoryLog(_HISTORY_CAPACITY)
+boot_profile.mark('imports')
 
 
 def create_battery_service():
-    service = BatteryService(BLE())
+    policy = NotificationPolicy(suppress_unchanged=True, min_interval_ms=_NOTIFY_MIN_INTERVAL_MS,
+                                coalesce_window_ms=_NOTIFY_COALESCE_WINDOW_MS)
+    service = BatteryService(BLE(), notification_policy=policy, schedule=schedule, instrumentation=instrumentation,
+                             diagnostics=_DIAGNOSTICS, history=history,
+                             batcher=SampleBatcher(max_latency_ms=_BATCH_MAX_LATENCY_MS),
+                             advertising_policy=AdvertisingPolicy(max_centrals=_MAX_CENTRALS),
+                             max_connections=_MAX_CENTRALS, subscriptions=_TRACK_SUBSCRIPTIONS,
+                             channels=len(_ADC_PINS))
     service.register_services()
     service.start()
     return service
 
 
-def create_voltage_reader():
-    adc = ADC(Pin(_ADC_PIN))
+def create_adc(pin):
+    from machine import Pin, ADC
+    adc = ADC(Pin(pin))
     adc.atten(ADC.ATTN_11DB)  # set 11dB input attenuation (voltage range roughly 0.0v - 3.6v)
     adc.width(ADC.WIDTH_9BIT)  # set 9 bit return values (returned range 0-511)
-    voltage_reader = VoltageReader(adc, _ADC_UPPER_LIMIT)
+    return adc
+
+
+def create_voltage_reader():
+    if len(_ADC_PINS) > 1:
+        from voltage_reader import MultiChannelReader
+        return MultiChannelReader([create_adc(pin) for pin in _ADC_PINS], _ADC_UPPER_LIMIT,
+                                  oversampling=_ADC_OVERSAMPLING, hysteresis=_HYSTERESIS_PERCENT,
+                                  instrumentation=instrumentation, history=history, ttl_ms=_READ_TTL_MS)
+    from voltage_reader import VoltageReader
+    from sample_filters import MovingAverageFilter
+    voltage_reader = VoltageReader(create_adc(_ADC_PINS[0]), _ADC_UPPER_LIMIT, oversampling=_ADC_OVERSAMPLING,
+                                   window=_ADC_SAMPLES_WINDOW, sample_filter=MovingAverageFilter(),
+                                   hysteresis=_HYSTERESIS_PERCENT, instrumentation=instrumentation, history=history,
+                                   ttl_ms=_READ_TTL_MS)
     return voltage_reader
 
 
-def boot_service(battery_service, voltage_reader):
+def boot_service(battery_service, voltage_reader_factory=create_voltage_reader, read_driven=_READ_DRIVEN):
+    """Called once advertising started, so creating the voltage reader (and the ADC behind it) does not delay it.
+    It is created here, never by a read request"""
+    from scheduler import AdaptiveScheduler
+    voltage_reader = voltage_reader_factory()
+    boot_profile.mark('voltage_reader')
+
+    def refresh():
+        changed = voltage_reader.refresh(battery_service)
+        battery_service.flush_notifications()
+        battery_service.publish_diagnostics()
+        return changed
+
+    if read_driven:
+        active_centrals = battery_service.notified_centrals
+        heartbeat_ms = _IDLE_HEARTBEAT_PERIOD_MS
+    else:
+        active_centrals = battery_service.connected_centrals
+        heartbeat_ms = _HEARTBEAT_PERIOD_MS
+    scheduler = AdaptiveScheduler(refresh, active_centrals, min_period_ms=_MIN_REFRESH_PERIOD_MS,
+                                  max_period_ms=_MAX_REFRESH_PERIOD_MS, heartbeat_ms=heartbeat_ms)
+    tim = Timer(-1)
+
     def refresh_callback(t):
-        voltage_reader.refresh(battery_service)
+        tim.init(period=scheduler.run(), mode=Timer.ONE_SHOT, callback=refresh_callback)
+
+    def resume(period_ms=_MIN_REFRESH_PERIOD_MS):
+        tim.init(period=period_ms, mode=Timer.ONE_SHOT, callback=refresh_callback)
+
+    if read_driven:
+        # a read older than the TTL is sampled, and written, before the stack answers it; its notification follows
+        battery_service.on_read_request = lambda conn_handle: voltage_reader.sample_if_stale(battery_service)
+        battery_service.on_read_refreshed = lambda conn_handle: voltage_reader.push(battery_service)
+        # a connected central (counted as getting the changes notified) does not wait for the idle heartbeat
+        battery_service.on_notified_central = resume
+    resume()
+    return scheduler
 
+
+def boot_advertising(battery_service):
+    """Steps advertising down as each burst of the advertising policy goes by"""
+    policy = battery_service.advertising_policy
     tim = Timer(-1)
-    tim.init(period=_TIMER_PERIOD_IN_MS, mode=Timer.PERIODIC, callback=refresh_callback)
+
+    def arm(delay_ms):
+        if delay_ms is not None:
+            tim.init(period=delay_ms, mode=Timer.ONE_SHOT, callback=step_down)
+
+    def step_down(t):
+        arm(battery_service.update_advertising())
+
+    policy.on_burst = lambda: arm(policy.next_step_ms())
+    arm(policy.next_step_ms())
+
+
+def boot():
+    battery_service = create_battery_service()
+    boot_profile.mark('advertising')
+    boot_advertising(battery_service)
+    scheduler = boot_service(battery_service)
+    boot_profile.mark('boot')
+    return battery_service, scheduler
 
 
 if __name__ == '__main__':
-    boot_service(create_battery_service(), create_voltage_reader())
+    boot()
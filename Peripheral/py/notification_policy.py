@@ -0,0 +1,92 @@
+"""
+    Notification policy: change suppression, per central rate limiting and coalescing of battery level updates
+"""
+from time import ticks_ms, ticks_diff
+from connections import Connection
+
+_RECORD = 0
+_LAST_VALUE = 1
+_PENDING = 2
+
+
+class NotificationPolicy:
+
+    def __init__(self, suppress_unchanged=True, min_interval_ms=0, coalesce_window_ms=0, clock=ticks_ms):
+        self.suppress_unchanged = suppress_unchanged
+        self.min_interval_ms = min_interval_ms
+        self.coalesce_window_ms = coalesce_window_ms
+        self._clock = clock
+        self._centrals = {}
+        self._window_start = None
+        self.value = None
+        self.updates = 0
+        self.sent = 0
+        self.suppressed_unchanged = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+
+    def add_central(self, conn_handle, record=None):
+        """record: the connections.Connection whose last_notify_ms paces the central, one of its own if None"""
+        self._centrals[conn_handle] = [Connection() if record is None else record, None, False]
+
+    def remove_central(self, conn_handle):
+        if conn_handle in self._centrals:
+            del self._centrals[conn_handle]
+
+    def update(self, value):
+        """Returns False if the update must be dropped, because the value did not change"""
+        if self.suppress_unchanged and value == self.value:
+            self.suppressed_unchanged += 1
+            return False
+        self.value = value
+        self.updates += 1
+        for state in self._centrals.values():
+            state[_PENDING] = True
+        return True
+
+    def pending(self):
+        for state in self._centrals.values():
+            if state[_PENDING]:
+                return True
+        return False
+
+    def due_centrals(self, count_deferred=False):
+        """Returns the centrals to be notified with the current value right now"""
+        now = self._clock()
+        if self.coalesce_window_ms and self._window_start is not None \
+                and ticks_diff(now, self._window_start) < self.coalesce_window_ms:
+            if count_deferred and self.pending():
+                self.coalesced += 1
+            return []
+        due = []
+        for conn_handle, state in self._centrals.items():
+            if not state[_PENDING]:
+                continue
+            if self.suppress_unchanged and state[_LAST_VALUE] == self.value:
+                state[_PENDING] = False
+                self.suppressed_unchanged += 1
+            elif state[_RECORD].last_notify_ms is not None \
+                    and ticks_diff(now, state[_RECORD].last_notify_ms) < self.min_interval_ms:
+                if count_deferred:
+                    self.rate_limited += 1
+            else:
+                due.append(conn_handle)
+        if due and self.coalesce_window_ms:
+            self._window_start = now
+        return due
+
+    def notified(self, conn_handle):
+        state = self._centrals[conn_handle]
+        state[_RECORD].last_notify_ms = self._clock()
+        state[_LAST_VALUE] = self.value
+        state[_PENDING] = False
+        self.sent += 1
+
+    def counters(self):
+        return {
+            'updates': self.updates,
+            'sent': self.sent,
+            'suppressed_unchanged': self.suppressed_unchanged,
+            'rate_limited': self.rate_limited,
+            'coalesced': self.coalesced,
+        }
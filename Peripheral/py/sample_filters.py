@@ -0,0 +1,68 @@
+"""
+    Ring buffer of ADC samples and the filters that can be applied to it
+
+    The filters return integer ADC codes (rounded to the nearest one), so no float is created on each refresh
+"""
+from array import array
+from micropython import const
+
+_EMA_FRACTION_BITS = const(8)
+
+
+class SampleRing:
+
+    def __init__(self, size):
+        self.size = size
+        self.samples = array('H', [0] * size)
+        self.count = 0
+        self.total = 0
+        self._next = 0
+
+    def append(self, sample):
+        if self.count == self.size:
+            self.total -= self.samples[self._next]
+        else:
+            self.count += 1
+        self.samples[self._next] = sample
+        self.total += sample
+        self._next = (self._next + 1) % self.size
+
+    def latest(self):
+        return self.samples[(self._next - 1) % self.size]
+
+    def values(self):
+        if self.count == self.size:
+            return self.samples[self._next:] + self.samples[:self._next]
+        return self.samples[:self.count]
+
+
+class MovingAverageFilter:
+    def apply(self, ring):
+        return (ring.total + ring.count // 2) // ring.count
+
+
+class MedianFilter:
+    def apply(self, ring):
+        ordered = sorted(ring.values())
+        middle = len(ordered) // 2
+        if len(ordered) % 2:
+            return ordered[middle]
+        return (ordered[middle - 1] + ordered[middle] + 1) // 2
+
+
+class EMAFilter:
+    """Exponential moving average, alpha being the weight of the newest sample (0 < alpha <= 1).
+    The average is kept in fixed point, with 8 fractional bits"""
+
+    def __init__(self, alpha=0.25):
+        self.alpha = alpha
+        self._weight = int(alpha * (1 << _EMA_FRACTION_BITS) + 0.5)
+        self._value = None
+
+    def apply(self, ring):
+        sample = ring.latest() << _EMA_FRACTION_BITS
+        if self._value is None:
+            self._value = sample
+        else:
+            self._value += (self._weight * (sample - self._value)) >> _EMA_FRACTION_BITS
+        return (self._value + (1 << (_EMA_FRACTION_BITS - 1))) >> _EMA_FRACTION_BITS
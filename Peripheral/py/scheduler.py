@@ -0,0 +1,47 @@
+"""
+    Adaptive scheduler for the periodic refresh: fast while the value changes, backing off while it is stable,
+    and a slow heartbeat while no central is connected
+"""
+from time import ticks_ms, ticks_diff
+
+
+class AdaptiveScheduler:
+
+    def __init__(self, task, connected_centrals, min_period_ms=1000, max_period_ms=16000, heartbeat_ms=60000,
+                 backoff=2, clock=ticks_ms):
+        """task: callable returning True when the value changed,
+        connected_centrals: callable returning the number of connected centrals"""
+        self.task = task
+        self.connected_centrals = connected_centrals
+        self.min_period_ms = min_period_ms
+        self.max_period_ms = max_period_ms
+        self.heartbeat_ms = heartbeat_ms
+        self.backoff = backoff
+        self._clock = clock
+        self.period_ms = min_period_ms
+        self.wakeups = 0
+        self.changes = 0
+        self.busy_ms = 0
+
+    def run(self):
+        """Runs the task, returning the delay (in ms) until it has to run again"""
+        start = self._clock()
+        changed = self.task()
+        self.busy_ms += ticks_diff(self._clock(), start)
+        self.wakeups += 1
+        if changed:
+            self.changes += 1
+            self.period_ms = self.min_period_ms
+        else:
+            self.period_ms = min(self.period_ms * self.backoff, self.max_period_ms)
+        if not self.connected_centrals():
+            return self.heartbeat_ms
+        return self.period_ms
+
+    def stats(self):
+        return {
+            'wakeups': self.wakeups,
+            'changes': self.changes,
+            'busy_ms': self.busy_ms,
+            'period_ms': self.period_ms,
+        }
@@ -0,0 +1,62 @@
+"""
+    Unit Tests for the advertising_policy module
+"""
+
+import unittest
+from advertising_policy import AdvertisingPolicy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class AdvertisingPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.policy = AdvertisingPolicy(steps=((20000, 1000), (400000, 5000), (1000000, 0)), max_centrals=2,
+                                        clock=self.clock)
+
+    def test_should_start_with_a_fast_burst(self):
+        self.assertEqual(self.policy.interval_us(), 20000)
+        self.assertEqual(self.policy.next_step_ms(), 1000)
+
+    def test_should_step_down_as_the_burst_goes_by(self):
+        self.clock.now = 999
+        self.assertEqual(self.policy.interval_us(), 20000)
+        self.clock.now = 1000
+        self.assertEqual(self.policy.interval_us(), 400000)
+        self.assertEqual(self.policy.next_step_ms(), 5000)
+        self.clock.now = 6000
+        self.assertEqual(self.policy.interval_us(), 1000000)
+        self.assertIsNone(self.policy.next_step_ms())
+        self.clock.now = 600000
+        self.assertEqual(self.policy.interval_us(), 1000000)
+
+    def test_should_start_over_on_burst(self):
+        self.clock.now = 10000
+        self.policy.burst()
+        self.assertEqual(self.policy.interval_us(), 20000)
+        self.assertEqual(self.policy.counters(), {'bursts': 2, 'step': 0})
+
+    def test_should_stop_advertising_at_max_centrals(self):
+        self.assertEqual(self.policy.interval_us(1), 20000)
+        self.assertIsNone(self.policy.interval_us(2))
+
+    def test_should_always_advertise_without_max_centrals(self):
+        policy = AdvertisingPolicy(clock=self.clock)
+        self.assertIsNotNone(policy.interval_us(100))
+
+    def test_should_call_on_burst(self):
+        bursts = []
+        self.policy.on_burst = lambda: bursts.append(self.clock.now)
+        self.clock.now = 300
+        self.policy.burst()
+        self.assertEqual(bursts, [300])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+    Unit Tests for the batching module
+"""
+
+import unittest
+from struct import pack
+from batching import SampleBatcher, samples_per_packet, MAX_PAYLOAD_SIZE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class SampleBatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.batcher = SampleBatcher(max_latency_ms=500, clock=self.clock)
+
+    def _add(self, level, after_ms):
+        self.clock.now += after_ms
+        self.batcher.add(level)
+
+    def test_should_fit_samples_in_payload(self):
+        self.assertEqual(samples_per_packet(20), 5)
+        self.assertEqual(samples_per_packet(509), 168)
+        self.assertEqual(samples_per_packet(4), 1)
+
+    def test_should_be_full_when_a_packet_can_be_filled(self):
+        for level in range(4):
+            self._add(level, 10)
+        self.assertFalse(self.batcher.full(20))
+        self._add(4, 10)
+        self.assertTrue(self.batcher.full(20))
+
+    def test_should_be_due_when_oldest_sample_is_too_old(self):
+        self.assertFalse(self.batcher.due())
+        self._add(50, 0)
+        self.clock.now += 499
+        self.assertFalse(self.batcher.due())
+        self.clock.now += 1
+        self.assertTrue(self.batcher.due())
+
+    def test_should_pack_oldest_samples_with_their_timestamps(self):
+        for level in (50, 51, 52):
+            self._add(level, 100)
+        self.clock.now += 20
+        self.assertEqual(self.batcher.packet(4 + 2 * 3), pack('<IHBHB', 220, 0, 50, 100, 51))
+        self.assertEqual(len(self.batcher), 1)
+        self.assertEqual(self.batcher.packet(20), pack('<IHB', 20, 0, 52))
+        self.assertEqual(len(self.batcher), 0)
+        self.assertEqual(self.batcher.packets, 2)
+
+    def test_should_drop_samples_when_full(self):
+        for level in range(samples_per_packet(MAX_PAYLOAD_SIZE)):
+            self.assertTrue(self.batcher.add(level % 101))
+        self.assertFalse(self.batcher.add(1))
+        self.assertEqual(self.batcher.samples, samples_per_packet(MAX_PAYLOAD_SIZE))
+
+
+if __name__ == '__main__':
+    unittest.main()
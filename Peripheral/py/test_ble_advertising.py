@@ -0,0 +1,74 @@
+"""
+    Unit Tests for the ble_advertising module
+"""
+
+import unittest
+from bluetooth import UUID
+from ble_advertising import advertising_payload, scan_response_payload, cached_advertising_payload, \
+    cached_scan_response_payload, decode_fields, decode_name, decode_services
+
+
+class AdvertisingPayloadTestCase(unittest.TestCase):
+    def test_should_build_payload_with_flags_name_services_and_appearance(self):
+        payload = advertising_payload(name='esp32', services=[UUID(0x180F)], appearance=3264)
+        self.assertEqual(bytes(payload), b'\x02\x01\x06\x06\x09esp32\x03\x03\x0f\x18\x03\x19\xc0\x0c')
+        self.assertEqual(decode_name(payload), 'esp32')
+        self.assertEqual(decode_services(payload), [UUID(0x180F)])
+
+    def test_should_build_scan_response_without_flags_nor_appearance(self):
+        payload = scan_response_payload(name='esp32')
+        self.assertEqual(bytes(payload), b'\x06\x09esp32')
+
+    def test_should_build_cached_payload_only_once(self):
+        payload = cached_advertising_payload(name='cached', services=[UUID(0x180F)], appearance=3264)
+        self.assertEqual(payload, advertising_payload(name='cached', services=[UUID(0x180F)], appearance=3264))
+        self.assertIs(cached_advertising_payload(name='cached', services=[UUID(0x180F)], appearance=3264), payload)
+        self.assertIsInstance(payload, bytes)
+
+    def test_should_cache_payloads_by_configuration(self):
+        payload = cached_advertising_payload(name='cached', services=[UUID(0x180F)])
+        self.assertNotEqual(cached_advertising_payload(name='cached', services=[UUID(0x180A)]), payload)
+        self.assertNotEqual(cached_advertising_payload(name='other', services=[UUID(0x180F)]), payload)
+        self.assertNotEqual(cached_advertising_payload(limited_disc=True, name='cached', services=[UUID(0x180F)]),
+                            payload)
+
+    def test_should_cache_scan_response_apart_from_advertising_payload(self):
+        response = cached_scan_response_payload(name='cached')
+        self.assertEqual(response, scan_response_payload(name='cached'))
+        self.assertIs(cached_scan_response_payload(name='cached'), response)
+        self.assertNotEqual(cached_advertising_payload(name='cached'), response)
+
+
+class AdvertisingDecodingTestCase(unittest.TestCase):
+    def test_should_decode_all_fields_in_a_single_pass(self):
+        payload = advertising_payload(name='esp32', services=[UUID(0x180F), UUID(0x180A)], appearance=3264)
+        fields = decode_fields(payload)
+        self.assertEqual(sorted(fields.keys()), [0x01, 0x03, 0x09, 0x19])
+        self.assertEqual([bytes(f) for f in fields[0x03]], [b'\x0f\x18', b'\x0a\x18'])
+        self.assertIsInstance(fields[0x09][0], memoryview)
+
+    def test_should_decode_name_and_services_from_decoded_fields(self):
+        fields = decode_fields(advertising_payload(name='esp32', services=[UUID(0x180F)]))
+        self.assertEqual(decode_name(fields), 'esp32')
+        self.assertEqual(decode_services(fields), [UUID(0x180F)])
+
+    def test_should_decode_16_bit_uuids_above_0x7fff(self):
+        self.assertEqual(decode_services(advertising_payload(services=[UUID(0xFE9F)])), [UUID(0xFE9F)])
+
+    def test_should_decode_32_bit_uuids(self):
+        self.assertEqual(decode_services(advertising_payload(services=[UUID(0x12345678)])), [UUID(0x12345678)])
+
+    def test_should_decode_128_bit_uuids(self):
+        uuid = UUID('6E400001-B5A3-F393-E0A9-E50E24DCCA9E')
+        self.assertEqual(decode_services(advertising_payload(services=[uuid])), [uuid])
+
+    def test_should_decode_incomplete_service_lists(self):
+        self.assertEqual(decode_services(b'\x03\x02\x0f\x18'), [UUID(0x180F)])
+
+    def test_should_decode_empty_payload(self):
+        self.assertEqual(decode_fields(b''), {})
+        self.assertEqual(decode_name(b''), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
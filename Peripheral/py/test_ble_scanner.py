@@ -0,0 +1,109 @@
+"""
+    Unit Tests for the ble_scanner module
+"""
+
+import unittest
+from mock.mock import create_mock
+from bluetooth import BLE, UUID
+from ble_advertising import advertising_payload
+from ble_scanner import BatteryScanner, LRUCache, _fnv1a
+
+_BATTERY_ADVERT = advertising_payload(name='battery', services=[UUID(0x180F)])
+_OTHER_ADVERT = advertising_payload(name='other', services=[UUID(0x181A)])
+
+
+def _scan_result(addr, adv_data, rssi=-60):
+    return 0, memoryview(addr), True, rssi, memoryview(adv_data)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_should_evict_least_recently_used_key(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_should_update_existing_key(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(len(cache), 1)
+
+
+class BatteryScannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBLE = create_mock(BLE)
+        self.found = []
+        self.scanner = BatteryScanner(self.mockBLE, on_device=self.found.append, cache_size=4)
+
+    def test_should_start_and_stop_scanning(self):
+        self.scanner.start(5000)
+        self.assertTrue(self.mockBLE.has_been_called_with('gap_scan', (5000, 30000, 30000), times=1))
+        self.assertTrue(self.scanner.scanning)
+        self.scanner.stop()
+        self.assertTrue(self.mockBLE.has_been_called_with('gap_scan', (None,), times=1))
+        self.assertFalse(self.scanner.scanning)
+
+    def test_should_report_battery_service_devices(self):
+        self.scanner.on_scan_result(_scan_result(b'\x01' * 6, _BATTERY_ADVERT, rssi=-40))
+        self.assertEqual(self.found, [(0, b'\x01' * 6, 'battery', -40)])
+        self.assertEqual(self.scanner.devices(), [(0, b'\x01' * 6, 'battery', -40)])
+
+    def test_should_ignore_devices_without_battery_service(self):
+        self.scanner.on_scan_result(_scan_result(b'\x02' * 6, _OTHER_ADVERT))
+        self.assertEqual(self.found, [])
+        self.assertEqual(self.scanner.results, 1)
+        self.assertEqual(self.scanner.matches, 0)
+
+    def test_should_de_duplicate_repeated_adverts(self):
+        for _ in range(10):
+            self.scanner.on_scan_result(_scan_result(b'\x01' * 6, _BATTERY_ADVERT))
+        self.assertEqual(len(self.found), 1)
+        self.assertEqual(self.scanner.duplicates, 9)
+
+    def test_should_decode_again_when_advert_changes(self):
+        self.scanner.on_scan_result(_scan_result(b'\x01' * 6, _BATTERY_ADVERT))
+        self.scanner.on_scan_result(_scan_result(b'\x01' * 6, advertising_payload(name='renamed',
+                                                                                  services=[UUID(0x180F)])))
+        self.assertEqual([device[2] for device in self.found], ['battery', 'renamed'])
+        self.assertEqual(len(self.scanner.devices()), 1)
+
+    def test_should_tell_apart_adverts_from_different_addresses(self):
+        self.scanner.on_scan_result(_scan_result(b'\x01' * 6, _BATTERY_ADVERT))
+        self.scanner.on_scan_result(_scan_result(b'\x02' * 6, _BATTERY_ADVERT))
+        self.assertEqual([device[1] for device in self.found], [b'\x01' * 6, b'\x02' * 6])
+        self.assertEqual(self.scanner.duplicates, 0)
+
+    def test_should_keep_a_copy_of_the_address(self):
+        addr = bytearray(b'\x01' * 6)
+        self.scanner.on_scan_result(_scan_result(addr, _BATTERY_ADVERT))
+        addr[0] = 0
+        self.assertEqual(self.scanner.devices()[0][1], b'\x01' * 6)
+
+    def test_should_keep_cache_bounded(self):
+        for i in range(20):
+            self.scanner.on_scan_result(_scan_result(bytes((i,)) * 6, _BATTERY_ADVERT))
+        self.assertEqual(len(self.found), 20)
+        self.assertEqual(len(self.scanner.devices()), 4)
+
+    def test_should_stop_scanning_on_complete(self):
+        self.scanner.start()
+        self.scanner.on_scan_complete()
+        self.assertFalse(self.scanner.scanning)
+
+
+class ChecksumTestCase(unittest.TestCase):
+    def test_should_hash_buffers_with_fnv1a(self):
+        self.assertEqual(_fnv1a(b''), 0x811c9dc5)
+        self.assertEqual(_fnv1a(memoryview(b'a')), 0xe40c292c)
+        self.assertEqual(_fnv1a(b'b', _fnv1a(b'a')), _fnv1a(b'ab'))
+
+
+if __name__ == '__main__':
+    unittest.main()
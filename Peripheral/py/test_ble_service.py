@@ -3,21 +3,41 @@
 """
 
 import unittest
+import micropython
 from mock.mock import create_mock, Mock
-from bluetooth import BLE, UUID, FLAG_READ, FLAG_NOTIFY
-from ble_service import BatteryService, BATTERY_SERVICE_APPEARANCE
-from ble_advertising import advertising_payload
+from bluetooth import BLE, UUID, FLAG_READ, FLAG_WRITE, FLAG_NOTIFY
+from ble_service import BatteryService, BATTERY_SERVICE_APPEARANCE, channel_name
+from ble_advertising import advertising_payload, scan_response_payload
+from notification_policy import NotificationPolicy
+from ble_scanner import BatteryScanner
+from gatt import Service, Characteristic, PRESENTATION_FORMAT_UUID
+from instrumentation import Instrumentation, DIAGNOSTICS_UUID, DIAGNOSTICS_SIZE
+from history import HistoryLog
+from batching import SampleBatcher
+from advertising_policy import AdvertisingPolicy
+from struct import pack
 from micropython import const
 
 MOCK_BATTERY_LEVEL_HANDLE = 111
+MOCK_BATTERY_LEVEL_FORMAT_HANDLE = 112
+MOCK_HISTORY_HANDLE = 113
 
-_IRQ_CENTRAL_CONNECT = const(1 << 0)
-_IRQ_CENTRAL_DISCONNECT = const(1 << 1)
+_IRQ_CENTRAL_CONNECT = const(1)
+_IRQ_CENTRAL_DISCONNECT = const(2)
+_IRQ_GATTS_WRITE = const(3)
+_IRQ_SCAN_RESULT = const(5)
+_IRQ_SCAN_DONE = const(6)
+_IRQ_MTU_EXCHANGED = const(21)
+_IRQ_CONNECTION_UPDATE = const(27)
+
+_ADDR_TYPE = 0
+_ADDR = b'\x11\x22\x33\x44\x55\x66'
 
 
 def _create_expected_services():
     battery_service_uuid = UUID(0x180F)
-    battery_level_characteristic = (UUID(0x2A19), FLAG_NOTIFY | FLAG_READ,)
+    battery_level_format = (UUID(0x2904), FLAG_READ,)
+    battery_level_characteristic = (UUID(0x2A19), FLAG_NOTIFY | FLAG_READ, (battery_level_format,),)
     battery_service = (battery_service_uuid, (battery_level_characteristic,),)
     return (battery_service,)
 
@@ -29,7 +49,8 @@ def _create_expected_advertising_payload():
 class BLEServiceTestCase(unittest.TestCase):
     def setUp(self):
         self.mockBLE = create_mock(BLE)
-        self.mockBLE.when('gatts_register_services', return_value=((MOCK_BATTERY_LEVEL_HANDLE,),))
+        self.mockBLE.when('gatts_register_services',
+                          return_value=((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE),))
 
     def test_should_create_mock(self):
         self.assertIsInstance(self.mockBLE, Mock)
@@ -44,7 +65,12 @@ class BLEServiceTestCase(unittest.TestCase):
         expected_services = _create_expected_services()
         service.register_services()
         self.assertTrue(self.mockBLE.has_been_called_with('gatts_register_services', (expected_services,), times=1))
-        self.assertTrue(self.mockBLE.has_been_called(method='gatts_write', times=1))
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_write', (MOCK_BATTERY_LEVEL_HANDLE, b'\x32'), times=1))
+        # percentage, as unsigned 8 bit integer (org.bluetooth.descriptor.gatt.characteristic_presentation_format)
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_write', (MOCK_BATTERY_LEVEL_FORMAT_HANDLE,
+                                                                          b'\x04\x00\xad\x27\x01\x00\x00'),
+                                                          times=1))
+        self.assertTrue(self.mockBLE.has_been_called(method='gatts_write', times=2))
 
     def test_should_advertise_services(self):
         service = BatteryService(self.mockBLE)
@@ -98,7 +124,7 @@ class BLEServiceTestCase(unittest.TestCase):
         self.assertEqual(service.read_battery_level_percentage(), 10)
 
     def test_should_restart_advertising_after_disconnect(self):
-        disconnect_data = (123, 'A_type', 'address')
+        disconnect_data = (123, _ADDR_TYPE, _ADDR)
         service = BatteryService(self.mockBLE)
         # testing 'private' method !!
         self.assertTrue(self.mockBLE.has_been_called(method='irq', times=1))
@@ -108,7 +134,7 @@ class BLEServiceTestCase(unittest.TestCase):
                                                       times=1))
 
     def test_should_restart_advertising_after_connect(self):
-        connect_data = (124, 'A_type', 'address')
+        connect_data = (124, _ADDR_TYPE, _ADDR)
         service = BatteryService(self.mockBLE)
         # testing 'private' method !!
         self.assertTrue(self.mockBLE.has_been_called(method='irq', times=1))
@@ -118,7 +144,7 @@ class BLEServiceTestCase(unittest.TestCase):
                                                           times=1))
 
     def test_should_add_connection_handle_on_central_connected(self):
-        connect_data = (124, 'A_type', 'address')
+        connect_data = (124, _ADDR_TYPE, _ADDR)
         service = BatteryService(self.mockBLE)
         self.assertEqual(service.connected_centrals(), 0)
         # triggering 'private' method !!
@@ -126,7 +152,7 @@ class BLEServiceTestCase(unittest.TestCase):
         self.assertEqual(service.connected_centrals(), 1)
 
     def test_should_remove_connection_handle_on_central_disconnected(self):
-        data = (124, 'A_type', 'address')
+        data = (124, _ADDR_TYPE, _ADDR)
         service = BatteryService(self.mockBLE)
         self.assertEqual(service.connected_centrals(), 0)
         # triggering 'private' method !!
@@ -137,7 +163,7 @@ class BLEServiceTestCase(unittest.TestCase):
 
     def test_should_notify_connect_centrals_on_battery_level_change(self):
         self.mockBLE.when('gatts_read', (MOCK_BATTERY_LEVEL_HANDLE, ), return_value=b'\x0A')
-        connect_data = (124, 'A_type', 'address')
+        connect_data = (124, _ADDR_TYPE, _ADDR)
         service = BatteryService(self.mockBLE)
         service.register_services()
         service.start()
@@ -148,6 +174,713 @@ class BLEServiceTestCase(unittest.TestCase):
         self.assertTrue(self.mockBLE.has_been_called(method='gatts_notify', times=1))
 
 
+    def test_should_not_write_nor_notify_unchanged_values_with_policy(self):
+        service = BatteryService(self.mockBLE, notification_policy=NotificationPolicy())
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        service.set_battery_level_percentage(23)
+        service.set_battery_level_percentage(23.2)
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_write', (MOCK_BATTERY_LEVEL_HANDLE, b'\x17'), times=1))
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_notify', (124, MOCK_BATTERY_LEVEL_HANDLE, b'\x17'),
+                                                          times=1))
+        self.assertEqual(service.notification_policy.counters()['suppressed_unchanged'], 1)
+
+    def test_should_flush_rate_limited_notifications(self):
+        clock = [0]
+        policy = NotificationPolicy(min_interval_ms=1000, clock=lambda: clock[0])
+        service = BatteryService(self.mockBLE, notification_policy=policy)
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        service.set_battery_level_percentage(23)
+        service.set_battery_level_percentage(24)
+        self.assertFalse(self.mockBLE.has_been_called_with('gatts_notify', (124, MOCK_BATTERY_LEVEL_HANDLE, b'\x18')))
+        self.assertEqual(service.connections.get(124).last_notify_ms, 0)
+        clock[0] = 1000
+        service.flush_notifications()
+        self.assertEqual(service.connections.get(124).last_notify_ms, 1000)
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_notify', (124, MOCK_BATTERY_LEVEL_HANDLE, b'\x18'),
+                                                          times=1))
+        self.assertTrue(self.mockBLE.has_been_called(method='gatts_notify', times=2))
+
+    def test_should_reuse_the_advertising_payload_on_each_restart(self):
+        service = BatteryService(self.mockBLE)
+        service.register_services()
+        service.start()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_CENTRAL_DISCONNECT, (124, _ADDR_TYPE, _ADDR))
+        self.assertTrue(self.mockBLE.has_been_called_with('gap_advertise', {'interval_us': 500000,
+                                                                            'adv_data': _create_expected_advertising_payload()},
+                                                          times=3))
+
+    def test_should_advertise_with_scan_response(self):
+        service = BatteryService(self.mockBLE)
+        service.configure_advertising(scan_response_name='battery')
+        service.start()
+        self.assertTrue(self.mockBLE.has_been_called_with('gap_advertise', {'interval_us': 500000,
+                                                                            'adv_data': _create_expected_advertising_payload(),
+                                                                            'resp_data': scan_response_payload(name='battery')},
+                                                          times=1))
+
+    def test_should_hand_scan_results_over_to_scanner(self):
+        scanner = create_mock(BatteryScanner)
+        service = BatteryService(self.mockBLE, scanner=scanner)
+        scan_result = (0, b'\x01' * 6, 0, -60, b'\x02\x01\x06')
+        service._irq_handler(_IRQ_SCAN_RESULT, scan_result)
+        service._irq_handler(_IRQ_SCAN_DONE, ())
+        self.assertTrue(scanner.has_been_called_with('on_scan_result', (scan_result,), times=1))
+        self.assertTrue(scanner.has_been_called(method='on_scan_complete', times=1))
+
+    def test_should_register_additional_services(self):
+        written = []
+        control = Characteristic('control', UUID(0x2A9F), FLAG_WRITE,
+                                 on_write=lambda conn_handle, handle: written.append((conn_handle, handle)))
+        mockBLE = create_mock(BLE)
+        mockBLE.when('gatts_register_services',
+                     return_value=((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE), (200,)))
+        service = BatteryService(mockBLE)
+        service.add_service(Service(UUID(0x1234), (control,)))
+        service.register_services()
+        self.assertEqual(service.battery_level_value_handle, MOCK_BATTERY_LEVEL_HANDLE)
+        self.assertEqual(control.handle, 200)
+        # triggering 'private' method !!
+        service._irq_handler(_IRQ_GATTS_WRITE, (124, 200))
+        service._irq_handler(_IRQ_GATTS_WRITE, (124, MOCK_BATTERY_LEVEL_HANDLE))
+        self.assertEqual(written, [(124, 200)])
+
+class ManualScheduler:
+    """Stand-in for micropython.schedule: keeps the scheduled calls until run"""
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self.pending = []
+
+    def __call__(self, function, arg):
+        if len(self.pending) == self.capacity:
+            raise RuntimeError('schedule queue full')
+        self.pending.append((function, arg))
+
+    def run(self):
+        pending, self.pending = self.pending, []
+        for function, arg in pending:
+            function(arg)
+
+
+class DeferredIrqTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBLE = create_mock(BLE)
+        self.mockBLE.when('gatts_register_services',
+                          return_value=((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE),))
+        self.scheduler = ManualScheduler()
+
+    def test_should_only_enqueue_inside_irq(self):
+        service = BatteryService(self.mockBLE, schedule=self.scheduler)
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        self.assertEqual(service.connected_centrals(), 0)
+        self.assertFalse(self.mockBLE.has_been_called(method='gap_advertise'))
+        self.scheduler.run()
+        self.assertEqual(service.connected_centrals(), 1)
+        self.assertTrue(self.mockBLE.has_been_called(method='gap_advertise', times=1))
+
+    def test_should_schedule_a_single_drain_and_restart_advertising_once(self):
+        service = BatteryService(self.mockBLE, schedule=self.scheduler)
+        for conn_handle in range(5):
+            service._irq_handler(_IRQ_CENTRAL_CONNECT, (conn_handle, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_CENTRAL_DISCONNECT, (3, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (4, _ADDR_TYPE, _ADDR))
+        self.assertEqual(len(self.scheduler.pending), 1)
+        self.scheduler.run()
+        self.assertEqual(service.connected_centrals(), 4)
+        self.assertTrue(self.mockBLE.has_been_called(method='gap_advertise', times=1))
+        self.assertEqual(service.coalesced_restarts, 6)
+
+    def test_should_count_overflows_when_flooded(self):
+        service = BatteryService(self.mockBLE, schedule=self.scheduler, irq_queue_size=8, max_connections=4)
+        for _ in range(100):
+            service._irq_handler(_IRQ_GATTS_WRITE, (124, MOCK_BATTERY_LEVEL_HANDLE))
+        self.assertEqual(service.irq_queue.counters(), {'enqueued': 8, 'overflows': 92, 'high_water': 8})
+        self.scheduler.run()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (200, _ADDR_TYPE, _ADDR))
+        self.scheduler.run()
+        self.assertEqual(service.connected_centrals(), 1)
+
+    def test_should_never_drop_connection_events_when_flooded(self):
+        service = BatteryService(self.mockBLE, schedule=self.scheduler, irq_queue_size=8, max_connections=4)
+        for conn_handle in range(4):
+            service._irq_handler(_IRQ_CENTRAL_CONNECT, (conn_handle, _ADDR_TYPE, _ADDR))
+        for _ in range(100):
+            service._irq_handler(_IRQ_GATTS_WRITE, (1, MOCK_BATTERY_LEVEL_HANDLE))
+        for conn_handle in range(4):
+            service._irq_handler(_IRQ_CENTRAL_DISCONNECT, (conn_handle, _ADDR_TYPE, _ADDR))
+        self.scheduler.run()
+        self.assertEqual(service.connected_centrals(), 0)
+        self.assertEqual(len(service.connections), 0)
+        self.assertTrue(self.mockBLE.has_been_called(method='gap_advertise', times=1))
+
+    def test_should_keep_draining_when_schedule_runs_the_drain_at_once(self):
+        service = BatteryService(self.mockBLE, schedule=lambda function, arg: function(arg))
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (1, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (2, _ADDR_TYPE, _ADDR))
+        self.assertEqual(service.connected_centrals(), 2)
+
+    def test_should_retry_scheduling_when_schedule_queue_is_full(self):
+        scheduler = ManualScheduler(capacity=0)
+        service = BatteryService(self.mockBLE, schedule=scheduler)
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (1, _ADDR_TYPE, _ADDR))
+        self.assertEqual(service.schedule_failures, 1)
+        scheduler.capacity = 1
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (2, _ADDR_TYPE, _ADDR))
+        scheduler.run()
+        self.assertEqual(service.connected_centrals(), 2)
+
+class InstrumentedBatteryServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBLE = create_mock(BLE)
+        self.mockBLE.when('gatts_register_services',
+                          return_value=((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE),))
+        self.instrumentation = Instrumentation()
+
+    def test_should_count_connections_and_irqs(self):
+        service = BatteryService(self.mockBLE, instrumentation=self.instrumentation)
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (125, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_CENTRAL_DISCONNECT, (124, _ADDR_TYPE, _ADDR))
+        stats = service.stats()
+        self.assertEqual(stats['connects'], 2)
+        self.assertEqual(stats['disconnects'], 1)
+        self.assertEqual(stats['irq'], 3)
+        self.assertEqual(stats['irq_us']['count'], 3)
+        self.assertEqual(stats['connected_centrals'], 1)
+
+    def test_should_count_writes_and_notifications(self):
+        service = BatteryService(self.mockBLE, instrumentation=self.instrumentation)
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        service.set_battery_level_percentage(23)
+        service.set_battery_level_percentage(24)
+        stats = service.stats()
+        self.assertEqual(stats['gatts_write'], 2)
+        self.assertEqual(stats['gatts_notify'], 2)
+        self.assertEqual(stats['gatts_notify_failures'], 0)
+
+    def test_should_count_failed_notifications(self):
+        self.mockBLE.when('gatts_notify', raise_exception=OSError(128))
+        service = BatteryService(self.mockBLE, instrumentation=self.instrumentation)
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        with self.assertRaises(OSError):
+            service.set_battery_level_percentage(23)
+        self.assertEqual(service.stats()['gatts_notify_failures'], 1)
+        self.assertEqual(service.stats()['gatts_notify'], 0)
+
+    def test_should_not_report_instrumentation_when_disabled(self):
+        service = BatteryService(self.mockBLE)
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        self.assertNotIn('irq', service.stats())
+        self.assertEqual(service.stats()['connected_centrals'], 1)
+
+    def test_should_register_and_publish_diagnostics(self):
+        mockBLE = create_mock(BLE)
+        mockBLE.when('gatts_register_services',
+                     return_value=((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE), (113,)))
+        service = BatteryService(mockBLE, instrumentation=self.instrumentation, diagnostics=True)
+        service.register_services()
+        self.assertEqual(service.gatt.definition()[1][1][0][0], DIAGNOSTICS_UUID)
+        self.assertTrue(mockBLE.has_been_called_with('gatts_set_buffer', (113, DIAGNOSTICS_SIZE), times=1))
+        self.instrumentation.count('connects')
+        service.publish_diagnostics()
+        self.assertTrue(mockBLE.has_been_called_with('gatts_write', (113, self.instrumentation.pack()), times=1))
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class BufferedBLE:
+    """BLE stand-in running out of notification buffers after the given number of notifications"""
+
+    def __init__(self, buffers):
+        self.buffers = buffers
+        self.values = {}
+        self.notified = []
+
+    def active(self, change=None):
+        pass
+
+    def irq(self, handler=None):
+        pass
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None):
+        pass
+
+    def gatts_register_services(self, services):
+        # one characteristic in each service added to the Battery Service, from MOCK_HISTORY_HANDLE on
+        extra_handles = tuple((MOCK_HISTORY_HANDLE + i,) for i in range(len(services) - 1))
+        return ((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE),) + extra_handles
+
+    def gatts_write(self, value_handle, data):
+        self.values[value_handle] = bytes(data)
+
+    def gatts_read(self, value_handle):
+        return self.values[value_handle]
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        if not self.buffers:
+            raise OSError(12)
+        self.buffers -= 1
+        self.notified.append((conn_handle, value_handle, data))
+
+
+class HistoryTransferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.history = HistoryLog(16)
+        for level in range(10):
+            self.history.append(level)
+
+    def _request(self, service, ble, start_seq):
+        ble.gatts_write(MOCK_HISTORY_HANDLE, pack('<I', start_seq))
+        service._irq_handler(_IRQ_GATTS_WRITE, (124, MOCK_HISTORY_HANDLE))
+
+    def test_should_stream_history_in_chunks(self):
+        ble = BufferedBLE(10)
+        service = BatteryService(ble, history=self.history)
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        self._request(service, ble, 0)
+        # 4 readings per 20 bytes chunk, and the end of transfer chunk
+        self.assertEqual([len(data) for _, _, data in ble.notified], [20, 20, 14, 8])
+        self.assertEqual(ble.notified[-1], (124, MOCK_HISTORY_HANDLE, pack('<II', 10, 0)))
+
+    def test_should_resume_from_the_requested_sequence_number(self):
+        ble = BufferedBLE(10)
+        service = BatteryService(ble, history=self.history)
+        service.register_services()
+        self._request(service, ble, 8)
+        self.assertEqual(ble.notified[0][2][:4], pack('<I', 8))
+        self.assertEqual(len(ble.notified), 2)
+
+    def test_should_continue_on_flush_when_out_of_buffers(self):
+        ble = BufferedBLE(1)
+        service = BatteryService(ble, history=self.history)
+        service.register_services()
+        self._request(service, ble, 0)
+        self.assertEqual(len(ble.notified), 1)
+        ble.buffers = 10
+        service.flush_notifications()
+        self.assertEqual(len(ble.notified), 4)
+        self.assertEqual(ble.notified[1][2][:4], pack('<I', 4))
+        service.flush_notifications()
+        self.assertEqual(len(ble.notified), 4)
+
+    def test_should_ignore_the_bytes_beyond_the_sequence_number(self):
+        ble = BufferedBLE(10)
+        service = BatteryService(ble, history=self.history)
+        service.register_services()
+        ble.gatts_write(MOCK_HISTORY_HANDLE, pack('<II', 8, 0xFFFF))
+        service._irq_handler(_IRQ_GATTS_WRITE, (124, MOCK_HISTORY_HANDLE))
+        self.assertEqual(ble.notified[0][2][:4], pack('<I', 8))
+
+    def test_should_count_history_notifications(self):
+        ble = BufferedBLE(2)
+        instrumentation = Instrumentation()
+        service = BatteryService(ble, history=self.history, instrumentation=instrumentation)
+        service.register_services()
+        self._request(service, ble, 0)
+        stats = service.stats()
+        self.assertEqual((stats['gatts_notify'], stats['gatts_notify_failures']), (2, 1))
+
+    def test_should_size_history_chunks_for_the_negotiated_mtu(self):
+        ble = BufferedBLE(10)
+        service = BatteryService(ble, history=self.history)
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_MTU_EXCHANGED, (124, 185))
+        self.assertEqual(service.mtu(124), 185)
+        self._request(service, ble, 0)
+        self.assertEqual([len(data) for _, _, data in ble.notified], [38, 8])
+
+
+class BatchedNotificationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ble = BufferedBLE(100)
+        self.clock = FakeClock()
+        self.service = BatteryService(self.ble, batcher=SampleBatcher(max_latency_ms=1000, clock=self.clock))
+        self.service.register_services()
+        self.batch_handle = MOCK_HISTORY_HANDLE
+        for conn_handle in (124, 125):
+            self.service._irq_handler(_IRQ_CENTRAL_CONNECT, (conn_handle, _ADDR_TYPE, _ADDR))
+
+    def _ask_for_batches(self, conn_handle, enabled=True):
+        self.ble.gatts_write(self.batch_handle, b'\x01' if enabled else b'\x00')
+        self.service._irq_handler(_IRQ_GATTS_WRITE, (conn_handle, self.batch_handle))
+
+    def _notified(self, value_handle):
+        return [(c, data) for c, h, data in self.ble.notified if h == value_handle]
+
+    def test_should_keep_notifying_every_change_by_default(self):
+        for level in range(10):
+            self.service.set_battery_level_percentage(level)
+        self.assertEqual(len(self._notified(MOCK_BATTERY_LEVEL_HANDLE)), 20)
+        self.assertEqual(self._notified(self.batch_handle), [])
+
+    def test_should_batch_samples_filling_the_mtu(self):
+        self._ask_for_batches(125)
+        for level in range(10):
+            self.clock.now += 10
+            self.service.set_battery_level_percentage(level)
+        self.assertEqual(len(self._notified(MOCK_BATTERY_LEVEL_HANDLE)), 10)
+        # 20 bytes payload: 4 bytes header and 5 samples
+        batches = self._notified(self.batch_handle)
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[0][0], 125)
+        self.assertEqual(batches[0][1], pack('<IHBHBHBHBHB', 40, 0, 0, 10, 1, 10, 2, 10, 3, 10, 4))
+
+    def test_should_count_batch_notifications(self):
+        instrumentation = Instrumentation()
+        service = BatteryService(self.ble, batcher=SampleBatcher(max_latency_ms=1000, clock=self.clock),
+                                 instrumentation=instrumentation)
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (125, _ADDR_TYPE, _ADDR))
+        self.ble.gatts_write(self.batch_handle, b'\x01')
+        service._irq_handler(_IRQ_GATTS_WRITE, (125, self.batch_handle))
+        for level in range(5):
+            service.set_battery_level_percentage(level)
+        self.assertEqual(len(self._notified(self.batch_handle)), 1)
+        self.assertEqual(service.stats()['gatts_notify'], 1)
+
+    def test_should_size_batches_for_the_negotiated_mtu(self):
+        self._ask_for_batches(125)
+        self.service._irq_handler(_IRQ_MTU_EXCHANGED, (125, 37))
+        for level in range(10):
+            self.service.set_battery_level_percentage(level)
+        batches = self._notified(self.batch_handle)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(len(batches[0][1]), 4 + 10 * 3)
+
+    def test_should_flush_partial_batch_on_timeout(self):
+        self._ask_for_batches(125)
+        self.service.set_battery_level_percentage(50)
+        self.service.flush_notifications()
+        self.assertEqual(self._notified(self.batch_handle), [])
+        self.clock.now += 1000
+        self.service.flush_notifications()
+        self.assertEqual(self._notified(self.batch_handle), [(125, pack('<IHB', 1000, 0, 50))])
+
+    def test_should_go_back_to_single_notifications(self):
+        self._ask_for_batches(125)
+        self._ask_for_batches(125, enabled=False)
+        self.service.set_battery_level_percentage(50)
+        self.assertEqual(len(self._notified(MOCK_BATTERY_LEVEL_HANDLE)), 2)
+        self.assertEqual(self.service.stats()['batched_centrals'], 0)
+
+
+class AdvertisingPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBLE = create_mock(BLE)
+        self.mockBLE.when('gatts_register_services',
+                          return_value=((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE),))
+        self.clock = FakeClock()
+        self.policy = AdvertisingPolicy(steps=((20000, 1000), (1000000, 0)), max_centrals=2, clock=self.clock)
+        self.service = BatteryService(self.mockBLE, advertising_policy=self.policy)
+        self.service.register_services()
+        self.service.start()
+
+    def _advertised(self, interval_us):
+        return self.mockBLE.has_been_called_with('gap_advertise', {'interval_us': interval_us,
+                                                                   'adv_data': _create_expected_advertising_payload()})
+
+    def test_should_advertise_fast_after_boot(self):
+        self.assertTrue(self._advertised(20000))
+        self.assertEqual(self.service.advertising_interval_us, 20000)
+
+    def test_should_step_down_advertising(self):
+        self.assertEqual(self.service.update_advertising(), 1000)
+        self.assertFalse(self._advertised(1000000))
+        self.clock.now = 1000
+        self.assertIsNone(self.service.update_advertising())
+        self.assertTrue(self._advertised(1000000))
+        self.assertEqual(self.service.stats()['advertising'], {'bursts': 1, 'step': 1, 'interval_us': 1000000})
+
+    def test_should_stop_advertising_at_max_centrals(self):
+        self.service._irq_handler(_IRQ_CENTRAL_CONNECT, (1, _ADDR_TYPE, _ADDR))
+        self.assertEqual(self.service.advertising_interval_us, 20000)
+        self.service._irq_handler(_IRQ_CENTRAL_CONNECT, (2, _ADDR_TYPE, _ADDR))
+        self.assertTrue(self.mockBLE.has_been_called_with('gap_advertise', (None,), times=1))
+        self.assertIsNone(self.service.advertising_interval_us)
+        self.clock.now = 5000
+        self.service.update_advertising()
+        self.assertIsNone(self.service.advertising_interval_us)
+
+    def test_should_burst_after_disconnect(self):
+        self.service._irq_handler(_IRQ_CENTRAL_CONNECT, (1, _ADDR_TYPE, _ADDR))
+        self.clock.now = 5000
+        self.service.update_advertising()
+        self.assertEqual(self.service.advertising_interval_us, 1000000)
+        self.service._irq_handler(_IRQ_CENTRAL_DISCONNECT, (1, _ADDR_TYPE, _ADDR))
+        self.assertEqual(self.service.advertising_interval_us, 20000)
+        self.assertEqual(self.policy.bursts, 2)
+
+
+class ConnectionRecordsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBLE = create_mock(BLE)
+        self.mockBLE.when('gatts_register_services',
+                          return_value=((MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE),))
+        self.service = BatteryService(self.mockBLE, max_connections=2)
+        self.service.register_services()
+
+    def test_should_keep_a_record_per_connection(self):
+        address = bytearray(_ADDR)
+        self.service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, 1, memoryview(address)))
+        address[0] = 0  # the stack reuses the buffer
+        record = self.service.connections.get(124)
+        self.assertEqual(record.addr_type, 1)
+        self.assertEqual(bytes(record.addr), _ADDR)
+        self.service._irq_handler(_IRQ_MTU_EXCHANGED, (124, 100))
+        self.assertEqual(self.service.mtu(124), 100)
+        self.service._irq_handler(_IRQ_CENTRAL_DISCONNECT, (124, _ADDR_TYPE, _ADDR))
+        self.assertIsNone(self.service.connections.get(124))
+        self.assertEqual(self.service.mtu(124), 23)
+
+    def test_should_disconnect_centrals_beyond_max_connections(self):
+        for conn_handle in (1, 2, 3):
+            self.service._irq_handler(_IRQ_CENTRAL_CONNECT, (conn_handle, _ADDR_TYPE, _ADDR))
+        self.assertEqual(self.service.connected_centrals(), 2)
+        self.assertTrue(self.mockBLE.has_been_called_with('gap_disconnect', (3,), times=1))
+        self.assertEqual(self.service.stats()['rejected_connections'], 1)
+
+    def test_should_record_negotiated_connection_parameters(self):
+        self.service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        self.service._irq_handler(_IRQ_CONNECTION_UPDATE, (124, 24, 4, 600, 0))
+        record = self.service.connections.get(124)
+        self.assertEqual((record.interval_us, record.latency, record.supervision_timeout_ms), (30000, 4, 6000))
+
+
+class SubscriptionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ble = BLE()
+        self.service = BatteryService(self.ble, notification_policy=NotificationPolicy(), subscriptions=True)
+        self.service.register_services()
+
+    def _connect(self, addr=_ADDR):
+        return self.ble.connect_central(addr=addr)
+
+    def _subscribe(self, conn_handle, enabled=True):
+        self.ble.subscribe_central(conn_handle, self.service.battery_level_value_handle, enabled)
+
+    def _notified(self, conn_handle):
+        return self.ble.connection(conn_handle).notified
+
+    def test_should_leave_the_client_configuration_to_the_stack(self):
+        definition = self.service.gatt.definition()[0][1][0]
+        self.assertEqual([d[0] for d in definition[2]], [UUID(0x2904)])
+
+    def test_should_only_notify_subscribed_centrals(self):
+        passive = self._connect()
+        subscribed = self._connect()
+        self._subscribe(subscribed)
+        self.service.set_battery_level_percentage(23)
+        self.assertEqual(self._notified(passive), 0)
+        self.assertEqual(self._notified(subscribed), 1)
+
+    def test_should_stop_notifying_when_unsubscribed(self):
+        conn_handle = self._connect()
+        self._subscribe(conn_handle)
+        self._subscribe(conn_handle, False)
+        self.service.set_battery_level_percentage(23)
+        self.assertEqual(self._notified(conn_handle), 0)
+
+    def test_should_notify_subscribed_centrals_without_notification_policy(self):
+        self.service = BatteryService(BLE(), subscriptions=True)
+        self.ble = self.service.bt
+        self.service.register_services()
+        passive = self._connect()
+        subscribed = self._connect()
+        self._subscribe(subscribed)
+        self.service.set_battery_level_percentage(23)
+        self.assertEqual(self._notified(passive), 0)
+        self.assertEqual(self._notified(subscribed), 1)
+        self.assertEqual(self.ble.connection(subscribed).queue[0][2], b'\x17')
+
+    def test_should_pace_the_notifications_of_the_subscribed_centrals(self):
+        clock = FakeClock()
+        self.service = BatteryService(BLE(), notification_policy=NotificationPolicy(min_interval_ms=1000, clock=clock),
+                                      subscriptions=True)
+        self.ble = self.service.bt
+        self.service.register_services()
+        first = self._connect()
+        second = self._connect()
+        self._subscribe(first)
+        self._subscribe(second)
+        self.service.set_battery_level_percentage(23)
+        clock.now = 500
+        self.service.set_battery_level_percentage(24)
+        self.service.set_battery_level_percentage(25)
+        self.assertEqual((self._notified(first), self._notified(second)), (1, 1))
+        self.service.flush_notifications()
+        self.assertEqual(self._notified(first), 1)
+        clock.now = 1000
+        self.service.flush_notifications()
+        self.assertEqual((self._notified(first), self._notified(second)), (2, 2))
+        self.assertEqual(self.ble.connection(first).queue[-1][2], b'\x19')
+        self.assertEqual(self.service.stats()['notifications']['sent'], 2)
+
+    def test_should_not_offer_batching(self):
+        with self.assertRaises(ValueError):
+            BatteryService(BLE(), batcher=SampleBatcher(), subscriptions=True)
+
+    def test_should_count_connected_centrals_as_notified(self):
+        added = []
+        self.service.on_notified_central = lambda: added.append(self.service.notified_centrals())
+        self._connect()
+        self.assertEqual(added, [1])
+
+    def test_should_answer_reads_with_the_value_written_in_the_irq(self):
+        scheduler = ManualScheduler()
+        self.service = BatteryService(BLE(), schedule=scheduler)
+        self.ble = self.service.bt
+        self.service.register_services()
+        conn_handle = self._connect()
+        scheduler.run()
+        refreshed = []
+        self.service.on_read_request = lambda central: self.service.write_battery_level_percentage(77) or True
+        self.service.on_read_refreshed = refreshed.append
+        self.assertEqual(self.ble.read_from_central(conn_handle, self.service.battery_level_value_handle), b'\x4d')
+        # only the write happens inside the IRQ
+        self.assertEqual(self._notified(conn_handle), 0)
+        self.assertEqual(refreshed, [])
+        scheduler.run()
+        self.assertEqual(refreshed, [conn_handle])
+
+    def test_should_not_defer_anything_when_the_value_is_not_refreshed(self):
+        scheduler = ManualScheduler()
+        self.service = BatteryService(BLE(), schedule=scheduler)
+        self.ble = self.service.bt
+        self.service.register_services()
+        conn_handle = self._connect()
+        scheduler.run()
+        self.service.on_read_request = lambda central: False
+        self.ble.read_from_central(conn_handle, self.service.battery_level_value_handle)
+        self.assertEqual(scheduler.pending, [])
+
+    def test_should_only_refresh_on_battery_level_reads(self):
+        conn_handle = self._connect()
+        reads = []
+        self.service.on_read_request = reads.append
+        battery_level = self.service.gatt.characteristic('battery_level')
+        self.ble.read_from_central(conn_handle, battery_level.descriptors[0].handle)
+        self.assertEqual(reads, [])
+        self.ble.read_from_central(conn_handle, self.service.battery_level_value_handle)
+        self.assertEqual(reads, [conn_handle])
+
+
+class MultiChannelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ble = BLE()
+        self.service = BatteryService(self.ble, channels=3)
+        self.service.register_services()
+
+    def _descriptor(self, channel, uuid):
+        characteristic = self.service.gatt.characteristic(channel_name(channel))
+        return [d.handle for d in characteristic.descriptors if d.uuid == uuid][0]
+
+    def _notified(self, conn_handle):
+        return [(value_handle, data) for _, value_handle, data in self.ble.connection(conn_handle).queue]
+
+    def test_should_declare_a_battery_level_per_channel(self):
+        definition = self.service.gatt.definition()[0]
+        self.assertEqual([c[0] for c in definition[1]], [UUID(0x2A19)] * 3)
+        self.assertEqual(self.service.battery_level_value_handle, self.service.channel_value_handles[0])
+
+    def test_should_tell_channels_apart_by_presentation_format_description(self):
+        for channel in range(3):
+            value = self.ble.gatts_read(self._descriptor(channel, PRESENTATION_FORMAT_UUID))
+            self.assertEqual(value, pack('<BbHBH', 0x04, 0, 0x27AD, 0x01, channel + 1))
+
+    def test_should_write_and_notify_only_the_changed_channels(self):
+        conn_handle = self.ble.connect_central()
+        self.service.set_channel_levels(bytearray((80, 70, 60)), 0b110)
+        handles = self.service.channel_value_handles
+        self.assertEqual(self._notified(conn_handle), [(handles[1], b'\x46'), (handles[2], b'\x3c')])
+        self.assertEqual(self.service.read_battery_level_percentage(2), 60)
+        self.assertEqual(self.service.read_battery_level_percentage(), 50)
+
+    def test_should_set_the_first_channel_as_the_battery_level(self):
+        conn_handle = self.ble.connect_central()
+        self.service.set_channel_levels(bytearray((80, 70, 60)), 0b001)
+        self.assertEqual(self._notified(conn_handle), [(self.service.battery_level_value_handle, b'\x50')])
+
+    def test_should_only_notify_channels_to_their_subscribers(self):
+        service = BatteryService(BLE(), subscriptions=True, channels=2)
+        self.ble, self.service = service.bt, service
+        service.register_services()
+        first = self.ble.connect_central()
+        second = self.ble.connect_central()
+        self.ble.subscribe_central(second, service.channel_value_handles[1])
+        service.set_channel_levels(bytearray((80, 70)), 0b11)
+        self.assertEqual(self._notified(first), [])
+        self.assertEqual(self._notified(second), [(service.channel_value_handles[1], b'\x46')])
+
+    def test_should_refresh_on_reads_of_any_channel(self):
+        conn_handle = self.ble.connect_central()
+        reads = []
+        self.service.on_read_request = reads.append
+        self.ble.read_from_central(conn_handle, self.service.channel_value_handles[2])
+        self.assertEqual(reads, [conn_handle])
+
+
+class NoAllocationBLE:
+    """BLE stand-in which does not allocate memory, to check the update path with the heap locked"""
+
+    def __init__(self):
+        self.writes = 0
+        self.notifies = 0
+
+    def active(self, change=None):
+        pass
+
+    def irq(self, handler=None):
+        pass
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        pass
+
+    def gap_disconnect(self, conn_handle):
+        return True
+
+    def gatts_register_services(self, services):
+        return (MOCK_BATTERY_LEVEL_HANDLE, MOCK_BATTERY_LEVEL_FORMAT_HANDLE),
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self.writes += 1
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        self.notifies += 1
+
+
+@unittest.skipUnless(hasattr(micropython, 'heap_lock'), 'needs the micropython unix port')
+class BatteryLevelUpdateAllocationTestCase(unittest.TestCase):
+    def test_should_not_allocate_when_setting_battery_level(self):
+        ble = NoAllocationBLE()
+        service = BatteryService(ble)
+        service.register_services()
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (124, _ADDR_TYPE, _ADDR))
+        service._irq_handler(_IRQ_CENTRAL_CONNECT, (125, _ADDR_TYPE, _ADDR))
+        allocated = False
+        micropython.heap_lock()
+        try:
+            for level in (10, 11.6, -3, 250, 99.5):
+                service.set_battery_level_percentage(level)
+        except MemoryError:
+            allocated = True
+        finally:
+            micropython.heap_unlock()
+        self.assertFalse(allocated)
+        self.assertEqual(ble.writes, 7)
+        self.assertEqual(ble.notifies, 10)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,38 @@
+"""
+    Unit Tests for the boot_profile module
+"""
+
+import unittest
+from boot_profile import BootProfile
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class BootProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.profile = BootProfile(clock=self.clock)
+
+    def test_should_mark_time_since_start(self):
+        self.clock.now += 150
+        self.profile.mark('imports')
+        self.clock.now += 50
+        self.profile.mark('advertising')
+        self.assertEqual(self.profile.marks, [('imports', 150), ('advertising', 200)])
+        self.assertEqual(self.profile.report(), {'imports': 150, 'advertising': 200})
+
+    def test_should_return_elapsed_time_to_a_step(self):
+        self.clock.now += 300
+        self.profile.mark('advertising')
+        self.assertEqual(self.profile.elapsed_us('advertising'), 300)
+        self.assertIsNone(self.profile.elapsed_us('first_refresh'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+    Unit Tests for the connections module
+"""
+
+import sys
+import unittest
+from connections import Connection, ConnectionPool
+
+_ADDR = b'\x11\x22\x33\x44\x55\x66'
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(2)
+
+    def test_should_keep_connection_state(self):
+        record = self.pool.acquire(5, 1, memoryview(_ADDR))
+        self.assertIs(self.pool.get(5), record)
+        self.assertEqual(record.addr_type, 1)
+        self.assertEqual(bytes(record.addr), _ADDR)
+        self.assertEqual(record.mtu, 0)
+        self.assertEqual(len(self.pool), 1)
+
+    @unittest.skipIf(sys.implementation.name == 'micropython', 'MicroPython does not enforce __slots__')
+    def test_should_not_keep_undeclared_attributes(self):
+        with self.assertRaises(AttributeError):
+            Connection().rssi = -60
+
+    def test_should_reject_connections_beyond_capacity(self):
+        self.pool.acquire(1, 0, _ADDR)
+        self.pool.acquire(2, 0, _ADDR)
+        self.assertIsNone(self.pool.acquire(3, 0, _ADDR))
+        self.assertEqual(self.pool.rejected, 1)
+        self.assertIsNone(self.pool.get(3))
+
+    def test_should_reuse_released_records(self):
+        first = self.pool.acquire(1, 0, _ADDR)
+        first.mtu = 100
+        self.pool.acquire(2, 0, _ADDR)
+        self.assertIs(self.pool.release(1), first)
+        self.assertIsNone(self.pool.get(1))
+        record = self.pool.acquire(3, 0, _ADDR)
+        self.assertIs(record, first)
+        self.assertEqual(record.mtu, 0)
+        self.assertIs(self.pool.get(3), first)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_should_ignore_release_of_unknown_connections(self):
+        self.assertIsNone(self.pool.release(7))
+        self.assertEqual(len(self.pool), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
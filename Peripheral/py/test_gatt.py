@@ -0,0 +1,58 @@
+"""
+    Unit Tests for the gatt module
+"""
+
+import unittest
+from mock.mock import create_mock
+from bluetooth import BLE, UUID, FLAG_READ, FLAG_WRITE, FLAG_NOTIFY
+from gatt import GattTable, Service, Characteristic, Descriptor, presentation_format, FORMAT_UINT8, UNIT_PERCENTAGE
+
+
+def _create_table():
+    level = Characteristic('level', UUID(0x2A19), FLAG_READ | FLAG_NOTIFY,
+                           descriptors=(Descriptor(UUID(0x2901), FLAG_READ, value=b'level'),), value=b'\x32')
+    control = Characteristic('control', UUID(0x2A9F), FLAG_WRITE)
+    name = Characteristic('name', UUID(0x2A00), FLAG_READ, value=b'esp32')
+    return GattTable((Service(UUID(0x180F), (level, control)), Service(UUID(0x1800), (name,))))
+
+
+class GattTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBLE = create_mock(BLE)
+        self.mockBLE.when('gatts_register_services', return_value=((10, 11, 13), (20,)))
+
+    def test_should_build_registration_definition(self):
+        self.assertEqual(_create_table().definition(), (
+            (UUID(0x180F), ((UUID(0x2A19), FLAG_READ | FLAG_NOTIFY, ((UUID(0x2901), FLAG_READ),)),
+                            (UUID(0x2A9F), FLAG_WRITE))),
+            (UUID(0x1800), ((UUID(0x2A00), FLAG_READ),)),
+        ))
+
+    def test_should_map_handles_to_characteristics_and_descriptors(self):
+        table = _create_table()
+        table.register(self.mockBLE)
+        self.assertEqual(table.handle('level'), 10)
+        self.assertEqual(table.handle('control'), 13)
+        self.assertEqual(table.handle('name'), 20)
+        self.assertIs(table.find(13), table.characteristic('control'))
+        self.assertEqual(table.find(11).uuid, UUID(0x2901))
+        self.assertIsNone(table.find(99))
+
+    def test_should_write_initial_values(self):
+        _create_table().register(self.mockBLE)
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_write', (10, b'\x32'), times=1))
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_write', (11, b'level'), times=1))
+        self.assertTrue(self.mockBLE.has_been_called_with('gatts_write', (20, b'esp32'), times=1))
+        self.assertTrue(self.mockBLE.has_been_called(method='gatts_write', times=3))
+
+    def test_should_add_services_before_registering(self):
+        table = _create_table()
+        table.add_service(Service(UUID(0x180A), (Characteristic('model', UUID(0x2A24), FLAG_READ),)))
+        self.assertEqual(len(table.definition()), 3)
+
+    def test_should_pack_presentation_format(self):
+        self.assertEqual(presentation_format(FORMAT_UINT8, unit=UNIT_PERCENTAGE), b'\x04\x00\xad\x27\x01\x00\x00')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+    Unit Tests for the history module
+"""
+
+import unittest
+from struct import unpack
+from history import HistoryLog, CHUNK_HEADER_SIZE, ENTRY_SIZE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _decode_chunk(chunk):
+    seq, age_s = unpack('<II', chunk[:CHUNK_HEADER_SIZE])
+    entries = [unpack('<HB', chunk[i:i + ENTRY_SIZE]) for i in range(CHUNK_HEADER_SIZE, len(chunk), ENTRY_SIZE)]
+    return seq, age_s, entries
+
+
+class HistoryLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.history = HistoryLog(4, clock=self.clock)
+
+    def _append(self, level, after_s):
+        self.clock.now += after_s * 1000
+        self.history.append(level)
+
+    def test_should_keep_readings_with_their_age(self):
+        self._append(50, 0)
+        self._append(49, 10)
+        self._append(48, 5)
+        self.clock.now += 2000
+        self.assertEqual(self.history.entries(), [(0, 17, 50), (1, 7, 49), (2, 2, 48)])
+        self.assertEqual(self.history.entries(2), [(2, 2, 48)])
+
+    def test_should_overwrite_the_oldest_readings_when_full(self):
+        for level in range(6):
+            self._append(level, 1)
+        self.assertEqual(len(self.history), 4)
+        self.assertEqual(self.history.first_seq, 2)
+        self.assertEqual(self.history.next_seq(), 6)
+        self.assertEqual(self.history.entries(), [(2, 3, 2), (3, 2, 3), (4, 1, 4), (5, 0, 5)])
+
+    def test_should_not_accumulate_rounding_errors(self):
+        for _ in range(3):
+            self.clock.now += 1500
+            self.history.append(10)
+        self.assertEqual([age for _, age, _ in self.history.entries()], [3, 2, 0])
+
+    def test_should_split_in_chunks(self):
+        for level in (50, 49, 48):
+            self._append(level, 60)
+        chunk, next_seq = self.history.chunk(0, CHUNK_HEADER_SIZE + 2 * ENTRY_SIZE)
+        self.assertEqual(_decode_chunk(chunk), (0, 120, [(0, 50), (60, 49)]))
+        self.assertEqual(next_seq, 2)
+        chunk, next_seq = self.history.chunk(next_seq, CHUNK_HEADER_SIZE + 2 * ENTRY_SIZE)
+        self.assertEqual(_decode_chunk(chunk), (2, 0, [(0, 48)]))
+        self.assertEqual(next_seq, 3)
+
+    def test_should_mark_the_end_with_an_empty_chunk(self):
+        self._append(50, 0)
+        chunk, next_seq = self.history.chunk(1, 20)
+        self.assertEqual(_decode_chunk(chunk), (1, 0, []))
+        self.assertEqual(next_seq, 1)
+
+    def test_should_resume_from_the_oldest_reading_kept(self):
+        for level in range(6):
+            self._append(level, 1)
+        chunk, next_seq = self.history.chunk(0, 20)
+        self.assertEqual(_decode_chunk(chunk)[0], 2)
+        self.assertEqual(next_seq, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+    Unit Tests for the instrumentation module
+"""
+
+import unittest
+from struct import unpack
+from instrumentation import Histogram, Instrumentation, COUNTERS, DIAGNOSTICS_SIZE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_should_record_values_in_buckets(self):
+        histogram = Histogram((10, 100))
+        for value in (5, 10, 11, 100, 1000):
+            histogram.record(value)
+        self.assertEqual(list(histogram.buckets), [2, 2, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.max, 1000)
+        self.assertEqual(histogram.average(), 225)
+
+    def test_should_average_zero_when_empty(self):
+        self.assertEqual(Histogram().stats(), {'count': 0, 'avg': 0, 'max': 0, 'buckets': [0] * 9})
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.instrumentation = Instrumentation(clock=self.clock)
+
+    def test_should_count(self):
+        self.instrumentation.count('connects')
+        self.instrumentation.count('connects')
+        self.assertEqual(self.instrumentation.stats()['connects'], 2)
+        self.assertEqual(self.instrumentation.stats()['gatts_notify'], 0)
+
+    def test_should_record_elapsed_time(self):
+        start = self.instrumentation.start()
+        self.clock.now += 150
+        self.instrumentation.elapsed('irq_us', start)
+        stats = self.instrumentation.stats()['irq_us']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['max'], 150)
+
+    def test_should_report_free_heap(self):
+        self.assertIn('mem_free', self.instrumentation.stats())
+
+    def test_should_pack_counters_and_latencies(self):
+        self.instrumentation.count('gatts_notify_failures')
+        start = self.instrumentation.start()
+        self.clock.now += 300
+        self.instrumentation.elapsed('refresh_us', start)
+        packed = self.instrumentation.pack()
+        self.assertEqual(len(packed), DIAGNOSTICS_SIZE)
+        values = unpack('<%dI' % (DIAGNOSTICS_SIZE // 4), packed)
+        self.assertEqual(values[COUNTERS.index('gatts_notify_failures')], 1)
+        self.assertEqual(values[len(COUNTERS):len(COUNTERS) + 4], (0, 0, 300, 300))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+    Unit Tests for the irq_queue module
+"""
+
+import unittest
+from irq_queue import EventQueue
+
+
+class EventQueueTestCase(unittest.TestCase):
+    def test_should_get_events_in_order(self):
+        queue = EventQueue(4)
+        queue.put(1, 10)
+        queue.put(4, 11, 22)
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.get(), (1, 10, 0))
+        self.assertEqual(queue.get(), (4, 11, 22))
+        self.assertEqual(len(queue), 0)
+
+    def test_should_raise_when_empty(self):
+        with self.assertRaises(IndexError):
+            EventQueue(2).get()
+
+    def test_should_count_overflows_when_full(self):
+        queue = EventQueue(3)
+        results = [queue.put(1, i) for i in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(queue.counters(), {'enqueued': 3, 'overflows': 2, 'high_water': 3})
+        self.assertEqual(queue.get(), (1, 0, 0))
+
+    def test_should_keep_reserved_slots_for_reserved_events(self):
+        queue = EventQueue(4, reserved=2, reserved_events=(1, 2))
+        results = [queue.put(4, i) for i in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertTrue(queue.put(1, 10))
+        self.assertTrue(queue.put(2, 10))
+        self.assertFalse(queue.put(1, 11))
+        self.assertEqual(queue.overflows, 2)
+        self.assertEqual([queue.get()[0] for _ in range(4)], [4, 4, 1, 2])
+
+    def test_should_wrap_around(self):
+        queue = EventQueue(2)
+        for i in range(10):
+            queue.put(2, i)
+            self.assertEqual(queue.get(), (2, i, 0))
+        self.assertEqual(queue.high_water, 1)
+
+    def test_should_copy_event_data(self):
+        queue = EventQueue(2, data_size=6)
+        address = bytearray(b'\x01\x02\x03\x04\x05\x06')
+        queue.put(1, 10, 0, memoryview(address))
+        address[0] = 0xFF  # buffer reused by the stack once the IRQ returns
+        data = bytearray(6)
+        self.assertEqual(queue.get(data), (1, 10, 0))
+        self.assertEqual(data, b'\x01\x02\x03\x04\x05\x06')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+    Unit Tests for the notification_policy module
+"""
+
+import unittest
+from connections import Connection
+from notification_policy import NotificationPolicy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class NotificationPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_should_suppress_unchanged_values(self):
+        policy = NotificationPolicy(clock=self.clock)
+        self.assertTrue(policy.update(10))
+        self.assertFalse(policy.update(10))
+        self.assertTrue(policy.update(11))
+        self.assertEqual(policy.counters()['suppressed_unchanged'], 1)
+
+    def test_should_accept_unchanged_values_if_not_suppressing(self):
+        policy = NotificationPolicy(suppress_unchanged=False, clock=self.clock)
+        policy.add_central(1)
+        self.assertTrue(policy.update(10))
+        policy.notified(1)
+        self.assertTrue(policy.update(10))
+        self.assertEqual(policy.due_centrals(), [1])
+
+    def test_should_notify_every_central_on_update(self):
+        policy = NotificationPolicy(clock=self.clock)
+        policy.add_central(1)
+        policy.add_central(2)
+        policy.update(10)
+        self.assertEqual(sorted(policy.due_centrals()), [1, 2])
+        policy.notified(1)
+        policy.notified(2)
+        self.assertFalse(policy.pending())
+        self.assertEqual(policy.counters()['sent'], 2)
+
+    def test_should_rate_limit_each_central(self):
+        policy = NotificationPolicy(min_interval_ms=1000, clock=self.clock)
+        policy.add_central(1)
+        policy.update(10)
+        policy.notified(1)
+        self.clock.now = 500
+        policy.update(11)
+        self.assertEqual(policy.due_centrals(True), [])
+        self.assertTrue(policy.pending())
+        self.assertEqual(policy.counters()['rate_limited'], 1)
+        self.clock.now = 1000
+        self.assertEqual(policy.due_centrals(), [1])
+
+    def test_should_pace_with_the_connection_record(self):
+        policy = NotificationPolicy(min_interval_ms=1000, clock=self.clock)
+        record = Connection()
+        record.last_notify_ms = 0
+        policy.add_central(1, record)
+        self.clock.now = 500
+        policy.update(10)
+        self.assertEqual(policy.due_centrals(), [])
+        self.clock.now = 1000
+        self.assertEqual(policy.due_centrals(), [1])
+        policy.notified(1)
+        self.assertEqual(record.last_notify_ms, 1000)
+
+    def test_should_coalesce_updates_inside_window(self):
+        policy = NotificationPolicy(coalesce_window_ms=100, clock=self.clock)
+        policy.add_central(1)
+        policy.update(10)
+        self.assertEqual(policy.due_centrals(True), [1])
+        policy.notified(1)
+        self.clock.now = 10
+        policy.update(11)
+        self.assertEqual(policy.due_centrals(True), [])
+        self.clock.now = 20
+        policy.update(12)
+        self.assertEqual(policy.due_centrals(True), [])
+        self.assertEqual(policy.counters()['coalesced'], 2)
+        self.clock.now = 100
+        self.assertEqual(policy.due_centrals(), [1])
+        policy.notified(1)
+        self.assertEqual(policy.value, 12)
+
+    def test_should_not_notify_central_with_value_already_sent(self):
+        policy = NotificationPolicy(coalesce_window_ms=100, clock=self.clock)
+        policy.add_central(1)
+        policy.update(10)
+        policy.notified(1)
+        policy.update(11)
+        policy.update(10)
+        self.clock.now = 100
+        self.assertEqual(policy.due_centrals(), [])
+        self.assertFalse(policy.pending())
+
+    def test_should_forget_disconnected_centrals(self):
+        policy = NotificationPolicy(clock=self.clock)
+        policy.add_central(1)
+        policy.remove_central(1)
+        policy.update(10)
+        self.assertEqual(policy.due_centrals(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
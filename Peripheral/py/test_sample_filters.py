@@ -0,0 +1,59 @@
+"""
+    Unit Tests for the sample_filters module
+"""
+
+import unittest
+from sample_filters import SampleRing, MovingAverageFilter, MedianFilter, EMAFilter
+
+
+def _ring(size, samples):
+    ring = SampleRing(size)
+    for sample in samples:
+        ring.append(sample)
+    return ring
+
+
+class SampleRingTestCase(unittest.TestCase):
+    def test_should_keep_samples_until_full(self):
+        ring = _ring(4, (1, 2))
+        self.assertEqual(ring.count, 2)
+        self.assertEqual(list(ring.values()), [1, 2])
+        self.assertEqual(ring.latest(), 2)
+
+    def test_should_overwrite_oldest_samples(self):
+        ring = _ring(3, (1, 2, 3, 4, 5))
+        self.assertEqual(ring.count, 3)
+        self.assertEqual(list(ring.values()), [3, 4, 5])
+        self.assertEqual(ring.total, 12)
+        self.assertEqual(ring.latest(), 5)
+
+
+class SampleFiltersTestCase(unittest.TestCase):
+    def test_should_average_samples(self):
+        self.assertEqual(MovingAverageFilter().apply(_ring(4, (10, 20, 30, 40, 50))), 35)
+
+    def test_should_round_averages_to_the_nearest_integer(self):
+        self.assertIs(type(MovingAverageFilter().apply(_ring(3, (10, 10, 11)))), int)
+        self.assertEqual(MovingAverageFilter().apply(_ring(3, (10, 10, 11))), 10)
+        self.assertEqual(MovingAverageFilter().apply(_ring(2, (10, 11))), 11)
+        self.assertEqual(MedianFilter().apply(_ring(2, (10, 11))), 11)
+
+    def test_should_take_median_of_samples(self):
+        self.assertEqual(MedianFilter().apply(_ring(3, (100, 2, 3))), 3)
+        self.assertEqual(MedianFilter().apply(_ring(4, (100, 2, 4, 0))), 3)
+
+    def test_should_smooth_samples_exponentially(self):
+        ema = EMAFilter(alpha=0.5)
+        ring = SampleRing(1)
+        ring.append(100)
+        self.assertEqual(ema.apply(ring), 100)
+        ring.append(200)
+        self.assertEqual(ema.apply(ring), 150)
+        ring.append(200)
+        self.assertEqual(ema.apply(ring), 175)
+        ring.append(176)
+        self.assertEqual(ema.apply(ring), 176)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+    Unit Tests for the scheduler module
+"""
+
+import unittest
+from scheduler import AdaptiveScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedTask:
+    """Task reporting a change on the given runs, taking busy_ms each time it runs"""
+
+    def __init__(self, clock, changes=(), busy_ms=2):
+        self.clock = clock
+        self.changes = changes
+        self.busy_ms = busy_ms
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        self.clock.now += self.busy_ms
+        return self.runs in self.changes
+
+
+class AdaptiveSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.centrals = 1
+
+    def _scheduler(self, task):
+        return AdaptiveScheduler(task, lambda: self.centrals, min_period_ms=1000, max_period_ms=8000,
+                                 heartbeat_ms=60000, clock=self.clock)
+
+    def _run_for(self, scheduler, duration_ms):
+        end = self.clock.now + duration_ms
+        while self.clock.now < end:
+            self.clock.now += scheduler.run()
+
+    def test_should_back_off_exponentially_while_stable(self):
+        scheduler = self._scheduler(ScriptedTask(self.clock))
+        self.assertEqual([scheduler.run() for _ in range(5)], [2000, 4000, 8000, 8000, 8000])
+
+    def test_should_sample_fast_while_changing(self):
+        scheduler = self._scheduler(ScriptedTask(self.clock, changes=(1, 2, 3, 4)))
+        self.assertEqual([scheduler.run() for _ in range(4)], [1000, 1000, 1000, 1000])
+        self.assertEqual(scheduler.run(), 2000)
+        self.assertEqual(scheduler.stats()['changes'], 4)
+
+    def test_should_go_back_to_fast_sampling_on_change(self):
+        scheduler = self._scheduler(ScriptedTask(self.clock, changes=(4,)))
+        self.assertEqual([scheduler.run() for _ in range(4)], [2000, 4000, 8000, 1000])
+
+    def test_should_drop_to_heartbeat_without_centrals(self):
+        self.centrals = 0
+        scheduler = self._scheduler(ScriptedTask(self.clock, changes=(1,)))
+        self.assertEqual(scheduler.run(), 60000)
+
+    def test_should_count_wakeups_and_busy_time(self):
+        scheduler = self._scheduler(ScriptedTask(self.clock, busy_ms=3))
+        self._run_for(scheduler, 3600000)
+        # 2 + 4 + 8 s and then every 8 s during an hour, instead of 1800 wake-ups with a fixed 2 s period
+        self.assertTrue(scheduler.wakeups < 460)
+        self.assertEqual(scheduler.busy_ms, scheduler.wakeups * 3)
+
+    def test_should_wake_up_once_a_minute_without_centrals(self):
+        self.centrals = 0
+        scheduler = self._scheduler(ScriptedTask(self.clock))
+        self._run_for(scheduler, 3600000)
+        self.assertEqual(scheduler.wakeups, 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,8 +4,39 @@
 
 import unittest
 from mock.mock import create_mock, Mock
-from voltage_reader import VoltageReader
+from voltage_reader import VoltageReader, MultiChannelReader, build_lut, scale_curve, LI_ION_CURVE
+from sample_filters import MovingAverageFilter, MedianFilter
 from ble_service import BatteryService
+from instrumentation import Instrumentation
+from history import HistoryLog
+from bluetooth import BLE
+
+
+def _read_driven_service(voltage_reader, channels=1):
+    """Battery service wired as main.py does in the read driven mode, returning it with its scheduled calls"""
+    scheduled = []
+    service = BatteryService(BLE(), schedule=lambda function, arg: scheduled.append((function, arg)),
+                             channels=channels)
+    service.register_services()
+    service.on_read_request = lambda conn_handle: voltage_reader.sample_if_stale(service)
+    service.on_read_refreshed = lambda conn_handle: voltage_reader.push(service)
+    return service, scheduled
+
+
+def _run(scheduled):
+    pending = scheduled[:]
+    del scheduled[:]
+    for function, arg in pending:
+        function(arg)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
 
 # mock ADC locally
 class ADC:
@@ -21,6 +52,19 @@ class ADC:
 
 _MOCK_UPPER_LIMIT = 511
 
+
+class SequenceADC:
+    """ADC returning the given readings, one after the other"""
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.reads = 0
+
+    def read(self):
+        reading = self.readings[self.reads % len(self.readings)]
+        self.reads += 1
+        return reading
+
 class VoltageReaderTestCase(unittest.TestCase):
     def setUp(self):
         self.mockADC = create_mock(ADC)
@@ -62,5 +106,275 @@ class VoltageReaderTestCase(unittest.TestCase):
         self.assertEqual(voltage_reader.last_read, _MOCK_UPPER_LIMIT)
 
 
+    def test_should_average_oversampled_reads(self):
+        adc = SequenceADC([100, 101, 103, 104])
+        voltage_reader = VoltageReader(adc, _MOCK_UPPER_LIMIT, oversampling=4)
+        voltage_reader.refresh(self.mockBS)
+        self.assertEqual(adc.reads, 4)
+        self.assertEqual(voltage_reader.last_read, 102)
+
+    def test_should_filter_samples(self):
+        voltage_reader = VoltageReader(SequenceADC([100, 300, 110]), _MOCK_UPPER_LIMIT, window=3,
+                                       sample_filter=MedianFilter())
+        for _ in range(3):
+            voltage_reader.refresh(self.mockBS)
+        self.assertEqual(voltage_reader.last_read, 110)
+
+    def test_should_not_refresh_battery_service_inside_hysteresis_deadband(self):
+        # 1 LSB is ~0.2%, 5 LSB ~1%
+        voltage_reader = VoltageReader(SequenceADC([255, 256, 254, 256, 261]), _MOCK_UPPER_LIMIT, hysteresis=1)
+        for _ in range(4):
+            voltage_reader.refresh(self.mockBS)
+        self.assertTrue(self.mockBS.has_been_called(method='set_battery_level_percentage', times=1))
+        voltage_reader.refresh(self.mockBS)
+        self.assertTrue(self.mockBS.has_been_called(method='set_battery_level_percentage', times=2))
+        self.assertTrue(self.mockBS.has_been_called_with('set_battery_level_percentage', (51,)))
+
+    def test_should_smooth_flapping_reads_with_moving_average(self):
+        voltage_reader = VoltageReader(SequenceADC([255, 256]), _MOCK_UPPER_LIMIT, window=4,
+                                       sample_filter=MovingAverageFilter(), hysteresis=0.5)
+        for _ in range(20):
+            voltage_reader.refresh(self.mockBS)
+        self.assertTrue(self.mockBS.has_been_called(method='set_battery_level_percentage', times=1))
+
+    def test_should_return_whether_the_percentage_changed(self):
+        voltage_reader = VoltageReader(SequenceADC([255, 255, 256]), _MOCK_UPPER_LIMIT)
+        self.assertTrue(voltage_reader.refresh(self.mockBS))
+        self.assertFalse(voltage_reader.refresh(self.mockBS))
+        self.assertTrue(voltage_reader.refresh(self.mockBS))
+
+    def test_should_measure_refreshes_when_instrumented(self):
+        instrumentation = Instrumentation()
+        voltage_reader = VoltageReader(SequenceADC([255, 256]), _MOCK_UPPER_LIMIT, instrumentation=instrumentation)
+        for _ in range(3):
+            voltage_reader.refresh(self.mockBS)
+        stats = instrumentation.stats()
+        self.assertEqual(stats['refreshes'], 3)
+        self.assertEqual(stats['refresh_us']['count'], 3)
+
+    def test_should_record_pushed_percentages_in_history(self):
+        history = HistoryLog(8)
+        voltage_reader = VoltageReader(SequenceADC([255, 255, 511]), _MOCK_UPPER_LIMIT, history=history)
+        for _ in range(3):
+            voltage_reader.refresh(self.mockBS)
+        self.assertEqual([level for _, _, level in history.entries()], [50, 100])
+
+    def test_should_serve_cached_value_within_ttl(self):
+        clock = FakeClock()
+        adc = SequenceADC([255, 511])
+        voltage_reader = VoltageReader(adc, _MOCK_UPPER_LIMIT, ttl_ms=2000, clock=clock)
+        self.assertTrue(voltage_reader.refresh_if_stale(self.mockBS))
+        clock.now = 1999
+        self.assertFalse(voltage_reader.refresh_if_stale(self.mockBS))
+        self.assertEqual(adc.reads, 1)
+        self.assertEqual(voltage_reader.cached_reads, 1)
+        clock.now = 2000
+        self.assertTrue(voltage_reader.refresh_if_stale(self.mockBS))
+        self.assertEqual(adc.reads, 2)
+
+    def test_should_answer_the_first_read_after_an_idle_period_with_a_fresh_value(self):
+        clock = FakeClock()
+        history = HistoryLog(8)
+        voltage_reader = VoltageReader(SequenceADC([255, 511]), _MOCK_UPPER_LIMIT, ttl_ms=2000, clock=clock,
+                                       history=history)
+        service, scheduled = _read_driven_service(voltage_reader)
+        voltage_reader.refresh(service)
+        conn_handle = service.bt.connect_central()
+        _run(scheduled)
+        clock.now = 600000
+        self.assertEqual(service.bt.read_from_central(conn_handle, service.battery_level_value_handle), b'\x64')
+        # the notification and the history follow, out of the IRQ
+        self.assertEqual(service.bt.connection(conn_handle).notified, 0)
+        self.assertEqual(len(history.entries()), 1)
+        _run(scheduled)
+        self.assertEqual(service.bt.connection(conn_handle).notified, 1)
+        self.assertEqual([level for _, _, level in history.entries()], [50, 100])
+        clock.now = 601000
+        self.assertEqual(service.bt.read_from_central(conn_handle, service.battery_level_value_handle), b'\x64')
+        self.assertEqual(scheduled, [])
+        self.assertEqual(voltage_reader.cached_reads, 1)
+
+    def test_should_push_once_what_was_written_on_a_read(self):
+        clock = FakeClock()
+        voltage_reader = VoltageReader(SequenceADC([255, 511, 511]), _MOCK_UPPER_LIMIT, ttl_ms=2000, clock=clock)
+        service, scheduled = _read_driven_service(voltage_reader)
+        self.assertTrue(voltage_reader.sample_if_stale(service))
+        clock.now = 3000
+        self.assertTrue(voltage_reader.sample_if_stale(service))
+        # a periodic refresh before the deferred push pushes the level itself
+        self.assertTrue(voltage_reader.refresh(self.mockBS))
+        self.assertTrue(self.mockBS.has_been_called_with('set_battery_level_percentage', (100,), times=1))
+        voltage_reader.push(self.mockBS)
+        self.assertTrue(self.mockBS.has_been_called(method='set_battery_level_percentage', times=1))
+
+    def test_should_restart_ttl_on_periodic_refresh(self):
+        clock = FakeClock()
+        adc = SequenceADC([255])
+        voltage_reader = VoltageReader(adc, _MOCK_UPPER_LIMIT, ttl_ms=2000, clock=clock)
+        clock.now = 5000
+        voltage_reader.refresh(self.mockBS)
+        clock.now = 6000
+        voltage_reader.refresh_if_stale(self.mockBS)
+        self.assertEqual(adc.reads, 1)
+
+
+def interpolate(curve, x):
+    """Reference (floating point) interpolation of the curve"""
+    if x <= curve[0][0]:
+        return curve[0][1]
+    for (x0, p0), (x1, p1) in zip(curve, curve[1:]):
+        if x <= x1:
+            return p0 + (p1 - p0) * (x - x0) / (x1 - x0)
+    return curve[-1][1]
+
+
+class LookupTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBS = create_mock(BatteryService)
+
+    def test_should_keep_a_percentage_per_adc_code(self):
+        lut = build_lut(_MOCK_UPPER_LIMIT, ((0, 0), (_MOCK_UPPER_LIMIT, 100)))
+        self.assertIsInstance(lut, bytearray)
+        self.assertEqual(len(lut), 512)
+        self.assertEqual((lut[0], lut[255], lut[511]), (0, 50, 100))
+
+    def test_should_match_the_reference_curve(self):
+        curve = scale_curve(LI_ION_CURVE, 4400, _MOCK_UPPER_LIMIT)
+        lut = build_lut(_MOCK_UPPER_LIMIT, curve)
+        for code in range(_MOCK_UPPER_LIMIT + 1):
+            self.assertEqual(lut[code], int(interpolate(curve, code) + 0.5))
+        for code, percentage in curve:
+            self.assertEqual(lut[code], percentage)
+
+    def test_should_stay_close_to_the_voltage_curve(self):
+        # the points are rounded to the nearest code (~8.6 mV), where the curve is steepest that is ~2%
+        lut = build_lut(_MOCK_UPPER_LIMIT, scale_curve(LI_ION_CURVE, 4400, _MOCK_UPPER_LIMIT))
+        for millivolts in range(3000, 4201, 5):
+            code = round(millivolts * _MOCK_UPPER_LIMIT / 4400)
+            expected = interpolate(LI_ION_CURVE, code * 4400 / _MOCK_UPPER_LIMIT)
+            self.assertTrue(abs(lut[code] - expected) <= 2, millivolts)
+
+    def test_should_be_flat_beyond_the_curve(self):
+        lut = build_lut(_MOCK_UPPER_LIMIT, ((100, 10), (400, 90)))
+        self.assertEqual(set(lut[:101]), {10})
+        self.assertEqual(set(lut[400:]), {90})
+        self.assertEqual(sorted(lut), list(lut))
+
+    def test_should_convert_reads_through_the_calibration_curve(self):
+        voltage_reader = VoltageReader(SequenceADC([445]), _MOCK_UPPER_LIMIT,
+                                       curve=scale_curve(LI_ION_CURVE, 4400, _MOCK_UPPER_LIMIT))
+        voltage_reader.refresh(self.mockBS)
+        self.assertTrue(self.mockBS.has_been_called_with('set_battery_level_percentage', (50,), times=1))
+
+    def test_should_clamp_reads_above_the_upper_limit(self):
+        voltage_reader = VoltageReader(SequenceADC([600, 600, 700, 650]), _MOCK_UPPER_LIMIT, oversampling=2,
+                                       window=2, sample_filter=MovingAverageFilter())
+        voltage_reader.refresh(self.mockBS)
+        voltage_reader.refresh(self.mockBS)
+        self.assertEqual(voltage_reader.last_percentage, 100)
+        self.assertTrue(self.mockBS.has_been_called_with('set_battery_level_percentage', (100,)))
+
+    def test_should_round_filtered_reads(self):
+        voltage_reader = VoltageReader(SequenceADC([255]), _MOCK_UPPER_LIMIT)
+        self.assertEqual(voltage_reader.percentage(255.6), 50)
+        self.assertEqual(voltage_reader.percentage(510.6), 100)
+        self.assertEqual(voltage_reader.percentage(600), 100)
+
+    def test_should_push_the_level_again_when_calibrated(self):
+        voltage_reader = VoltageReader(SequenceADC([445]), _MOCK_UPPER_LIMIT)
+        voltage_reader.refresh(self.mockBS)
+        self.assertTrue(self.mockBS.has_been_called_with('set_battery_level_percentage', (87,), times=1))
+        voltage_reader.calibrate(scale_curve(LI_ION_CURVE, 4400, _MOCK_UPPER_LIMIT))
+        self.assertTrue(voltage_reader.refresh(self.mockBS))
+        self.assertTrue(self.mockBS.has_been_called_with('set_battery_level_percentage', (50,), times=1))
+
+
+class MultiChannelReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mockBS = create_mock(BatteryService)
+
+    def test_should_read_every_channel_in_one_pass(self):
+        reads = []
+
+        class LoggingADC:
+            def __init__(self, channel, reading):
+                self.channel = channel
+                self.reading = reading
+
+            def read(self):
+                reads.append(self.channel)
+                return self.reading
+
+        voltage_reader = MultiChannelReader([LoggingADC(0, 511), LoggingADC(1, 255)], _MOCK_UPPER_LIMIT,
+                                            oversampling=2)
+        voltage_reader.refresh(self.mockBS)
+        self.assertEqual(reads, [0, 1, 0, 1])
+        self.assertEqual(list(voltage_reader.samples), [511, 255])
+        self.assertEqual(list(voltage_reader.levels), [100, 50])
+
+    def test_should_push_all_the_changed_channels_at_once(self):
+        voltage_reader = MultiChannelReader([SequenceADC([511]), SequenceADC([255]), SequenceADC([0])],
+                                            _MOCK_UPPER_LIMIT)
+        self.assertEqual(voltage_reader.refresh(self.mockBS), 0b111)
+        self.assertTrue(self.mockBS.has_been_called_with('set_channel_levels', (b'\x64\x32\x00', 0b111), times=1))
+        self.assertEqual(voltage_reader.refresh(self.mockBS), 0)
+        self.assertTrue(self.mockBS.has_been_called(method='set_channel_levels', times=1))
+
+    def test_should_only_flag_the_changed_channels(self):
+        voltage_reader = MultiChannelReader([SequenceADC([511]), SequenceADC([255, 0])], _MOCK_UPPER_LIMIT)
+        voltage_reader.refresh(self.mockBS)
+        self.assertEqual(voltage_reader.refresh(self.mockBS), 0b10)
+        self.assertTrue(self.mockBS.has_been_called_with('set_channel_levels', (b'\x64\x00', 0b10), times=1))
+
+    def test_should_apply_hysteresis_to_every_channel(self):
+        voltage_reader = MultiChannelReader([SequenceADC([255, 258]), SequenceADC([255, 261])], _MOCK_UPPER_LIMIT,
+                                            hysteresis=1)
+        voltage_reader.refresh(self.mockBS)
+        self.assertEqual(voltage_reader.refresh(self.mockBS), 0b10)
+        self.assertEqual(list(voltage_reader.levels), [50, 51])
+
+    def test_should_push_every_channel_again_when_calibrated(self):
+        voltage_reader = MultiChannelReader([SequenceADC([445]), SequenceADC([511])], _MOCK_UPPER_LIMIT)
+        voltage_reader.refresh(self.mockBS)
+        voltage_reader.calibrate(scale_curve(LI_ION_CURVE, 4400, _MOCK_UPPER_LIMIT))
+        self.assertEqual(voltage_reader.refresh(self.mockBS), 0b11)
+        self.assertEqual(list(voltage_reader.levels), [50, 100])
+
+    def test_should_record_the_first_channel_in_history(self):
+        history = HistoryLog(8)
+        voltage_reader = MultiChannelReader([SequenceADC([255, 255, 511]), SequenceADC([0, 511])],
+                                            _MOCK_UPPER_LIMIT, history=history)
+        for _ in range(3):
+            voltage_reader.refresh(self.mockBS)
+        self.assertEqual([level for _, _, level in history.entries()], [50, 100])
+
+    def test_should_serve_cached_values_within_ttl(self):
+        clock = FakeClock()
+        adcs = [SequenceADC([255]), SequenceADC([511])]
+        voltage_reader = MultiChannelReader(adcs, _MOCK_UPPER_LIMIT, ttl_ms=2000, clock=clock)
+        voltage_reader.refresh_if_stale(self.mockBS)
+        clock.now = 1000
+        self.assertEqual(voltage_reader.refresh_if_stale(self.mockBS), 0)
+        self.assertEqual([adc.reads for adc in adcs], [1, 1])
+        self.assertEqual(voltage_reader.cached_reads, 1)
+
+    def test_should_write_the_changed_channels_on_a_read(self):
+        clock = FakeClock()
+        voltage_reader = MultiChannelReader([SequenceADC([255]), SequenceADC([511, 255])], _MOCK_UPPER_LIMIT,
+                                            ttl_ms=2000, clock=clock)
+        service, scheduled = _read_driven_service(voltage_reader, channels=2)
+        voltage_reader.refresh(service)
+        conn_handle = service.bt.connect_central()
+        _run(scheduled)
+        clock.now = 5000
+        value_handle = service.channel_value_handles[1]
+        self.assertEqual(service.bt.read_from_central(conn_handle, value_handle), b'\x32')
+        self.assertEqual(service.bt.connection(conn_handle).notified, 0)
+        _run(scheduled)
+        self.assertEqual(service.bt.connection(conn_handle).notified, 1)
+        self.assertEqual(voltage_reader.push(service), None)
+        self.assertEqual(service.bt.connection(conn_handle).notified, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
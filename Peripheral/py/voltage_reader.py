@@ -1,19 +1,268 @@
 """
     Voltage reader using ADC
 """
+from array import array
+from micropython import const
+from time import ticks_ms, ticks_diff
+from sample_filters import SampleRing
+
+_UNKNOWN = const(255)  # level of a channel not pushed yet
+
+# reference discharge curve of a Li-ion cell at a low load, as (millivolts, percentage) points
+LI_ION_CURVE = ((3000, 0), (3300, 5), (3600, 10), (3700, 20), (3750, 30), (3790, 40), (3830, 50), (3870, 60),
+                (3920, 70), (3970, 80), (4080, 90), (4200, 100))
+
+
+def scale_curve(curve, full_scale, upper_limit):
+    """Converts the (voltage, percentage) points of curve into (ADC code, percentage) ones, full_scale being
+    the voltage (in the units of curve, behind any divider) read as upper_limit"""
+    return tuple(((voltage * upper_limit + full_scale // 2) // full_scale, percentage)
+                 for voltage, percentage in curve)
+
+
+def build_lut(upper_limit, curve):
+    """Returns the percentage for every ADC code (0 to upper_limit), interpolated in fixed point between the
+    (ADC code, percentage) points of curve, sorted by code, and flat beyond its first and last points"""
+    lut = bytearray(upper_limit + 1)
+    x0, p0 = curve[0]
+    segment = 1
+    for code in range(upper_limit + 1):
+        while segment < len(curve) and curve[segment][0] <= code:
+            x0, p0 = curve[segment]
+            segment += 1
+        if code <= x0 or segment == len(curve):
+            lut[code] = p0
+        else:
+            x1, p1 = curve[segment]
+            lut[code] = p0 + (2 * (p1 - p0) * (code - x0) + x1 - x0) // (2 * (x1 - x0))
+    return lut
 
 
 class VoltageReader:
 
-    def __init__(self, adc, upper_limit):
+    def __init__(self, adc, upper_limit, oversampling=1, window=1, sample_filter=None, hysteresis=0,
+                 instrumentation=None, history=None, ttl_ms=0, clock=ticks_ms, curve=None):
+        """oversampling: ADC reads averaged on each refresh, window: samples kept in the ring buffer,
+        sample_filter: filter applied to the ring buffer (latest sample if None),
+        hysteresis: minimum change in percentage, since the last one pushed, to refresh the battery service,
+        instrumentation: instrumentation.Instrumentation measuring the refreshes, nothing is measured if None,
+        history: history.HistoryLog recording every percentage pushed to the battery service,
+        ttl_ms: age of the last refresh below which refresh_if_stale does not sample again,
+        curve: (ADC code, percentage) calibration points, linear from 0 to upper_limit if None"""
         self.adc = adc
         self.upper_limit = upper_limit
+        self.oversampling = oversampling
+        self.samples = SampleRing(window)
+        self.sample_filter = sample_filter
+        self.hysteresis = hysteresis
+        self.last_read = None
+        self.last_percentage = None
+        self.instrumentation = instrumentation
+        self.history = history
+        self.ttl_ms = ttl_ms
+        self._clock = clock
+        self.last_refresh_ms = None
+        self.cached_reads = 0
+        self._pushed = True
+        self.calibrate(curve)
+
+    def calibrate(self, curve=None):
+        """Rebuilds the lookup table from the ADC code to the percentage, the next refresh pushes the level
+        again. See scale_curve to calibrate with a discharge curve in volts, e.g. LI_ION_CURVE"""
+        if curve is None:
+            curve = ((0, 0), (self.upper_limit, 100))
+        self.curve = curve
+        self._lut = build_lut(self.upper_limit, curve)
         self.last_read = None
+        self.last_percentage = None
+
+    def percentage(self, code):
+        return self._lut[min(round(code), self.upper_limit)]
 
     def refresh(self, battery_service=None):
-        voltage = self.adc.read()
-        if not self.last_read == voltage:
-            self.last_read = voltage
-            percentage = voltage / self.upper_limit * 100
-            if battery_service is not None:
-                battery_service.set_battery_level_percentage(percentage)
+        """Returns True if the percentage changed (and it was pushed to the battery service)"""
+        self.last_refresh_ms = self._clock()
+        if self.instrumentation is None:
+            return self._refresh(battery_service)
+        start = self.instrumentation.start()
+        changed = self._refresh(battery_service)
+        self.instrumentation.count('refreshes')
+        self.instrumentation.elapsed('refresh_us', start)
+        return changed
+
+    def refresh_if_stale(self, battery_service=None):
+        """Refreshes only if the last refresh is ttl_ms old, or older: a read gets a fresh enough value
+        without sampling the ADC every time"""
+        if self.last_refresh_ms is not None and ticks_diff(self._clock(), self.last_refresh_ms) < self.ttl_ms:
+            self.cached_reads += 1
+            return False
+        return self.refresh(battery_service)
+
+    def sample_if_stale(self, battery_service):
+        """For the read request IRQ, as it does not allocate: samples again if the last refresh is ttl_ms old,
+        or older, and writes a changed percentage in place (BatteryService.write_battery_level_percentage), so
+        the read gets it. Returns True if it changed, push then records and notifies it out of the IRQ"""
+        now = self._clock()
+        if self.last_refresh_ms is not None and ticks_diff(now, self.last_refresh_ms) < self.ttl_ms:
+            self.cached_reads += 1
+            return False
+        self.last_refresh_ms = now
+        if not self._update():
+            return False
+        self._pushed = False
+        battery_service.write_battery_level_percentage(self.last_percentage)
+        return True
+
+    def push(self, battery_service):
+        """Records and notifies the percentage written by sample_if_stale, unless a refresh already did"""
+        if not self._pushed:
+            self._push(battery_service)
+
+    def _refresh(self, battery_service):
+        if self._update() or not self._pushed:
+            self._push(battery_service)
+            return True
+        return False
+
+    def _update(self):
+        """Samples the ADC, returns True if the percentage changed (by the hysteresis at least)"""
+        voltage = self._filter(self._sample())
+        if self.last_read == voltage:
+            return False
+        self.last_read = voltage
+        percentage = self._lut[min(voltage, self.upper_limit)]
+        if self.last_percentage is not None and abs(percentage - self.last_percentage) < self.hysteresis:
+            return False
+        self.last_percentage = percentage
+        return True
+
+    def _push(self, battery_service):
+        self._pushed = True
+        if self.history is not None:
+            self.history.append(self.last_percentage)
+        if battery_service is not None:
+            battery_service.set_battery_level_percentage(self.last_percentage)
+
+    def _sample(self):
+        if self.oversampling == 1:
+            return self.adc.read()
+        total = 0
+        for _ in range(self.oversampling):
+            total += self.adc.read()
+        return (total + self.oversampling // 2) // self.oversampling
+
+    def _filter(self, sample):
+        self.samples.append(sample)
+        if self.sample_filter is None:
+            return sample
+        return self.sample_filter.apply(self.samples)
+
+
+class MultiChannelReader:
+    """Reads several ADCs (a channel each, e.g. one per cell) in a single pass, and pushes the channels that
+    changed to the battery service at once (see BatteryService.set_channel_levels)"""
+
+    def __init__(self, adcs, upper_limit, oversampling=1, hysteresis=0, instrumentation=None, history=None,
+                 ttl_ms=0, clock=ticks_ms, curve=None):
+        """The arguments are the ones of VoltageReader, shared by all the channels (with no sample filter).
+        history records the level of the first channel"""
+        self.adcs = adcs
+        self.upper_limit = upper_limit
+        self.oversampling = oversampling
+        self.hysteresis = hysteresis
+        self.instrumentation = instrumentation
+        self.history = history
+        self.ttl_ms = ttl_ms
+        self._clock = clock
+        # the last read and the last level pushed of every channel
+        self.samples = array('H', [0] * len(adcs))
+        self.levels = bytearray(len(adcs))
+        self._totals = array('I', [0] * len(adcs))
+        self.last_refresh_ms = None
+        self.cached_reads = 0
+        self._unpushed = 0  # channels written by sample_if_stale, not pushed yet
+        self.calibrate(curve)
+
+    def calibrate(self, curve=None):
+        """Rebuilds the lookup table (see VoltageReader.calibrate), the next refresh pushes every channel again"""
+        if curve is None:
+            curve = ((0, 0), (self.upper_limit, 100))
+        self.curve = curve
+        self._lut = build_lut(self.upper_limit, curve)
+        for channel in range(len(self.levels)):
+            self.levels[channel] = _UNKNOWN
+
+    def refresh(self, battery_service=None):
+        """Returns the bit mask of the channels whose level changed (and was pushed to the battery service)"""
+        self.last_refresh_ms = self._clock()
+        if self.instrumentation is None:
+            return self._refresh(battery_service)
+        start = self.instrumentation.start()
+        changed = self._refresh(battery_service)
+        self.instrumentation.count('refreshes')
+        self.instrumentation.elapsed('refresh_us', start)
+        return changed
+
+    def refresh_if_stale(self, battery_service=None):
+        """See VoltageReader.refresh_if_stale"""
+        if self.last_refresh_ms is not None and ticks_diff(self._clock(), self.last_refresh_ms) < self.ttl_ms:
+            self.cached_reads += 1
+            return 0
+        return self.refresh(battery_service)
+
+    def sample_if_stale(self, battery_service):
+        """See VoltageReader.sample_if_stale, the changed channels are written by
+        BatteryService.write_channel_levels. Returns their bit mask"""
+        now = self._clock()
+        if self.last_refresh_ms is not None and ticks_diff(now, self.last_refresh_ms) < self.ttl_ms:
+            self.cached_reads += 1
+            return 0
+        self.last_refresh_ms = now
+        changed = self._update()
+        if changed:
+            self._unpushed |= changed
+            battery_service.write_channel_levels(self.levels, changed)
+        return changed
+
+    def push(self, battery_service):
+        """See VoltageReader.push"""
+        if self._unpushed:
+            self._push(self._unpushed, battery_service)
+
+    def _refresh(self, battery_service):
+        changed = self._update() | self._unpushed
+        if changed:
+            self._push(changed, battery_service)
+        return changed
+
+    def _update(self):
+        """Samples every channel, returns the bit mask of the ones whose level changed"""
+        self._sample()
+        changed = 0
+        for channel in range(len(self.adcs)):
+            percentage = self._lut[self.samples[channel]]
+            last = self.levels[channel]
+            if last == _UNKNOWN or (percentage != last and abs(percentage - last) >= self.hysteresis):
+                self.levels[channel] = percentage
+                changed |= 1 << channel
+        return changed
+
+    def _push(self, changed, battery_service):
+        self._unpushed = 0
+        if self.history is not None and changed & 1:
+            self.history.append(self.levels[0])
+        if battery_service is not None:
+            battery_service.set_channel_levels(self.levels, changed)
+
+    def _sample(self):
+        """Oversamples all the channels in turn, into the samples array"""
+        adcs = self.adcs
+        totals = self._totals
+        for channel in range(len(adcs)):
+            totals[channel] = 0
+        for _ in range(self.oversampling):
+            for channel in range(len(adcs)):
+                totals[channel] += adcs[channel].read()
+        half = self.oversampling // 2
+        for channel in range(len(adcs)):
+            self.samples[channel] = min((totals[channel] + half) // self.oversampling, self.upper_limit)
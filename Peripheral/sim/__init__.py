@@ -0,0 +1,34 @@
+"""
+    Host-side simulation of the micropython BLE stack
+"""
+import sys
+
+
+def install(clock=None):
+    """Registers the simulated stack as the `bluetooth` module, the simulated `machine` module when the port does
+    not provide ADC and Timer, and the micropython shims on CPython.
+    clock: sim.clock.VirtualClock registered as the `time` module, it must be installed before importing the
+    peripheral modules (they take the ticks_* functions on import)"""
+    from sim import ble
+    sys.modules['bluetooth'] = ble
+    try:
+        import micropython
+    except ImportError:
+        from sim import runtime
+        sys.modules['micropython'] = runtime
+    try:
+        import machine
+        # run from the sim folder, sim/machine.py itself is found as `machine`: sim.machine must be the one used
+        port_machine = hasattr(machine, 'ADC') and hasattr(machine, 'Timer') and not hasattr(machine, 'adc_source')
+    except ImportError:
+        port_machine = False
+    if not port_machine:
+        from sim import machine
+        sys.modules['machine'] = machine
+    import time
+    if clock is not None:
+        sys.modules['time'] = clock
+        sys.modules['utime'] = clock
+    elif not hasattr(time, 'ticks_us'):
+        from sim import runtime
+        runtime.patch_time(time)
@@ -0,0 +1,325 @@
+"""
+    Simulated BLE stack, a pure python stand-in for the ubluetooth module
+
+    Besides the subset of the BLE API used by the peripheral, it offers simulation controls
+    (connect_central, disconnect_central, advance...) to play the role of the centrals
+"""
+from binascii import unhexlify
+
+FLAG_READ = 0x0002
+FLAG_WRITE_NO_RESPONSE = 0x0004
+FLAG_WRITE = 0x0008
+FLAG_NOTIFY = 0x0010
+
+# event codes of micropython 1.18+
+IRQ_CENTRAL_CONNECT = 1
+IRQ_CENTRAL_DISCONNECT = 2
+IRQ_GATTS_WRITE = 3
+IRQ_GATTS_READ_REQUEST = 4
+IRQ_SCAN_RESULT = 5
+IRQ_SCAN_DONE = 6
+IRQ_MTU_EXCHANGED = 21
+IRQ_CONNECTION_UPDATE = 27
+IRQ_ENCRYPTION_UPDATE = 28
+ADV_IND = 0x00
+ADV_NONCONN_IND = 0x03
+
+DEFAULT_QUEUE_DEPTH = 8
+DEFAULT_CONNECTION_INTERVAL_US = 30000
+DEFAULT_PACKETS_PER_EVENT = 4
+DEFAULT_MTU = 23
+# radio time estimate of an advertising event: the PDU (preamble, access address, header, address, payload and CRC)
+# sent on each of the 3 advertising channels at 1 Mbit/s, plus the listening window for scan/connection requests
+_ADVERTISING_PDU_OVERHEAD_BYTES = 16
+_ADVERTISING_CHANNEL_RX_US = 150
+_ADVERTISING_CHANNELS = 3
+
+
+class UUID(bytes):
+    """UUID stored, as in the real stack, as little endian bytes (2, 4 or 16 long)"""
+
+    def __new__(cls, value):
+        if isinstance(value, int):
+            data = value.to_bytes(2 if value <= 0xFFFF else 4, 'little')
+        elif isinstance(value, str):
+            data = bytes(reversed(unhexlify(value.replace('-', ''))))
+        else:
+            data = bytes(value)
+        if len(data) not in (2, 4, 16):
+            raise ValueError('invalid UUID')
+        return super().__new__(cls, data)
+
+    def __repr__(self):
+        if len(self) == 16:
+            return 'UUID(%r)' % bytes(self)
+        return 'UUID(0x%x)' % int.from_bytes(bytes(self), 'little')
+
+
+class SimulatedConnection:
+    """A connected central, receiving the notifications through a bounded queue"""
+
+    def __init__(self, conn_handle, addr_type, addr, queue_depth, interval_us, packets_per_event, now_us):
+        self.conn_handle = conn_handle
+        self.addr_type = addr_type
+        self.addr = addr
+        self.queue_depth = queue_depth
+        self.interval_us = interval_us
+        self.packets_per_event = packets_per_event
+        self.next_event_us = now_us + interval_us
+        self.mtu = DEFAULT_MTU
+        self.latency = 0
+        self.supervision_timeout_ms = 0
+        self.queue = []
+        self.notified = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.delivery_latency_us_total = 0
+        self.delivery_latency_us_max = 0
+        self.last_value = None
+        # value handles whose notifications the central enabled in their CCCD, which the stack keeps
+        self.subscriptions = set()
+
+    def enqueue(self, value_handle, data, now_us):
+        self.notified += 1
+        if len(self.queue) >= self.queue_depth:
+            self.dropped += 1
+            return False
+        self.queue.append((now_us, value_handle, data))
+        return True
+
+    def advance(self, now_us):
+        while self.next_event_us <= now_us:
+            if not self.queue:
+                skipped = (now_us - self.next_event_us) // self.interval_us + 1
+                self.next_event_us += skipped * self.interval_us
+                return
+            for _ in range(min(self.packets_per_event, len(self.queue))):
+                enqueued_us, _, data = self.queue.pop(0)
+                latency = self.next_event_us - enqueued_us
+                self.delivery_latency_us_total += latency
+                if latency > self.delivery_latency_us_max:
+                    self.delivery_latency_us_max = latency
+                self.delivered += 1
+                self.last_value = data
+            self.next_event_us += self.interval_us
+
+
+class BLE:
+    def __init__(self, queue_depth=DEFAULT_QUEUE_DEPTH):
+        self.queue_depth = queue_depth
+        self.now_us = 0
+        self.advertising = None
+        self.advertise_calls = 0
+        # advertising events and estimated radio time, up to the last time advertising was (re)started or stopped
+        self.advertising_events = 0
+        self.advertising_radio_us = 0
+        self._advertising_start_us = 0
+        self.scanning = None
+        self.writes = 0
+        self.notifications = 0
+        self.connects = 0
+        self.disconnects = 0
+        self._active = False
+        self._config = {'gap_name': b'MPY', 'mtu': 23}
+        self._handler = None
+        self._next_handle = 1
+        self._next_conn_handle = 0
+        self._values = {}
+        self._connections = {}
+
+    # ubluetooth API
+
+    def active(self, change=None):
+        if change is not None:
+            self._active = bool(change)
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        self.advertise_calls += 1
+        self._end_advertising()
+        self._advertising_start_us = self.now_us
+        if interval_us is None:
+            self.advertising = None
+        else:
+            self.advertising = (interval_us, bytes(adv_data) if adv_data else None,
+                                bytes(resp_data) if resp_data else None, connectable)
+
+    def gap_scan(self, duration_ms, interval_us=1280000, window_us=11250):
+        self.scanning = None if duration_ms is None else (duration_ms, interval_us, window_us)
+
+    def gap_disconnect(self, conn_handle):
+        if conn_handle not in self._connections:
+            return False
+        self.disconnect_central(conn_handle)
+        return True
+
+    def gatts_register_services(self, services_definition):
+        all_handles = []
+        for _, characteristics in services_definition:
+            self._next_handle += 1  # service declaration
+            handles = []
+            for characteristic in characteristics:
+                self._next_handle += 1  # characteristic declaration
+                handles.append(self._allocate_value_handle())
+                if len(characteristic) > 2:
+                    for _ in characteristic[2]:
+                        handles.append(self._allocate_value_handle())
+            all_handles.append(tuple(handles))
+        return tuple(all_handles)
+
+    def gatts_read(self, value_handle):
+        self._check_handle(value_handle)
+        return self._values[value_handle]
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self._check_handle(value_handle)
+        self.writes += 1
+        self._values[value_handle] = bytes(data)
+        if send_update:
+            # notified to the centrals subscribed to it
+            for connection in self._connections.values():
+                if value_handle in connection.subscriptions:
+                    self.notifications += 1
+                    connection.enqueue(value_handle, bytes(data), self.now_us)
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        self._check_handle(value_handle)
+        connection = self._connections.get(conn_handle)
+        if connection is None:
+            raise OSError('not connected')
+        if data is None:
+            data = self._values[value_handle]
+        self.notifications += 1
+        connection.enqueue(value_handle, bytes(data), self.now_us)
+
+    def gatts_set_buffer(self, value_handle, length, append=False):
+        self._check_handle(value_handle)
+
+    # simulation controls
+
+    def connect_central(self, addr_type=0, addr=None, interval_us=DEFAULT_CONNECTION_INTERVAL_US,
+                        packets_per_event=DEFAULT_PACKETS_PER_EVENT):
+        conn_handle = self._next_conn_handle
+        self._next_conn_handle += 1
+        self.connects += 1
+        # as the real stack does, advertising stops once a central connects
+        self._end_advertising()
+        self.advertising = None
+        if addr is None:
+            addr = conn_handle.to_bytes(6, 'little')
+        self._connections[conn_handle] = SimulatedConnection(conn_handle, addr_type, addr, self.queue_depth,
+                                                             interval_us, packets_per_event, self.now_us)
+        self._fire(IRQ_CENTRAL_CONNECT, (conn_handle, addr_type, addr))
+        return conn_handle
+
+    def update_connection(self, conn_handle, interval_us, latency=0, supervision_timeout_ms=4000):
+        """Connection parameter update initiated by the central"""
+        connection = self._connections[conn_handle]
+        # intervals are multiples of 1.25 ms
+        connection.interval_us = interval_us // 1250 * 1250
+        connection.latency = latency
+        connection.supervision_timeout_ms = supervision_timeout_ms
+        self._fire(IRQ_CONNECTION_UPDATE, (conn_handle, connection.interval_us // 1250, latency,
+                                           supervision_timeout_ms // 10, 0))
+
+    def disconnect_central(self, conn_handle):
+        connection = self._connections.pop(conn_handle)
+        self.disconnects += 1
+        self._fire(IRQ_CENTRAL_DISCONNECT, (conn_handle, connection.addr_type, connection.addr))
+
+    def exchange_mtu(self, conn_handle, mtu):
+        self._connections[conn_handle].mtu = mtu
+        self._fire(IRQ_MTU_EXCHANGED, (conn_handle, mtu))
+
+    def subscribe_central(self, conn_handle, value_handle, enabled=True):
+        """The central writes the CCCD the stack adds to every notify characteristic. The stack keeps it,
+        without raising any IRQ"""
+        self._check_handle(value_handle)
+        subscriptions = self._connections[conn_handle].subscriptions
+        if enabled:
+            subscriptions.add(value_handle)
+        else:
+            subscriptions.discard(value_handle)
+
+    def read_from_central(self, conn_handle, value_handle):
+        """Returns the value the central gets, as left by the read request IRQ handler"""
+        self._check_handle(value_handle)
+        self._fire(IRQ_GATTS_READ_REQUEST, (conn_handle, value_handle))
+        return self._values[value_handle]
+
+    def write_from_central(self, conn_handle, value_handle, data):
+        self._check_handle(value_handle)
+        self._values[value_handle] = bytes(data)
+        self._fire(IRQ_GATTS_WRITE, (conn_handle, value_handle))
+
+    def advertise_to_scanner(self, addr_type, addr, adv_data, rssi=-60, connectable=True):
+        """A peripheral advert received while scanning"""
+        if self.scanning is not None:
+            adv_type = ADV_IND if connectable else ADV_NONCONN_IND
+            self._fire(IRQ_SCAN_RESULT, (addr_type, memoryview(addr), adv_type, rssi, memoryview(adv_data)))
+
+    def complete_scan(self):
+        self.scanning = None
+        self._fire(IRQ_SCAN_DONE, ())
+
+    def connection(self, conn_handle):
+        return self._connections[conn_handle]
+
+    def connections(self):
+        return list(self._connections.values())
+
+    def next_advertising_event_us(self):
+        """Time of the next advertising event (now if one is due), None while not advertising"""
+        if self.advertising is None:
+            return None
+        return self._advertising_start_us + self._advertising_events_since_start() * self.advertising[0]
+
+    def advertising_duty_cycle(self):
+        """Estimated fraction of the time, so far, the radio has been on for advertising"""
+        radio_us = self.advertising_radio_us
+        if self.advertising is not None:
+            radio_us += self._advertising_events_since_start() * self._advertising_event_us()
+        return radio_us / self.now_us if self.now_us else 0
+
+    def advance(self, now_us):
+        """Moves the simulated time forward, delivering the queued notifications at each connection event"""
+        self.now_us = now_us
+        for connection in self._connections.values():
+            connection.advance(now_us)
+
+    def _advertising_events_since_start(self):
+        # sent in [start, now), the first one right at the start
+        return -(-(self.now_us - self._advertising_start_us) // self.advertising[0])
+
+    def _advertising_event_us(self):
+        adv_data = self.advertising[1] or b''
+        pdu_us = 8 * (_ADVERTISING_PDU_OVERHEAD_BYTES + len(adv_data))
+        return _ADVERTISING_CHANNELS * (pdu_us + _ADVERTISING_CHANNEL_RX_US)
+
+    def _end_advertising(self):
+        if self.advertising is not None:
+            events = self._advertising_events_since_start()
+            self.advertising_events += events
+            self.advertising_radio_us += events * self._advertising_event_us()
+
+    def _allocate_value_handle(self):
+        handle = self._next_handle
+        self._next_handle += 1
+        self._values[handle] = b''
+        return handle
+
+    def _check_handle(self, value_handle):
+        if value_handle not in self._values:
+            raise OSError('invalid handle')
+
+    def _fire(self, event, data):
+        if self._handler is not None:
+            self._handler(event, data)
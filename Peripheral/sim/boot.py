@@ -0,0 +1,40 @@
+"""
+    Boot timing of main.py on the simulated stack: time to the first advert, and to the first refresh
+
+    From the Peripheral folder (--build takes the precompiled modules from build/, see build.sh):
+
+        micropython -m sim.boot [--json] [--build]
+        python3 -m sim.boot [--json]
+"""
+import sys
+import json
+from sim import install
+
+install()
+
+if 'py' not in sys.path:
+    sys.path.append('py')
+
+
+def run():
+    """Boots main.py (it can only be done once per process) and runs the first refresh,
+    returning the time (in us) to each boot step, since main.py started"""
+    import machine
+    import main
+    battery_service, _ = main.boot()
+    machine.timers[-1].fire()
+    main.boot_profile.mark('first_refresh')
+    report = main.boot_profile.report()
+    report['advertising_started'] = battery_service.bt.advertising is not None
+    return report
+
+
+if __name__ == '__main__':
+    if '--build' in sys.argv:
+        sys.path.insert(0, 'build')
+    report = run()
+    if '--json' in sys.argv:
+        print(json.dumps(report))
+    else:
+        for step, elapsed in sorted(report.items(), key=lambda item: item[1]):
+            print('%s: %s' % (step, elapsed))
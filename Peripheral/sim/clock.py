@@ -0,0 +1,43 @@
+"""
+    Virtual clock, registered by sim.install as the `time` module: the ticks_* functions read the simulated time,
+    moved forward by the simulator
+"""
+import time as _wall_time
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF_PERIOD = _TICKS_PERIOD // 2
+
+
+class VirtualClock:
+
+    def __init__(self, start_us=0):
+        self.now_us = start_us
+
+    def ticks_us(self):
+        return self.now_us & _TICKS_MAX
+
+    def ticks_ms(self):
+        return (self.now_us // 1000) & _TICKS_MAX
+
+    def ticks_add(self, ticks, delta):
+        return (ticks + delta) & _TICKS_MAX
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ((ticks1 - ticks2 + _TICKS_HALF_PERIOD) & _TICKS_MAX) - _TICKS_HALF_PERIOD
+
+    def time(self):
+        return self.now_us // 1000000
+
+    def sleep_us(self, us):
+        self.now_us += us
+
+    def sleep_ms(self, ms):
+        self.now_us += ms * 1000
+
+    def sleep(self, seconds):
+        self.now_us += int(seconds * 1000000)
+
+    def __getattr__(self, name):
+        # anything else (e.g. perf_counter for the test runner) is the wall clock one
+        return getattr(_wall_time, name)
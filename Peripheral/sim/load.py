@@ -0,0 +1,88 @@
+"""
+    Multi-central load harness for BatteryService, running on the simulated BLE stack
+
+    From the Peripheral folder:
+
+        micropython -m sim.load [centrals] [rate_hz] [duration_s]
+        python3 -m sim.load [centrals] [rate_hz] [duration_s]
+"""
+import sys
+from sim import install
+
+install()
+
+if 'py' not in sys.path:
+    sys.path.append('py')
+
+from time import ticks_us, ticks_diff
+from sim.ble import BLE, DEFAULT_QUEUE_DEPTH, DEFAULT_CONNECTION_INTERVAL_US, DEFAULT_PACKETS_PER_EVENT
+from ble_service import BatteryService
+
+
+def sawtooth(update):
+    return update % 101
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(centrals=5, rate_hz=10, duration_s=10, queue_depth=DEFAULT_QUEUE_DEPTH,
+        interval_us=DEFAULT_CONNECTION_INTERVAL_US, packets_per_event=DEFAULT_PACKETS_PER_EVENT,
+        waveform=sawtooth, service_factory=None):
+    """Drives set_battery_level_percentage at rate_hz (simulated time) against the given number of centrals"""
+    ble = BLE(queue_depth=queue_depth)
+    if service_factory is None:
+        service = BatteryService(ble, max_connections=centrals)
+    else:
+        service = service_factory(ble)
+    service.register_services()
+    service.start()
+    for _ in range(centrals):
+        ble.connect_central(interval_us=interval_us, packets_per_event=packets_per_event)
+
+    updates = int(rate_hz * duration_s)
+    period_us = 1000000 // rate_hz
+    latencies = []
+    for update in range(updates):
+        ble.advance(update * period_us)
+        level = waveform(update)
+        start = ticks_us()
+        service.set_battery_level_percentage(level)
+        latencies.append(ticks_diff(ticks_us(), start))
+    ble.advance(updates * period_us)
+
+    connections = ble.connections()
+    notified = sum(c.notified for c in connections)
+    delivered = sum(c.delivered for c in connections)
+    dropped = sum(c.dropped for c in connections)
+    latency_total = sum(latencies)
+    latencies.sort()
+    return {
+        'centrals': centrals,
+        'rate_hz': rate_hz,
+        'duration_s': duration_s,
+        'updates': updates,
+        'notified': notified,
+        'delivered': delivered,
+        'dropped': dropped,
+        'pending': notified - delivered - dropped,
+        'notify_throughput_per_s': notified * 1000000 // latency_total if latency_total else 0,
+        'update_latency_us_avg': latency_total // updates if updates else 0,
+        'update_latency_us_p50': _percentile(latencies, 0.5) if latencies else 0,
+        'update_latency_us_p99': _percentile(latencies, 0.99) if latencies else 0,
+        'update_latency_us_max': latencies[-1] if latencies else 0,
+        'delivery_latency_us_avg': sum(c.delivery_latency_us_total for c in connections) // delivered
+        if delivered else 0,
+        'delivery_latency_us_max': max([c.delivery_latency_us_max for c in connections] + [0]),
+    }
+
+
+def print_report(report):
+    for key in sorted(report):
+        print('%s: %s' % (key, report[key]))
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:4]]
+    print_report(run(*args))
@@ -0,0 +1,91 @@
+"""
+    Simulated machine module: the Pin, ADC and Timer subset used by the peripheral
+"""
+
+timers = []
+# sim.simulator.Simulator running the timers on its virtual clock, when None they are fired manually
+simulator = None
+# function returning the reading of the ADC on the given pin (e.g. a scripted waveform), when None ADC.value is read
+adc_source = None
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+
+    def __init__(self, pin_id, mode=None):
+        self.pin_id = pin_id
+        self.mode = mode
+        self._value = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_11DB = 3
+    WIDTH_9BIT = 0
+    WIDTH_12BIT = 3
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.attenuation = None
+        self.bits = None
+        self.value = 0
+
+    def atten(self, attenuation):
+        self.attenuation = attenuation
+
+    def width(self, bits):
+        self.bits = bits
+
+    def read(self):
+        if adc_source is not None:
+            return adc_source(self.pin.pin_id)
+        return self.value
+
+
+class Timer:
+    """Without a simulator, callbacks are not run on their own: fire() runs them (simulation control)"""
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, timer_id):
+        self.timer_id = timer_id
+        self.period = None
+        self.mode = None
+        self.callback = None
+        self.expirations = 0
+        self._generation = 0
+        timers.append(self)
+
+    def init(self, period=None, mode=PERIODIC, callback=None):
+        self.period = period
+        self.mode = mode
+        self.callback = callback
+        self._generation += 1
+        if simulator is not None and callback is not None:
+            simulator.after(period * 1000, self._expire, self._generation)
+
+    def deinit(self):
+        self.callback = None
+        self._generation += 1
+
+    def _expire(self, generation):
+        if generation != self._generation:
+            # re-initialised or deinitialised since scheduled
+            return
+        self.expirations += 1
+        if self.mode == Timer.PERIODIC:
+            simulator.after(self.period * 1000, self._expire, generation)
+        self.fire()
+
+    def fire(self):
+        callback = self.callback
+        if self.mode == Timer.ONE_SHOT:
+            self.callback = None
+        if callback is not None:
+            callback(self)
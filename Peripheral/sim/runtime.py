@@ -0,0 +1,40 @@
+"""
+    Minimal stand-ins for the micropython-only runtime APIs, used when running on CPython
+"""
+from time import perf_counter_ns
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF_PERIOD = _TICKS_PERIOD // 2
+
+
+def const(value):
+    return value
+
+
+def schedule(function, arg):
+    """Runs the function right away, there are no IRQs to leave on CPython"""
+    function(arg)
+
+
+def ticks_us():
+    return (perf_counter_ns() // 1000) & _TICKS_MAX
+
+
+def ticks_ms():
+    return (perf_counter_ns() // 1000000) & _TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + _TICKS_HALF_PERIOD) & _TICKS_MAX) - _TICKS_HALF_PERIOD
+
+
+def patch_time(time_module):
+    time_module.ticks_us = ticks_us
+    time_module.ticks_ms = ticks_ms
+    time_module.ticks_add = ticks_add
+    time_module.ticks_diff = ticks_diff
@@ -0,0 +1,177 @@
+"""
+    Deterministic discrete-event simulator: timers, ADC readings and central connections run on a virtual clock,
+    so days of operation take seconds
+
+    From the Peripheral folder:
+
+        micropython -m sim.simulator [days] [centrals]
+        python3 -m sim.simulator [days] [centrals]
+"""
+import sys
+from sim import install
+from sim.clock import VirtualClock
+
+if __name__ == '__main__':
+    install(VirtualClock())
+
+if 'py' not in sys.path:
+    sys.path.append('py')
+
+from heapq import heappush, heappop
+from sim import machine
+
+_SECOND_US = 1000000
+_DAY_US = 86400 * _SECOND_US
+# a central scanning while the peripheral does not advertise looks for it again after this
+_SCAN_RETRY_US = _SECOND_US
+
+
+class Simulator:
+    """Events are (time, order of scheduling) ordered, so a run is fully determined by its inputs"""
+
+    def __init__(self, clock, ble=None):
+        self.clock = clock
+        self.ble = ble
+        self._events = []
+        self._scheduled = 0
+        self.events = 0
+        machine.simulator = self
+
+    def at(self, time_us, action, *args):
+        heappush(self._events, (time_us, self._scheduled, action, args))
+        self._scheduled += 1
+
+    def after(self, delay_us, action, *args):
+        self.at(self.clock.now_us + delay_us, action, *args)
+
+    def pending(self):
+        return len(self._events)
+
+    def run(self, until_us):
+        """Runs the events due until the given time, leaving the clock there"""
+        while self._events and self._events[0][0] <= until_us:
+            time_us, _, action, args = heappop(self._events)
+            self._move_to(time_us)
+            action(*args)
+            self.events += 1
+        self._move_to(until_us)
+
+    def close(self):
+        machine.simulator = None
+        machine.adc_source = None
+
+    def _move_to(self, time_us):
+        self.clock.now_us = time_us
+        if self.ble is not None:
+            self.ble.advance(time_us)
+
+
+def discharge_waveform(clock, upper_limit, period_s=86400, noise=2, seed=1):
+    """ADC readings discharging linearly from upper_limit to 0 every period_s (then recharged at once),
+    with a deterministic pseudo-random noise of +-noise LSB"""
+    state = [seed]
+
+    def read(pin_id):
+        state[0] = (state[0] * 1103515245 + 12345) & 0x7FFFFFFF
+        elapsed = (clock.now_us // _SECOND_US) % period_s
+        level = upper_limit - upper_limit * elapsed // period_s
+        return min(max(level + state[0] % (2 * noise + 1) - noise, 0), upper_limit)
+    return read
+
+
+def schedule_sessions(simulator, ble, sessions, reconnect_us=None, on_connect=None):
+    """A central starts scanning at each of the given (connect_s, duration_s) sessions, connecting on the first
+    advertising event (it scans continuously) and disconnecting duration_s later.
+    The time from scanning to connecting of every session is appended to reconnect_us, if given.
+    on_connect(conn_handle) plays the central once connected (e.g. subscribing to notifications)"""
+    for connect_s, duration_s in sessions:
+        simulator.at(connect_s * _SECOND_US, _scan, simulator, ble, duration_s, connect_s * _SECOND_US, reconnect_us,
+                     on_connect)
+
+
+def _scan(simulator, ble, duration_s, start_us, reconnect_us, on_connect):
+    event_us = ble.next_advertising_event_us()
+    if event_us is None:
+        simulator.after(_SCAN_RETRY_US, _scan, simulator, ble, duration_s, start_us, reconnect_us, on_connect)
+    elif event_us > simulator.clock.now_us:
+        # checked again then, advertising may have been restarted meanwhile
+        simulator.at(event_us, _scan, simulator, ble, duration_s, start_us, reconnect_us, on_connect)
+    else:
+        conn_handle = ble.connect_central()
+        if reconnect_us is not None:
+            reconnect_us.append(simulator.clock.now_us - start_us)
+        if on_connect is not None:
+            on_connect(conn_handle)
+        simulator.after(duration_s * _SECOND_US, ble.disconnect_central, conn_handle)
+
+
+def subscriber(ble, battery_service):
+    """Plays a central reading the battery level and then enabling its notifications, in the CCCD kept by the
+    stack (as every central does)"""
+
+    def on_connect(conn_handle):
+        ble.read_from_central(conn_handle, battery_service.battery_level_value_handle)
+        ble.subscribe_central(conn_handle, battery_service.battery_level_value_handle)
+    return on_connect
+
+
+def daily_sessions(days, centrals, session_s=600, sessions_per_day=6):
+    """Every central connects sessions_per_day times a day, each central shifted from the previous one"""
+    sessions = []
+    spacing_s = 86400 // sessions_per_day
+    for day in range(days):
+        for session in range(sessions_per_day):
+            for central in range(centrals):
+                start_s = day * 86400 + session * spacing_s + central * spacing_s // (centrals + 1)
+                sessions.append((start_s, session_s))
+    return sessions
+
+
+def run(days=7, centrals=2, session_s=600, sessions_per_day=6):
+    """Boots main.py (once per process, on the virtual clock installed as `time`) and runs it for the given days"""
+    from time import time as simulated_time
+    clock = sys.modules['time']
+    if not isinstance(clock, VirtualClock):
+        raise RuntimeError('sim.install(VirtualClock()) must be called before importing the peripheral modules')
+    wall_start = clock.perf_counter() if hasattr(clock, 'perf_counter') else 0
+    simulator = Simulator(clock)
+    adc_reads = [0]
+    reconnect_us = []
+    import main
+    waveform = discharge_waveform(clock, main._ADC_UPPER_LIMIT)
+
+    def adc_source(pin_id):
+        adc_reads[0] += 1
+        return waveform(pin_id)
+
+    machine.adc_source = adc_source
+    battery_service, scheduler = main.boot()
+    ble = battery_service.bt
+    simulator.ble = ble
+    schedule_sessions(simulator, ble, daily_sessions(days, centrals, session_s, sessions_per_day), reconnect_us,
+                      subscriber(ble, battery_service))
+    simulator.run(days * _DAY_US)
+    simulator.close()
+    wall_s = (clock.perf_counter() - wall_start) if hasattr(clock, 'perf_counter') else None
+    return {
+        'simulated_s': simulated_time(),
+        'wall_s': wall_s,
+        'events': simulator.events,
+        'wakeups': scheduler.wakeups,
+        'changes': scheduler.changes,
+        'adc_reads': adc_reads[0],
+        'connects': ble.connects,
+        'disconnects': ble.disconnects,
+        'notifications': ble.notifications,
+        'history_readings': len(main.history),
+        'reconnect_ms_avg': sum(reconnect_us) // len(reconnect_us) // 1000 if reconnect_us else None,
+        'reconnect_ms_max': max(reconnect_us) // 1000 if reconnect_us else None,
+        'advertising_events': ble.advertising_events,
+        'advertising_duty_cycle': ble.advertising_duty_cycle(),
+    }
+
+
+if __name__ == '__main__':
+    report = run(*[int(a) for a in sys.argv[1:3]])
+    for key in sorted(report):
+        print('%s: %s' % (key, report[key]))
@@ -0,0 +1,162 @@
+"""
+    Unit Tests for the simulated BLE stack
+"""
+
+import unittest
+from sim.ble import BLE, UUID, FLAG_READ, FLAG_NOTIFY, IRQ_CENTRAL_CONNECT, IRQ_CENTRAL_DISCONNECT, IRQ_SCAN_RESULT, \
+    IRQ_SCAN_DONE, IRQ_MTU_EXCHANGED, IRQ_CONNECTION_UPDATE, IRQ_GATTS_READ_REQUEST
+
+_BATTERY_SERVICE = (UUID(0x180F), ((UUID(0x2A19), FLAG_NOTIFY | FLAG_READ,),),)
+
+
+class IrqRecorder:
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event, data):
+        self.events.append((event, data))
+
+
+class UUIDTestCase(unittest.TestCase):
+    def test_should_store_16_bit_uuid_little_endian(self):
+        self.assertEqual(bytes(UUID(0x180F)), b'\x0f\x18')
+
+    def test_should_store_32_bit_uuid(self):
+        self.assertEqual(len(bytes(UUID(0x12345678))), 4)
+
+    def test_should_store_128_bit_uuid_reversed(self):
+        uuid = UUID('6E400001-B5A3-F393-E0A9-E50E24DCCA9E')
+        self.assertEqual(len(bytes(uuid)), 16)
+        self.assertEqual(bytes(uuid)[0], 0x9E)
+        self.assertEqual(bytes(uuid)[15], 0x6E)
+
+    def test_should_compare_equal(self):
+        self.assertEqual(UUID(0x180F), UUID(0x180F))
+        self.assertNotEqual(UUID(0x180F), UUID(0x2A19))
+
+
+class SimulatedBLETestCase(unittest.TestCase):
+    def setUp(self):
+        self.ble = BLE(queue_depth=2)
+        self.irqs = IrqRecorder()
+        self.ble.irq(self.irqs)
+        ((self.handle,),) = self.ble.gatts_register_services((_BATTERY_SERVICE,))
+
+    def test_should_register_services_and_store_values(self):
+        self.ble.gatts_write(self.handle, b'\x32')
+        self.assertEqual(self.ble.gatts_read(self.handle), b'\x32')
+
+    def test_should_return_descriptor_handles_after_characteristic(self):
+        services = ((UUID(0x180F), ((UUID(0x2A19), FLAG_READ, ((UUID(0x2904), FLAG_READ),)),)),)
+        ((value_handle, descriptor_handle),) = self.ble.gatts_register_services(services)
+        self.assertEqual(descriptor_handle, value_handle + 1)
+
+    def test_should_raise_on_unknown_handle(self):
+        with self.assertRaises(OSError):
+            self.ble.gatts_write(9999, b'\x00')
+
+    def test_should_fire_connect_and_disconnect_irqs(self):
+        conn_handle = self.ble.connect_central()
+        self.ble.disconnect_central(conn_handle)
+        self.assertEqual(self.irqs.events[0][0], IRQ_CENTRAL_CONNECT)
+        self.assertEqual(self.irqs.events[0][1][0], conn_handle)
+        self.assertEqual(self.irqs.events[1][0], IRQ_CENTRAL_DISCONNECT)
+
+    def test_should_fire_mtu_exchanged_irq(self):
+        conn_handle = self.ble.connect_central()
+        self.ble.exchange_mtu(conn_handle, 185)
+        self.assertEqual(self.irqs.events[1], (IRQ_MTU_EXCHANGED, (conn_handle, 185)))
+        self.assertEqual(self.ble.connection(conn_handle).mtu, 185)
+
+    def test_should_raise_on_notify_to_unknown_connection(self):
+        with self.assertRaises(OSError):
+            self.ble.gatts_notify(12, self.handle, b'\x01')
+
+    def test_should_notify_written_values_to_subscribed_centrals(self):
+        subscribed = self.ble.connect_central()
+        other = self.ble.connect_central()
+        self.ble.subscribe_central(subscribed, self.handle)
+        self.ble.gatts_write(self.handle, b'\x32', True)
+        self.ble.gatts_write(self.handle, b'\x33')
+        self.assertEqual(self.ble.connection(subscribed).notified, 1)
+        self.assertEqual(self.ble.connection(other).notified, 0)
+        self.assertEqual(len(self.irqs.events), 2)
+        self.ble.subscribe_central(subscribed, self.handle, False)
+        self.ble.gatts_write(self.handle, b'\x34', True)
+        self.assertEqual(self.ble.connection(subscribed).notified, 1)
+
+    def test_should_drop_notifications_when_queue_is_full(self):
+        conn_handle = self.ble.connect_central()
+        for value in range(3):
+            self.ble.gatts_notify(conn_handle, self.handle, bytes((value,)))
+        connection = self.ble.connection(conn_handle)
+        self.assertEqual(connection.notified, 3)
+        self.assertEqual(connection.dropped, 1)
+        self.assertEqual(len(connection.queue), 2)
+
+    def test_should_deliver_queued_notifications_on_connection_events(self):
+        conn_handle = self.ble.connect_central(interval_us=1000, packets_per_event=1)
+        self.ble.gatts_notify(conn_handle, self.handle, b'\x01')
+        self.ble.gatts_notify(conn_handle, self.handle, b'\x02')
+        self.ble.advance(1000)
+        connection = self.ble.connection(conn_handle)
+        self.assertEqual(connection.delivered, 1)
+        self.ble.advance(2000)
+        self.assertEqual(connection.delivered, 2)
+        self.assertEqual(connection.last_value, b'\x02')
+        self.assertEqual(connection.delivery_latency_us_max, 2000)
+
+    def test_should_record_advertising(self):
+        self.ble.gap_advertise(500000, adv_data=b'\x02\x01\x06')
+        self.assertEqual(self.ble.advertising[0], 500000)
+        self.ble.gap_advertise(None)
+        self.assertIsNone(self.ble.advertising)
+
+    def test_should_update_connection_parameters(self):
+        conn_handle = self.ble.connect_central()
+        self.ble.update_connection(conn_handle, 800000, 4, 10000)
+        connection = self.ble.connection(conn_handle)
+        self.assertEqual((connection.interval_us, connection.latency), (800000, 4))
+        self.assertEqual(self.irqs.events[-1], (IRQ_CONNECTION_UPDATE, (conn_handle, 640, 4, 1000, 0)))
+
+    def test_should_fire_read_requests_before_answering(self):
+        value_handle = self.ble.gatts_register_services((_BATTERY_SERVICE,))[0][0]
+        conn_handle = self.ble.connect_central()
+        self.ble.irq(lambda event, data: self.ble.gatts_write(data[1], b'\x4d'))
+        self.assertEqual(self.ble.read_from_central(conn_handle, value_handle), b'\x4d')
+
+    def test_should_stop_advertising_on_connection(self):
+        self.ble.gap_advertise(500000, adv_data=b'\x02\x01\x06')
+        self.ble.connect_central()
+        self.assertIsNone(self.ble.advertising)
+
+    def test_should_tell_next_advertising_event(self):
+        self.assertIsNone(self.ble.next_advertising_event_us())
+        self.ble.gap_advertise(100000, adv_data=b'\x02\x01\x06')
+        self.assertEqual(self.ble.next_advertising_event_us(), 0)
+        self.ble.advance(250000)
+        self.assertEqual(self.ble.next_advertising_event_us(), 300000)
+
+    def test_should_estimate_advertising_duty_cycle(self):
+        self.ble.gap_advertise(100000, adv_data=b'\x02\x01\x06')
+        self.ble.advance(1000000)
+        self.ble.gap_advertise(None)
+        self.ble.advance(2000000)
+        self.assertEqual(self.ble.advertising_events, 10)
+        # 3 channels x (8 us x (16 + 3) bytes + 150 us)
+        self.assertEqual(self.ble.advertising_radio_us, 10 * 3 * (8 * 19 + 150))
+        self.assertAlmostEqual(self.ble.advertising_duty_cycle(), 10 * 906 / 2000000)
+
+    def test_should_deliver_adverts_only_while_scanning(self):
+        self.ble.advertise_to_scanner(0, b'\x01' * 6, b'\x02\x01\x06')
+        self.assertEqual(self.irqs.events, [])
+        self.ble.gap_scan(1000)
+        self.ble.advertise_to_scanner(0, b'\x01' * 6, b'\x02\x01\x06')
+        self.ble.complete_scan()
+        self.assertEqual(self.irqs.events[0][0], IRQ_SCAN_RESULT)
+        self.assertEqual(bytes(self.irqs.events[0][1][4]), b'\x02\x01\x06')
+        self.assertEqual(self.irqs.events[1][0], IRQ_SCAN_DONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+"""
+    Unit Tests for the boot timing of main.py on the simulated stack
+"""
+
+import unittest
+from sim import install
+
+install()
+
+from sim.boot import run
+
+
+class BootTestCase(unittest.TestCase):
+    def test_should_advertise_before_creating_the_voltage_reader(self):
+        report = run()
+        self.assertTrue(report['advertising_started'])
+        self.assertLessEqual(report['imports'], report['advertising'])
+        self.assertLessEqual(report['advertising'], report['voltage_reader'])
+        self.assertLessEqual(report['voltage_reader'], report['boot'])
+        self.assertLessEqual(report['boot'], report['first_refresh'])
+
+
+if __name__ == '__main__':
+    unittest.main()
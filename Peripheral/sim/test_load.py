@@ -0,0 +1,28 @@
+"""
+    Unit Tests for the load harness
+"""
+
+import unittest
+from sim.load import run
+
+
+class LoadHarnessTestCase(unittest.TestCase):
+    def test_should_notify_every_central_on_every_update(self):
+        report = run(centrals=5, rate_hz=10, duration_s=2)
+        self.assertEqual(report['updates'], 20)
+        self.assertEqual(report['notified'], 100)
+        self.assertEqual(report['dropped'], 0)
+
+    def test_should_report_dropped_notifications_when_rate_exceeds_link_capacity(self):
+        report = run(centrals=3, rate_hz=1000, duration_s=1, queue_depth=4, interval_us=50000, packets_per_event=1)
+        self.assertTrue(report['dropped'] > 0)
+        self.assertEqual(report['notified'], report['delivered'] + report['dropped'] + report['pending'])
+
+    def test_should_report_latencies(self):
+        report = run(centrals=2, rate_hz=10, duration_s=1)
+        self.assertTrue(report['update_latency_us_max'] >= report['update_latency_us_p50'])
+        self.assertTrue(report['delivery_latency_us_avg'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+    Unit Tests for the discrete-event simulator
+"""
+
+from sim import install
+from sim.clock import VirtualClock
+
+# before any peripheral module is imported, so they take the virtual ticks_* functions
+install(VirtualClock())
+
+import unittest
+from sim import machine
+from sim.ble import BLE
+from sim.simulator import Simulator, discharge_waveform, daily_sessions, schedule_sessions, run
+
+
+class SimulatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.simulator = Simulator(self.clock)
+        self.log = []
+
+    def tearDown(self):
+        self.simulator.close()
+
+    def _log(self, name):
+        self.log.append((name, self.clock.now_us))
+
+    def test_should_run_events_in_time_order(self):
+        self.simulator.at(300, self._log, 'c')
+        self.simulator.at(100, self._log, 'a')
+        self.simulator.at(100, self._log, 'b')
+        self.simulator.run(1000)
+        self.assertEqual(self.log, [('a', 100), ('b', 100), ('c', 300)])
+        self.assertEqual(self.clock.now_us, 1000)
+        self.assertEqual(self.simulator.events, 3)
+
+    def test_should_leave_later_events_pending(self):
+        self.simulator.at(2000, self._log, 'late')
+        self.simulator.run(1000)
+        self.assertEqual(self.log, [])
+        self.assertEqual(self.simulator.pending(), 1)
+
+    def test_should_run_one_shot_timers_on_virtual_clock(self):
+        timer = machine.Timer(-1)
+        timer.init(period=50, mode=machine.Timer.ONE_SHOT, callback=lambda t: self._log('timer'))
+        self.simulator.run(1000000)
+        self.assertEqual(self.log, [('timer', 50000)])
+
+    def test_should_run_periodic_timers_on_virtual_clock(self):
+        timer = machine.Timer(-1)
+        timer.init(period=100, mode=machine.Timer.PERIODIC, callback=lambda t: self._log('tick'))
+        self.simulator.run(1000000)
+        self.assertEqual(len(self.log), 10)
+        timer.deinit()
+        self.simulator.run(2000000)
+        self.assertEqual(len(self.log), 10)
+
+    def test_should_cancel_timer_on_reinit(self):
+        timer = machine.Timer(-1)
+        timer.init(period=100, mode=machine.Timer.ONE_SHOT, callback=lambda t: self._log('first'))
+        timer.init(period=200, mode=machine.Timer.ONE_SHOT, callback=lambda t: self._log('second'))
+        self.simulator.run(1000000)
+        self.assertEqual(self.log, [('second', 200000)])
+
+    def test_should_read_adc_from_waveform(self):
+        machine.adc_source = discharge_waveform(self.clock, 511, period_s=100, noise=0)
+        adc = machine.ADC(machine.Pin(32))
+        self.assertEqual(adc.read(), 511)
+        self.clock.now_us = 50 * 1000000
+        self.assertEqual(adc.read(), 256)
+
+    def test_should_schedule_daily_sessions(self):
+        sessions = daily_sessions(2, 2, session_s=60, sessions_per_day=4)
+        self.assertEqual(len(sessions), 16)
+        self.assertEqual(sessions[:2], [(0, 60), (7200, 60)])
+
+    def test_should_connect_centrals_on_advertising_events(self):
+        ble = BLE()
+        self.simulator.ble = ble
+        ble.gap_advertise(300000, adv_data=b'\x02\x01\x06')
+        reconnect_us = []
+        schedule_sessions(self.simulator, ble, [(1, 10)], reconnect_us)
+        self.simulator.run(2000000)
+        self.assertEqual(reconnect_us, [200000])
+        self.assertEqual(len(ble.connections()), 1)
+        self.simulator.run(20000000)
+        self.assertEqual(ble.disconnects, 1)
+
+    def test_should_wait_for_advertising_to_connect(self):
+        ble = BLE()
+        self.simulator.ble = ble
+        reconnect_us = []
+        schedule_sessions(self.simulator, ble, [(0, 10)], reconnect_us)
+        self.simulator.run(2500000)
+        ble.gap_advertise(100000, adv_data=b'\x02\x01\x06')
+        self.simulator.run(5000000)
+        self.assertEqual(reconnect_us, [3000000])
+
+
+class SoakTestCase(unittest.TestCase):
+    def test_should_run_days_of_operation(self):
+        report = run(days=2, centrals=1, session_s=600, sessions_per_day=4)
+        self.assertEqual(report['simulated_s'], 2 * 86400)
+        self.assertEqual(report['connects'], 8)
+        self.assertEqual(report['disconnects'], 8)
+        # at least every idle heartbeat, but well below a wake-up a minute while no central is notified
+        self.assertTrue(2 * 86400 // 600 <= report['wakeups'] < 2 * 86400 // 60)
+        self.assertTrue(report['notifications'] > 0)
+        self.assertTrue(report['adc_reads'] > 0)
+        self.assertTrue(report['reconnect_ms_max'] <= 1300)
+        self.assertTrue(0 < report['advertising_duty_cycle'] < 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 #!/bin/bash
 
-for f in $(ls py/test_*.py)
+export MICROPYPATH="$(pwd):$(pwd)/py:${MICROPYPATH:-.frozen:~/.micropython/lib:/usr/lib/micropython}"
+
+for f in $(ls py/test_*.py sim/test_*.py)
 do
   echo Running $f tests...
   micropython $f
   if [ $? -ne 0 ]; then
     break
   fi
-done
\ No newline at end of file
+done